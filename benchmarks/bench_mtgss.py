@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the optimisation pipeline on synthetic decks and catalogues.
+
+Times pruning dominated listings, building the ensembles and the lookup
+tables of the cost calculator (reporting their size), costing single
+ensembles and whole populations, a generation of the genetic algorithm, a full
+SupplierSelector.run and a large neighbourhood search given the same time, and
+reports throughput, peak memory and the final cost relative to the optimum
+found by the integer program. Runs offline:
+
+    python benchmarks/bench_mtgss.py --cards 60 --sellers 100 --sellers-per-card 20
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+import numpy as np
+import mtgss.tools as t
+from mtgss import synthetic
+from mtgss.mtgss import SupplierSelector
+from mtgss.optimisation import GeneticAlgorithm, IntegerProgram
+
+def measure(func, repeat = 1):
+    """return result of func(), mean seconds per call and peak memory in MB"""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(repeat):
+            result = func()
+    seconds = (time.perf_counter() - start) / repeat
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def run_benchmarks(num_cards = 60, max_copies = 4, num_sellers = 100, sellers_per_card = 20,
+                   mean_stock = 3, price_spread = 0.5, N = 8000, num_iterations = 50,
+                   random_state = 0) -> dict:
+    """run all benchmarks on one synthetic deck and return their results"""
+
+    cardlist = synthetic.generate_cardlist(num_cards, max_copies, random_state)
+    suppliers_allcards = synthetic.generate_suppliers(cardlist, num_sellers, sellers_per_card,
+                                                      mean_stock, price_spread = price_spread,
+                                                      random_state = random_state)
+    results = {}
+
+    (_, report), seconds, peak = measure(lambda: t.prune_suppliers(cardlist, suppliers_allcards))
+    results['prune_suppliers'] = {'seconds': seconds, 'peak_MB': peak,
+                                  'listings_before': report['listings_before'],
+                                  'listings_after': report['listings_after'],
+                                  'sellers_after': report['sellers_after']}
+
+    ensembles, seconds, peak = measure(lambda: t.get_dict_of_all_ensembles(cardlist, suppliers_allcards))
+    results['get_dict_of_all_ensembles'] = {'seconds': seconds, 'peak_MB': peak,
+                                            'configurations': sum(len(e) for e in ensembles.values())}
+
+    #lookup tables of every configuration, see CostCalculator._build_lookup_tables
+    cost_calculator, seconds, peak = measure(lambda: t.CostCalculator(suppliers_allcards, ensembles))
+    tables = [cost_calculator.config_listings, cost_calculator.config_costs, 
+              cost_calculator.config_distinct_supplier_ids, cost_calculator.config_distinct_subtotals,
+              cost_calculator.config_distinct_items]
+    table_bytes = sum(array.nbytes for table in tables for array in table)
+    results['CostCalculator'] = {'seconds': seconds, 'peak_MB': peak, 'tables_MB': table_bytes / 2**20,
+                                 'bytes_per_configuration': table_bytes / sum(cost_calculator.ensemble_sizes)}
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    population = np.random.default_rng(random_state).integers(0, bounds + 1, (N, len(bounds)))
+
+    _, seconds, peak = measure(lambda: [cost_calculator.get_cost(p) for p in population[:1000]])
+    results['CostCalculator.get_cost'] = {'seconds': seconds, 'peak_MB': peak,
+                                          'individuals_per_second': 1000 / seconds}
+    _, seconds, peak = measure(lambda: cost_calculator.get_cost_batch(population), 5)
+    results['CostCalculator.get_cost_batch'] = {'seconds': seconds, 'peak_MB': peak,
+                                                'individuals_per_second': N / seconds}
+
+    model = GeneticAlgorithm(cost_calculator.get_total_cost_batch, bounds, N = N,
+                             vectorised = True, random_state = random_state, seed = population)
+    _, seconds, peak = measure(lambda: next(model), 10)
+    results['GeneticAlgorithm.__next__'] = {'seconds': seconds, 'peak_MB': peak,
+                                            'individuals_per_second': N / seconds}
+
+    program = IntegerProgram(cost_calculator)
+    _, seconds, peak = measure(program.solve)
+    results['IntegerProgram.solve'] = {'seconds': seconds, 'peak_MB': peak, 'cost': program.cost}
+
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                all_ensembles_dict = ensembles)
+    _, seconds, peak = measure(lambda: selector.run(num_iterations, N = N, random_state = random_state))
+    cost = sum(selector.cost_calculator.get_cost(selector.model.get_solution()))
+    results['SupplierSelector.run'] = {'seconds': seconds, 'peak_MB': peak,
+                                       'individuals_per_second': N * num_iterations / seconds,
+                                       'cost': cost,
+                                       'excess_over_optimum': cost / program.cost - 1}
+    
+    #large neighbourhood search given the same time as the genetic algorithm
+    _, seconds, peak = measure(lambda: selector.run(10**6, solver = 'lns', time_limit = seconds,
+                                                     random_state = random_state))
+    cost = sum(selector.cost_calculator.get_cost(selector.model.get_solution()))
+    results['LargeNeighbourhoodSearch'] = {'seconds': seconds, 'peak_MB': peak,
+                                           'moves_per_second': selector.model.num_evaluations / seconds,
+                                           'cost': cost,
+                                           'excess_over_optimum': cost / program.cost - 1}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--cards', type = int, default = 60, help = 'number of different cards')
+    parser.add_argument('--max-copies', type = int, default = 4, help = 'maximum copies of a card')
+    parser.add_argument('--sellers', type = int, default = 100, help = 'number of sellers')
+    parser.add_argument('--sellers-per-card', type = int, default = 20, help = 'sellers listing each card')
+    parser.add_argument('--mean-stock', type = float, default = 3, help = 'mean copies per listing')
+    parser.add_argument('--price-spread', type = float, default = 0.5, help = 'log-normal spread of prices')
+    parser.add_argument('-N', type = int, default = 8000, help = 'population size')
+    parser.add_argument('--iterations', type = int, default = 50, help = 'generations of SupplierSelector.run')
+    parser.add_argument('--seed', type = int, default = 0, help = 'random seed')
+    parser.add_argument('--json', help = 'also write results to this file')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cards, args.max_copies, args.sellers, args.sellers_per_card,
+                             args.mean_stock, args.price_spread, args.N, args.iterations, args.seed)
+    for name, result in results.items():
+        print('%-32s' % name + '  '.join('%s=%.4g' % item for item in result.items()))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+if __name__ == '__main__':
+    main()
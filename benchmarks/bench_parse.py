@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of parsing supplier pages.
+
+Times parsing the saved pages of tests/resources, padded to the given number
+of listings, into rows, and building the supplier table of a whole deck from
+them. Runs offline:
+
+    python benchmarks/bench_parse.py --listings 50 --cards 60
+"""
+import argparse
+import os
+import re
+import time
+import pandas as pd
+import mtgss.webscrape as ws
+
+RESOURCES = os.path.join(os.path.dirname(__file__), '..', 'tests', 'resources')
+
+def load_pages(num_listings):
+    """saved pages of both sites with num_listings listings each"""
+
+    pages = {}
+    for site in ['lm', 'mm']:
+        with open(os.path.join(RESOURCES, site + '_page.html'), encoding = 'UTF-8') as f:
+            page = f.read().replace('CARDNAME', 'Tempered Steel')
+        if site == 'lm':
+            listings = re.findall(r'  <tr><td>.*</tr>\n', page)
+            page = page.replace(''.join(listings), ''.join(listings * (-(-num_listings // len(listings)))))
+        else:
+            listings = re.findall(r'<div class="product p\d">.*?</div>\n', page, re.S)
+            page = page.replace(''.join(listings), ''.join(listings * (-(-num_listings // len(listings)))))
+        pages[site] = page.encode('UTF-8')
+    return pages
+
+def timeit(func, repeat):
+    """mean seconds per call of func"""
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+def run_benchmarks(num_listings = 50, num_cards = 60, repeat = 200) -> dict:
+    """time parsing each page and building the table of a deck"""
+
+    pages = load_pages(num_listings)
+    results = {}
+    results['parse_lm_page'] = {'seconds': timeit(lambda: ws.parse_lm_page(pages['lm']), repeat),
+                                'rows': len(ws.parse_lm_page(pages['lm']))}
+    results['parse_mm_page'] = {'seconds': timeit(lambda: ws.parse_mm_page(pages['mm'], 'Tempered Steel', ''), repeat),
+                                'rows': len(ws.parse_mm_page(pages['mm'], 'Tempered Steel', ''))}
+    rows = ws.parse_lm_page(pages['lm']) + ws.parse_mm_page(pages['mm'], 'Tempered Steel', '')
+    results['DataFrame per deck'] = {'seconds': timeit(lambda: pd.DataFrame(rows * num_cards, columns = ws.HEADERS),
+                                                      max(repeat // 10, 1)),
+                                     'rows': len(rows) * num_cards}
+    results['DataFrame per card'] = {'seconds': timeit(lambda: [pd.DataFrame(rows, columns = ws.HEADERS)
+                                                               for i in range(num_cards)], max(repeat // 10, 1)),
+                                     'rows': len(rows) * num_cards}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--listings', type = int, default = 50, help = 'listings per page')
+    parser.add_argument('--cards', type = int, default = 60, help = 'cards per deck')
+    parser.add_argument('--repeat', type = int, default = 200, help = 'parses timed per page')
+    args = parser.parse_args()
+
+    for name, result in run_benchmarks(args.listings, args.cards, args.repeat).items():
+        print('%-24s' % name + '  '.join('%s=%.4g' % item for item in result.items()))
+
+if __name__ == '__main__':
+    main()
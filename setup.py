@@ -27,8 +27,14 @@ setuptools.setup(name='mtgss',
           "lxml>=4.6.2",
           "requests>=2.23.0",
           "pandas>=1.1.5",
-          "scipy>=1.5.0"
+          "scipy>=1.9.0"
       ],
+      extras_require={
+          "plot": ["matplotlib"]
+      },
+      entry_points={
+          "console_scripts": ["mtgss = mtgss.cli:main"]
+      },
       classifiers=[
           'Environment :: Console',
           'Topic :: Games/Entertainment',
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optimise many decks at once.
+
+Cards that appear in several decks are looked up once, and the configurations
+of each (card, number of copies) pair are computed once. The decks are then
+optimised in parallel, one process each. From the command line:
+
+    python -m mtgss.batch decks/ results/ --processes 4 --cache
+
+Decks bought together can instead be optimised jointly (--joint): their cards
+are merged into one order, so that each listing's stock is shared by all
+decks and each supplier's shipping is paid once, and the order is then split
+into one manifest per deck.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from . import tools as t
+from . import webscrape as ws
+from .mtgss import SupplierSelector
+from .shipping import ShippingModel
+
+def _optimise_deck(cardlist, suppliers_allcards, all_ensembles_dict, shipping, run_kwargs):
+    """optimise one deck, quietly. Returns solution, total cost and run info"""
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                    all_ensembles_dict = all_ensembles_dict, shipping = shipping)
+        run_info = selector.run(**run_kwargs)
+    solution = selector.solution.sort_values(['supplier', 'cardname', 'cost']).reset_index(drop = True)
+    #the integer program may buy configurations outside the genome's ensembles
+    cost = float(solution['cost'].sum() + selector.cost_calculator.get_shipping(solution).sum())
+    return solution, cost, run_info
+
+def merge_decks(decks, suppliers_allcards) -> t.CardList:
+    """one CardList of the cards of all decks (deck name:CardList), with the
+    copies of the same card added up (see tools.merge_cards). The number of
+    copies is capped at the copies on offer, so that a card too scarce for all
+    decks is still bought for some of them."""
+
+    merged = t.merge_cards(card for cardlist in decks.values() for card in cardlist.cardlist)
+    return t.CardList({'Name': [card.name for card in merged.cardlist],
+                       'Number': [min(card.number, max(suppliers_allcards[card.name].total_cards_on_offer, 1))
+                                  for card in merged.cardlist]})
+
+def split_solution(solution, decks) -> dict:
+    """split the solution of merged decks (see merge_decks) into one per deck.
+    The copies of each card go to the decks in order, cheapest first, under
+    each deck's own spelling of the card.
+
+    Returns
+    -------
+    dict
+        deck name:DataFrame with the columns of solution.
+
+    """
+    import pandas as pd
+
+    copies = {}
+    for row in solution.sort_values(['cost', 'supplier'], kind = 'stable').itertuples(index = False):
+        copies.setdefault(ws.normalise_cardname(row.cardname), []).append(row)
+    manifests = {}
+    for name, cardlist in decks.items():
+        entries = []
+        for card in cardlist.cardlist:
+            rows = copies.get(ws.normalise_cardname(card.name), [])
+            entries.extend([row.supplier, card.name, row.cost, row.url] for row in rows[:card.number])
+            del rows[:card.number]
+        manifest = pd.DataFrame(entries, columns = ['supplier', 'cardname', 'cost', 'url'])
+        manifests[name] = manifest.sort_values(['supplier', 'cardname', 'cost']).reset_index(drop = True)
+    return manifests
+
+def share_shipping(manifests, shipping) -> dict:
+    """shipping cost of each deck: the shipping of each supplier (see
+    CostCalculator.get_shipping) is shared by the decks buying from it, in
+    proportion to what they spend there"""
+
+    import pandas as pd
+
+    subtotals = {name: manifest.groupby('supplier')['cost'].sum() for name, manifest in manifests.items()}
+    totals = pd.concat(subtotals.values()).groupby(level = 0).sum()
+    return {name: float((shipping.reindex(subtotal.index, fill_value = 0) * subtotal
+                         / totals.reindex(subtotal.index)).sum())
+            for name, subtotal in subtotals.items()}
+
+def run_joint(decks, suppliers_allcards, shipping = None, all_ensembles_dict = None, **kwargs) -> dict:
+    """Find the optimal card arrangement of several decks bought together.
+
+    The decks are merged into one order (see merge_decks), which is optimised
+    over one catalogue and one genome of its distinct cards: stock is shared
+    by all decks, and the shipping of each supplier is paid once.
+
+    Parameters
+    ----------
+    decks : dict
+        deck name:CardList.
+    suppliers_allcards : dict
+        cardname:SuppliersOfCard of all cards.
+    shipping : ShippingModel, optional
+        shipping rules, or their configuration. The default is a flat cost
+        of 1 per supplier.
+    all_ensembles_dict : dict, optional
+        cardname:configurations of the merged cards, instead of computing
+        them.
+    **kwargs :
+        passed to SupplierSelector.run, e.g. num_iterations or solver.
+
+    Returns
+    -------
+    dict
+        solution (DataFrame of the whole order), solutions (deck
+        name:DataFrame, see split_solution), and summary: total cost, shipping
+        and stop reason, seconds, and for each deck its number of cards,
+        number of cards bought, cost and share of the shipping (see
+        share_shipping).
+
+    """
+
+    start = time.perf_counter()
+    cardlist = merge_decks(decks, suppliers_allcards)
+    with contextlib.redirect_stdout(io.StringIO()):
+        selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                    all_ensembles_dict = all_ensembles_dict, shipping = shipping)
+        run_info = selector.run(**kwargs)
+    solution = selector.solution.sort_values(['supplier', 'cardname', 'cost']).reset_index(drop = True)
+    shipping_costs = selector.cost_calculator.get_shipping(solution)
+    manifests = split_solution(solution, decks)
+    shipping_shares = share_shipping(manifests, shipping_costs)
+
+    summary = {'cost': float(solution['cost'].sum() + shipping_costs.sum()),
+               'shipping': float(shipping_costs.sum()),
+               'stop_reason': run_info['stop_reason'],
+               'seconds': time.perf_counter() - start,
+               'per_deck': {name: {'cards': sum(card.number for card in decks[name].cardlist),
+                                   'bought': len(manifest),
+                                   'cost': float(manifest['cost'].sum()) + shipping_shares[name],
+                                   'shipping': shipping_shares[name]}
+                            for name, manifest in manifests.items()}}
+    return {'solution': solution, 'solutions': manifests, 'summary': summary}
+
+def _read_decks(directory, output_names = ('summary',)) -> dict:
+    """deck name:CardList of every deck in directory, named after its file
+    without extension. Raises ValueError if two decks have the same name 
+    (ignoring case), or a deck has the name of another output (output_names), 
+    as their CSVs would overwrite each other."""
+
+    paths = sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                   if os.path.splitext(path)[1].lower() in t.CARD_READERS)
+    decks = {}
+    seen = {} #lower case name:path
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name.lower() in output_names:
+            raise ValueError('Deck %s would be overwritten by %s.csv, rename it' % (path, name.lower()))
+        if name.lower() in seen:
+            raise ValueError('Decks %s and %s would both be written to %s.csv, rename one' 
+                             % (seen[name.lower()], path, name))
+        seen[name.lower()] = path
+        decks[name] = t.get_cardlist_from_filename(path)
+    return decks
+
+def run_batch(directory, out_dir = None, max_workers = 8, num_processes = None, cache = None,
+              suppliers_allcards = None, shipping = None, joint = False, **kwargs) -> dict:
+    """Find the optimal card arrangement of every deck in directory (files
+    with an extension of tools.CARD_READERS: .cod, .dec, .txt or .csv).
+    Each deck is named after its file, so no two may differ in extension 
+    only, and none may be called summary (nor order, with joint).
+
+    Parameters
+    ----------
+    directory : str
+        folder containing the decks.
+    out_dir : str, optional
+        folder to write one CSV per deck (named after the deck) and
+        summary.csv to. The default is None, which writes nothing.
+    max_workers : int, optional
+        number of cards looked up concurrently. The default is 8.
+    num_processes : int, optional
+        number of decks optimised in parallel. 1 (and solver 'islands') 
+        optimises them one after another in this process. The default is the
+        number of CPUs.
+    cache : SupplierCache, optional
+        persistent cache of supplier tables. The default is None.
+    suppliers_allcards : dict, optional
+        cardname:SuppliersOfCard of all cards, instead of looking them up.
+    shipping : ShippingModel, optional
+        shipping rules, or their configuration. The default is a flat cost
+        of 1 per supplier.
+    joint : bool, optional
+        optimise the decks as one order (see run_joint) instead of one by
+        one, and also write it to order.csv. The default is False.
+    **kwargs :
+        passed to SupplierSelector.run, e.g. num_iterations or solver.
+
+    Returns
+    -------
+    dict
+        solutions (deck name:DataFrame), and summary: number of decks,
+        unique cards and configuration tables, seconds spent looking up
+        cards, computing configurations and optimising, and for each deck
+        its number of cards, total cost, stop reason and seconds. With joint,
+        the summary of run_joint instead, with the number of decks and
+        unique cards and the seconds spent looking up cards and optimising,
+        and solution, the whole order.
+
+    """
+
+    start = time.perf_counter()
+    shipping = ShippingModel.from_config(shipping or ShippingModel())
+    #the joint order is written to order.csv next to the manifests
+    decks = _read_decks(directory, ('summary', 'order') if joint else ('summary',))
+
+    #look up each card once
+    cardnames = list(dict.fromkeys(card.name for cardlist in decks.values() for card in cardlist))
+    if suppliers_allcards is None:
+        unique_cards = t.CardList({'Name': cardnames, 'Number': [1] * len(cardnames)})
+        suppliers_allcards = t.get_suppliers_from_cardlist(unique_cards, max_workers, cache = cache)
+    lookup_end = time.perf_counter()
+
+    if joint:
+        result = run_joint(decks, suppliers_allcards, shipping, **kwargs)
+        end = time.perf_counter()
+        result['summary'].update({'decks': len(decks),
+                                  'unique_cards': len(cardnames),
+                                  'lookup_seconds': lookup_end - start,
+                                  'optimisation_seconds': end - lookup_end,
+                                  'seconds': end - start})
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok = True)
+            result['solution'].to_csv(os.path.join(out_dir, 'order.csv'))
+            for name, solution in result['solutions'].items():
+                solution.to_csv(os.path.join(out_dir, name + '.csv'))
+            with open(os.path.join(out_dir, 'summary.csv'), 'w') as f:
+                f.write('deck,cards,bought,cost,shipping\n')
+                for name, deck in result['summary']['per_deck'].items():
+                    f.write('%s,%d,%d,%.2f,%.2f\n' % (name, deck['cards'], deck['bought'],
+                                                      deck['cost'], deck['shipping']))
+        return result
+
+    #configurations of each (card, number) once
+    configurations = {}
+    for cardlist in decks.values():
+        for card in cardlist:
+            if (card.name, card.number) not in configurations:
+                configurations[card.name, card.number] = \
+                    suppliers_allcards[card.name].get_configuration_space(card.number, shipping.price_window)
+    configurations_end = time.perf_counter()
+
+    jobs = {}
+    for name, cardlist in decks.items():
+        jobs[name] = (cardlist,
+                      {card.name: suppliers_allcards[card.name] for card in cardlist},
+                      {card.name: configurations[card.name, card.number] for card in cardlist},
+                      shipping,
+                      kwargs)
+    #island processes cannot be started from a pool's worker processes
+    if num_processes == 1 or kwargs.get('solver') == 'islands':
+        results = {name: _optimise_deck(*job) for name, job in jobs.items()}
+    else:
+        with ProcessPoolExecutor(num_processes) as executor:
+            futures = {name: executor.submit(_optimise_deck, *job) for name, job in jobs.items()}
+            results = {name: future.result() for name, future in futures.items()}
+    end = time.perf_counter()
+
+    summary = {'decks': len(decks),
+               'unique_cards': len(cardnames),
+               'configuration_tables': len(configurations),
+               'lookup_seconds': lookup_end - start,
+               'configuration_seconds': configurations_end - lookup_end,
+               'optimisation_seconds': end - configurations_end,
+               'seconds': end - start,
+               'per_deck': {name: {'cards': sum(card.number for card in decks[name]),
+                                   'cost': cost,
+                                   'stop_reason': run_info['stop_reason'],
+                                   'seconds': run_info['seconds']}
+                            for name, (_, cost, run_info) in results.items()}}
+    solutions = {name: solution for name, (solution, _, _) in results.items()}
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok = True)
+        for name, solution in solutions.items():
+            solution.to_csv(os.path.join(out_dir, name + '.csv'))
+        with open(os.path.join(out_dir, 'summary.csv'), 'w') as f:
+            f.write('deck,cards,cost,stop_reason,seconds\n')
+            for name, deck in summary['per_deck'].items():
+                f.write('%s,%d,%.2f,%s,%.3f\n' % (name, deck['cards'], deck['cost'],
+                                                 deck['stop_reason'], deck['seconds']))
+    return {'solutions': solutions, 'summary': summary}
+
+def main(argv = None, prog = None):
+    parser = argparse.ArgumentParser(prog = prog, description = 'Optimise every deck (.cod, .dec, .txt or .csv) in a folder.')
+    parser.add_argument('directory', help = 'folder containing the decks')
+    parser.add_argument('out_dir', help = 'folder to write one CSV per deck and summary.csv to')
+    parser.add_argument('--workers', type = int, default = 8, help = 'cards looked up concurrently')
+    parser.add_argument('--processes', type = int, help = 'decks optimised in parallel')
+    parser.add_argument('--solver', default = 'ga', choices = ['ga', 'islands', 'lns', 'milp'])
+    parser.add_argument('--iterations', type = int, default = 50, help = 'generations of the genetic algorithm')
+    parser.add_argument('--cache', action = 'store_true', help = 'use the persistent supplier cache')
+    parser.add_argument('--shipping', help = 'JSON file of shipping rules (see mtgss.shipping)')
+    parser.add_argument('--joint', action = 'store_true',
+                        help = 'buy all decks as one order, sharing stock and shipping')
+    args = parser.parse_args(argv)
+
+    cache = None
+    if args.cache:
+        from .cache import SupplierCache
+        cache = SupplierCache()
+    summary = run_batch(args.directory, args.out_dir, args.workers, args.processes, cache,
+                        shipping = args.shipping, joint = args.joint, solver = args.solver,
+                        num_iterations = args.iterations)['summary']
+    if args.joint:
+        print('%(decks)d decks, %(unique_cards)d unique cards bought as one order' % summary)
+        print('lookup %(lookup_seconds).1fs, optimisation %(optimisation_seconds).1fs, total %(seconds).1fs' % summary)
+        print('total %.2f, of which shipping %.2f (%s)' % (summary['cost'], summary['shipping'], summary['stop_reason']))
+        for name, deck in summary['per_deck'].items():
+            print('%s: %.2f, %d of %d cards' % (name, deck['cost'], deck['bought'], deck['cards']))
+        return
+    print('%(decks)d decks, %(unique_cards)d unique cards, %(configuration_tables)d configuration tables' % summary)
+    print('lookup %(lookup_seconds).1fs, configurations %(configuration_seconds).1fs, '
+          'optimisation %(optimisation_seconds).1fs, total %(seconds).1fs' % summary)
+    for name, deck in summary['per_deck'].items():
+        print('%s: %.2f (%s, %.1fs)' % (name, deck['cost'], deck['stop_reason'], deck['seconds']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk cache of scraped supplier tables.
+
+Tables are stored in SQLite, keyed by (site, normalised card name), together
+with the time they were fetched.
+"""
+import os
+import json
+import sqlite3
+import threading
+import time
+import pandas as pd
+from . import webscrape as ws
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.mtgss', 'suppliers.sqlite')
+
+class SupplierCache:
+    """Cache of supplier tables scraped from each site"""
+
+    def __init__(self, path = DEFAULT_PATH, ttl = 24 * 3600, refresh = False, offline = False):
+        """Open (or create) cache stored at path.
+
+        Parameters
+        ----------
+        path : str, optional
+            SQLite file. The default is ~/.mtgss/suppliers.sqlite.
+        ttl : float, optional
+            seconds after which a cached table is re-fetched. None never
+            expires. The default is one day.
+        refresh : bool, optional
+            ignore cached tables and re-fetch all of them. The default is False.
+        offline : bool, optional
+            never fetch: serve cached tables regardless of age, and no
+            suppliers for cards that are not cached. The default is False.
+
+        """
+
+        if path != ':memory:' and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self.ttl = ttl
+        self.refresh = refresh
+        self.offline = offline
+        #cards of a deck are fetched from several threads
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS suppliers
+                         (site TEXT, cardname TEXT, fetched REAL, rows TEXT,
+                          PRIMARY KEY (site, cardname))''')
+        self._db.commit()
+
+    def __repr__(self):
+        return 'SupplierCache(%s)' % self.path
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM suppliers').fetchone()[0]
+
+    def get(self, site, cardname, max_age = None):
+        """return cached table of site for cardname, or None if it is not
+        cached or older than max_age seconds"""
+
+        with self._lock:
+            entry = self._db.execute('SELECT fetched, rows FROM suppliers WHERE site = ? AND cardname = ?',
+                                     (site, ws.normalise_cardname(cardname))).fetchone()
+        if entry is None:
+            return None
+        fetched, rows = entry
+        if max_age is not None and time.time() - fetched > max_age:
+            return None
+        table = json.loads(rows)
+        return pd.DataFrame(table['data'], columns = table['columns'])
+
+    def put(self, site, cardname, supplier_db):
+        """store table of site for cardname"""
+
+        rows = json.dumps({'columns': list(supplier_db.columns),
+                           'data': supplier_db.values.tolist()},
+                          default = lambda value: value.item()) #numpy scalars
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO suppliers VALUES (?, ?, ?, ?)',
+                             (site, ws.normalise_cardname(cardname), time.time(), rows))
+            self._db.commit()
+
+    def fetch(self, site, cardname, scrape):
+        """return table of site for cardname. Uses the cached table unless it
+        is missing, expired or refresh is set, in which case scrape() is called
+        and its result is cached. Offline, scrape() is never called."""
+
+        if self.offline:
+            supplier_db = self.get(site, cardname)
+            if supplier_db is None:
+                print('not cached, no suppliers for: ' + cardname)
+                supplier_db = pd.DataFrame([], columns = ws.HEADERS)
+            return supplier_db
+
+        supplier_db = None if self.refresh else self.get(site, cardname, self.ttl)
+        if supplier_db is None:
+            supplier_db = scrape()
+            self.put(site, cardname, supplier_db)
+        return supplier_db
+
+    def clear(self):
+        """remove all cached tables"""
+
+        with self._lock:
+            self._db.execute('DELETE FROM suppliers')
+            self._db.commit()
+
+    def close(self):
+        self._db.close()
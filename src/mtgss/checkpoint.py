@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of SupplierSelector.run, to resume a long optimisation.
+
+A checkpoint is one .npz file holding the state of the genetic algorithm
+(population, fitness, generation, counters and random number generator), its
+hyperparameters (mutation rate, selection, survivors, children and cache) and
+everything needed to cost it: the deck, the supplier tables of its cards, the
+configurations of each card and the shipping rules, together with their
+fingerprint (see CostCalculator.fingerprint). Resuming reads the file instead
+of looking the cards up again and recomputing the configurations:
+
+    selector.run(500, checkpoint = 'run.npz', checkpoint_interval = 10)
+    ...
+    selector = resume('run.npz', 200)
+
+From the command line:
+
+    python -m mtgss.checkpoint run.npz output.csv --iterations 200
+"""
+import argparse
+import json
+import os
+import numpy as np
+from . import tools as t
+from . import webscrape as ws
+
+VERSION = 1
+
+def _strings(values):
+    """array of str, which np.load reads without pickle"""
+
+    return np.array([str(value) for value in values], dtype = str)
+
+def save_checkpoint(path, selector):
+    """write state of the genetic algorithm of selector (after run with
+    solver 'ga') and its inputs to path. The file is replaced at once, so a
+    killed process leaves the previous checkpoint intact."""
+
+    cc = selector.cost_calculator
+    arrays = {'version': np.array(VERSION),
+              'fingerprint': np.array(cc.fingerprint()),
+              'parameters': np.array(json.dumps(selector.model.get_parameters())),
+              'card_names': _strings(card.name for card in selector.cardlist),
+              'card_numbers': np.array([card.number for card in selector.cardlist], dtype = np.int64),
+              'shipping': np.array(json.dumps(cc.shipping_model.to_config())),
+              'keys': _strings(cc.keys)}
+    #supplier tables of the costed cards, one after another
+    tables = [selector.suppliers_allcards[key].supplier_db for key in cc.keys]
+    arrays['table_offsets'] = np.cumsum([0] + [len(table) for table in tables]).astype(np.int64)
+    for column in ws.HEADERS:
+        values = [value for table in tables for value in table[column]]
+        if column == 'Price':
+            arrays['table_' + column] = np.array(values, dtype = np.float64)
+        elif column == '# in stock':
+            arrays['table_' + column] = np.array(values, dtype = np.int64)
+        else:
+            arrays['table_' + column] = _strings(values)
+    #configurations as listing indices of each card, one table after another
+    configurations = [listings - cc.catalogue.offsets[i] for i, listings in enumerate(cc.config_listings)]
+    arrays['configuration_shapes'] = np.array([c.shape for c in configurations], dtype = np.int64).reshape(-1, 2)
+    arrays['configurations'] = np.concatenate([c.ravel() for c in configurations]
+                                              + [np.zeros(0, dtype = np.int64)]).astype(np.int32)
+    for key, value in selector.model.get_state().items():
+        arrays['state_' + key] = value
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(temporary, path)
+
+def load_checkpoint(path) -> dict:
+    """read checkpoint written by save_checkpoint.
+
+    Returns
+    -------
+    dict
+        cardlist (CardList), suppliers_allcards (cardname:SuppliersOfCard),
+        all_ensembles_dict (cardname:array of configurations), shipping
+        (configuration of the ShippingModel), fingerprint, parameters and 
+        state (see GeneticAlgorithm.get_parameters and get_state).
+
+    """
+    import pandas as pd
+
+    with np.load(path) as data:
+        arrays = dict(data)
+    if int(arrays['version']) != VERSION:
+        raise ValueError('unsupported checkpoint version %d' % arrays['version'])
+
+    keys = arrays['keys'].tolist()
+    offsets = arrays['table_offsets']
+    suppliers_allcards = {}
+    for i, key in enumerate(keys):
+        rows = slice(offsets[i], offsets[i + 1])
+        supplier_db = pd.DataFrame({column: arrays['table_' + column][rows].tolist() for column in ws.HEADERS},
+                                   columns = ws.HEADERS)
+        suppliers_allcards[key] = t.SuppliersOfCard(supplier_db, key)
+    all_ensembles_dict = {}
+    start = 0
+    for key, shape in zip(keys, arrays['configuration_shapes']):
+        end = start + int(np.prod(shape))
+        all_ensembles_dict[key] = arrays['configurations'][start:end].reshape(shape).astype(np.int64)
+        start = end
+
+    return {'cardlist': t.CardList({'Name': arrays['card_names'].tolist(),
+                                    'Number': arrays['card_numbers'].tolist()}),
+            'suppliers_allcards': suppliers_allcards,
+            'all_ensembles_dict': all_ensembles_dict,
+            'shipping': json.loads(str(arrays['shipping'])),
+            'fingerprint': str(arrays['fingerprint']),
+            'parameters': json.loads(str(arrays.get('parameters', '{}'))),
+            'state': {key[len('state_'):]: value for key, value in arrays.items() if key.startswith('state_')}}
+
+def resume(path, num_iterations = 50, **kwargs):
+    """continue the run saved in checkpoint path for up to num_iterations
+    more generations, checkpointing to the same file unless kwargs give
+    another checkpoint. The genetic algorithm gets the hyperparameters it was
+    saved with, unless kwargs override them; kwargs are passed to 
+    SupplierSelector.run.
+
+    Returns the SupplierSelector."""
+
+    from .mtgss import SupplierSelector
+    checkpoint = load_checkpoint(path)
+    selector = SupplierSelector('', cardlist = checkpoint['cardlist'],
+                                suppliers_allcards = checkpoint['suppliers_allcards'],
+                                all_ensembles_dict = checkpoint['all_ensembles_dict'],
+                                shipping = checkpoint['shipping'])
+    kwargs = dict(checkpoint['parameters'], **kwargs)
+    kwargs.setdefault('checkpoint', path)
+    selector.run(num_iterations, state = dict(checkpoint['state'], fingerprint = checkpoint['fingerprint']),
+                 **kwargs)
+    return selector
+
+def main(argv = None, prog = None):
+    parser = argparse.ArgumentParser(prog = prog, description = 'Resume an optimisation from its checkpoint.')
+    parser.add_argument('checkpoint', help = '.npz file written by SupplierSelector.run')
+    parser.add_argument('output', help = 'CSV file to write the solution to')
+    parser.add_argument('--iterations', type = int, default = 50, help = 'further generations')
+    parser.add_argument('--interval', type = int, default = 10, help = 'generations between checkpoints')
+    args = parser.parse_args(argv)
+
+    selector = resume(args.checkpoint, args.iterations, checkpoint_interval = args.interval)
+    selector.print_results(args.output)
+
+if __name__ == '__main__':
+    main()
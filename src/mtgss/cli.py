@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line interface, installed as the console script mtgss:
+
+    mtgss run deck.cod output.csv --solver lns --cache
+    mtgss batch decks/ results/ --processes 4
+    mtgss resume run.npz output.csv --iterations 200
+
+Arguments are parsed before anything else is imported, so that mistakes and
+--help are reported at once.
+"""
+import argparse
+import sys
+
+#commands handled by the main function of another module
+FORWARDED = {'batch': ('mtgss.batch', 'optimise every deck in a folder'),
+             'resume': ('mtgss.checkpoint', 'resume an optimisation from its checkpoint')}
+
+def get_parser() -> argparse.ArgumentParser:
+    """parser of the command line"""
+
+    parser = argparse.ArgumentParser(prog = 'mtgss', description = 'Magic the gathering card supplier selector.')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    run = commands.add_parser('run', help = 'optimise one deck',
+                              description = 'Find the cheapest suppliers of the cards of a deck.')
+    run.add_argument('cardlist', help = 'deck (.cod, .dec, .txt or .csv)')
+    run.add_argument('output', help = 'CSV file to write the solution to')
+    run.add_argument('--solver', default = 'ga', choices = ['ga', 'islands', 'lns', 'milp'])
+    run.add_argument('--iterations', type = int, default = 50, help = 'generations (iterations) of the solver')
+    run.add_argument('--time-limit', type = float, help = 'seconds after which the solver stops')
+    run.add_argument('--stall', type = int, help = 'stop after this many generations without improvement')
+    run.add_argument('--workers', type = int, default = 8, help = 'cards looked up concurrently')
+    run.add_argument('--cache', action = 'store_true', help = 'use the persistent supplier cache')
+    run.add_argument('--shipping', help = 'JSON file of shipping rules (see mtgss.shipping)')
+    run.add_argument('--checkpoint', help = '.npz file to checkpoint the genetic algorithm to')
+    run.add_argument('--plot', help = 'image file to plot the cards and cost per supplier to')
+    for name, (_, description) in FORWARDED.items():
+        commands.add_parser(name, help = description, add_help = False)
+    return parser
+
+def run(args):
+    """optimise the deck of the run command"""
+
+    from .mtgss import SupplierSelector
+    cache = None
+    if args.cache:
+        from .cache import SupplierCache
+        cache = SupplierCache()
+    selector = SupplierSelector(args.cardlist, max_workers = args.workers, cache = cache, shipping = args.shipping)
+    kwargs = {'solver': args.solver, 'time_limit': args.time_limit, 'stall_generations': args.stall}
+    if args.checkpoint:
+        kwargs['checkpoint'] = args.checkpoint
+    selector.run(args.iterations, **kwargs)
+    selector.print_results(args.output)
+    if args.plot:
+        from matplotlib import pyplot as plt
+        selector.plot_results()
+        plt.savefig(args.plot)
+
+def main(argv = None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] in FORWARDED:
+        import importlib
+        module = importlib.import_module(FORWARDED[argv[0]][0])
+        module.main(argv[1:], prog = 'mtgss ' + argv[0])
+        return
+    args = get_parser().parse_args(argv)
+    run(args)
+
+if __name__ == '__main__':
+    main()
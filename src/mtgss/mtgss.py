@@ -7,11 +7,12 @@ Created on Wed Jan  6 19:24:08 2021
 @author: Thore
 """
 
-from tools.optimisation import GeneticAlgorithm as ga
-import tools.tools as t
+from mtgss.optimisation import GeneticAlgorithm as ga, IslandModel, LargeNeighbourhoodSearch, IntegerProgram
+import mtgss.tools as t
+from mtgss.shipping import ShippingModel
+from mtgss.checkpoint import save_checkpoint
 import numpy as np
-from matplotlib import pyplot as plt
-import sys
+import time
 
 class SupplierSelector:
     def __init__(self, cardlist_path: str, **kwargs):
@@ -22,7 +23,20 @@ class SupplierSelector:
         cardlist = kwargs.get('cardlist', None)
         suppliers_allcards = kwargs.get('suppliers_allcards', None)
         all_ensembles_dict = kwargs.get('all_ensembles_dict', None)
+        #number of cards looked up concurrently
+        max_workers = kwargs.get('max_workers', 8)
+        #persistent cache of supplier information (mtgss.cache.SupplierCache)
+        cache = kwargs.get('cache', None)
+        #remove dominated listings and sellers before computing ensembles
+        prune = kwargs.get('prune', True)
+        #ShippingModel, or its configuration (dict or path of a JSON file)
+        self.shipping = ShippingModel.from_config(kwargs.get('shipping') or ShippingModel())
         
+        if not cardlist and not suppliers_allcards:
+            #look the cards up while the list is being read
+            print('importing list ' + cardlist_path + ' and suppliers of card..')
+            cardlist, suppliers_allcards = t.get_suppliers_from_filename(cardlist_path, max_workers, cache = cache)
+            print('received supplier information')
         if not cardlist:
             print('importing list ' + cardlist_path, end = '')
             self.cardlist = t.get_cardlist_from_filename(cardlist_path)
@@ -32,46 +46,177 @@ class SupplierSelector:
         
         if not suppliers_allcards:
             print('importing suppliers of card..')
-            self.suppliers_allcards = t.get_suppliers_from_cardlist(self.cardlist)
+            self.suppliers_allcards = t.get_suppliers_from_cardlist(self.cardlist, max_workers, cache = cache)
             print('received supplier information')
         else:
             self.suppliers_allcards = suppliers_allcards
         
+        self.pruning_report = None
         if not all_ensembles_dict:
+            if prune:
+                self.suppliers_allcards, self.pruning_report = t.prune_suppliers(self.cardlist, self.suppliers_allcards,
+                                                                                 shipping = self.shipping)
+                print('pruned listings %(listings_before)d -> %(listings_after)d, '
+                      'sellers %(sellers_before)d -> %(sellers_after)d' % self.pruning_report)
             print('computing ensembles')
-            self.all_ensembles_dict = t.get_dict_of_all_ensembles(self.cardlist, self.suppliers_allcards)
+            self.all_ensembles_dict = t.get_dict_of_all_ensembles(self.cardlist, self.suppliers_allcards,
+                                                                  self.shipping.price_window)
             print('finished computing ensembles')
         else:
             self.all_ensembles_dict = all_ensembles_dict
     
-    def run(self, num_iterations = 50, **kwargs):
-        """run the genetic algorithm to find the optimal card arrangement.
-        The genetic algorithm object will be stored as self.model."""
+    def run(self, num_iterations = 50, solver = 'ga', stall_generations = None, tolerance = 0,
+            min_diversity = None, time_limit = None, max_evaluations = None, warm_start = 0.2, 
+            checkpoint = None, checkpoint_interval = 10, state = None, **kwargs):
+        """find the optimal card arrangement.
+        solver 'ga' runs the genetic algorithm for up to num_iterations generations,
+        'islands' runs one genetic algorithm per process for up to num_iterations 
+        generations (see IslandModel for kwargs),
+        'lns' runs a large neighbourhood search, which moves whole orders 
+        between suppliers, for up to num_iterations iterations (see 
+        LargeNeighbourhoodSearch for kwargs),
+        'milp' solves the integer program exactly (kwargs mip_rel_gap).
+        The solver object will be stored as self.model.
+        
+        A fraction warm_start of the initial population of the genetic 
+        algorithms is seeded with the cheapest-cards arrangement, greedy 
+        supplier consolidations of it and perturbations of these 
+        (see CostCalculator.generate_seed_population). The rest is random.
+        
+        The genetic algorithms and the search stop early if
+        - the best fitness improved by no more than a fraction tolerance over
+          the last stall_generations generations,
+        - no gene has more than min_diversity different values in the population,
+        - another generation would exceed time_limit seconds,
+        - more than max_evaluations individuals (moves) have been evaluated.
+        time_limit also bounds the integer program.
+        
+        kwargs callback (e.g. a sink from mtgss.progress) is called with the 
+        statistics of each generation of the genetic algorithms, see 
+        GeneticAlgorithm.__next__, or iteration of the search, see
+        LargeNeighbourhoodSearch.__next__.
         
+        With solver 'ga', the state of the run is saved to the .npz file 
+        checkpoint every checkpoint_interval generations and when it stops 
+        (see mtgss.checkpoint). state continues a run from such a state, 
+        rather than from a new population; mtgss.checkpoint.resume does so 
+        from a checkpoint file.
+        
+        Returns dict with the reason for stopping ('num_iterations', 'stalled',
+        'converged', 'time_limit', 'max_evaluations', or for 'milp' 'optimal'),
+        the fitness, duration and statistics of each generation and the total 
+        time. It is also stored as self.run_info."""
+        
+        start = time.perf_counter()
         #setup system
-        self.cost_calculator = t.CostCalculator(self.suppliers_allcards, self.all_ensembles_dict)
+        self.cost_calculator = t.CostCalculator(self.suppliers_allcards, self.all_ensembles_dict, self.shipping)
+        if solver == 'milp':
+            self.model = IntegerProgram(self.cost_calculator, time_limit = time_limit, **kwargs)
+            configurations = self.model.solve()
+            self.optimality_gap = self.model.gap
+            print('total cost: %1.2f, optimality gap: %1.2f%%' % (self.model.cost, 100 * self.model.gap))
+            self.solution = self.cost_calculator.decode_configurations(configurations)
+            self.run_info = {'stop_reason': 'optimal' if self.model.result.status == 0 else 'time_limit',
+                             'fitness': [self.model.cost],
+                             'generation_times': [],
+                             'stats': [],
+                             'seconds': time.perf_counter() - start}
+            return self.run_info
+        
+        if (checkpoint is not None or state is not None) and solver != 'ga':
+            raise ValueError('Checkpoints are only supported by solver ga')
+        if state is not None and state['fingerprint'] != self.cost_calculator.fingerprint():
+            raise ValueError('Checkpoint was saved for another catalogue, configurations or shipping rules')
+        
         bounds = np.array(self.cost_calculator.ensemble_sizes) - 1
-        #define cost functions
-        cost_func = lambda p: sum(self.cost_calculator.get_cost(p))
+        #define cost functions, evaluated over the whole population at once.
+        #Costing from scratch is slow unless shipping is flat, so children are
+        #then costed from the changes to their parents, unless a fitness 
+        #cache is asked for (see GeneticAlgorithm)
+        cost_func = self.cost_calculator.get_total_cost_batch
+        if not self.cost_calculator.shipping.flat and not kwargs.get('cache_size'):
+            cost_func = t.IncrementalCost(self.cost_calculator)
         #create model
-        self.model = ga(cost_func, bounds, **kwargs)
+        if solver == 'ga':
+            if state is not None:
+                kwargs['N'] = len(state['population'])
+                kwargs['seed'] = state['population']
+            self.model = ga(cost_func, bounds, vectorised = True, **kwargs)
+        elif solver == 'islands':
+            self.model = IslandModel(cost_func, bounds, vectorised = True, **kwargs)
+        elif solver == 'lns':
+            #starts from the greedy arrangement
+            self.model = LargeNeighbourhoodSearch(self.cost_calculator, **kwargs)
+        else:
+            raise ValueError('Unknown solver ' + solver)
+        if state is not None:
+            self.model.set_state(state)
+        elif warm_start and solver == 'ga':
+            #a seed spawned from random_state, so that seeding does not replay 
+            #the numbers of the genetic algorithm (a Generator is shared)
+            seed = kwargs.get('random_state')
+            if not isinstance(seed, np.random.Generator):
+                seed = np.random.SeedSequence(seed).spawn(1)[0]
+            self.model.immigrate(self.cost_calculator.generate_seed_population(int(warm_start * self.model.N), seed))
+        elif warm_start and solver == 'islands':
+            #a seed per island, spawned as IslandModel spawns those of the 
+            #islands, and once more so that seeding draws other numbers
+            seeds = iter([seed.spawn(1)[0] for seed in 
+                          np.random.SeedSequence(kwargs.get('random_state')).spawn(self.model.num_islands)])
+            self.model.seed(lambda n: self.cost_calculator.generate_seed_population(
+                int(warm_start * n), next(seeds)))
         
         fitness_list = [];
+        generation_times = []
+        stats = []
+        stop_reason = 'num_iterations'
         
         for i in range(num_iterations):
             #Update
+            generation_start = time.perf_counter()
             f = next(self.model)
+            generation_times.append(time.perf_counter() - generation_start)
             #get fitness values
             fitness_list.append(f[0])
+            stats.append(self.model.stats)
             #Output
             print('\r(%d/%d) '%(i+1,num_iterations), end = '')
             print('top ensemble fitness: %1.1f   '%f[0], end = '')
+            if checkpoint is not None and self.model.generation % checkpoint_interval == 0:
+                save_checkpoint(checkpoint, self)
             
-        print('\nDone')
+            #check for early stopping
+            if stall_generations and len(fitness_list) > stall_generations:
+                best_before = fitness_list[-stall_generations - 1]
+                if best_before - fitness_list[-1] <= tolerance * abs(best_before):
+                    stop_reason = 'stalled'
+                    break
+            if min_diversity is not None and np.max(f[1]) <= min_diversity:
+                stop_reason = 'converged'
+                break
+            if time_limit is not None and time.perf_counter() - start + generation_times[-1] > time_limit:
+                stop_reason = 'time_limit'
+                break
+            if max_evaluations is not None and self.model.num_evaluations >= max_evaluations:
+                stop_reason = 'max_evaluations'
+                break
+            
+        if checkpoint is not None and self.model.generation % checkpoint_interval:
+            save_checkpoint(checkpoint, self)
+        print('\nDone (%s)' % stop_reason)
         self.solution = self.cost_calculator.decode_arrangement(self.model.get_solution())
+        if solver == 'islands':
+            self.model.close()
+        self.run_info = {'stop_reason': stop_reason,
+                         'fitness': fitness_list,
+                         'generation_times': generation_times,
+                         'stats': stats,
+                         'seconds': time.perf_counter() - start}
+        return self.run_info
     
     def plot_results(self):
         """create bar-chart of suppliers with num_cards and cost per supplier"""
+        from matplotlib import pyplot as plt
         #get data
         new_df = self.solution.groupby('supplier').sum()
         new_df['count'] = self.solution.groupby('supplier').supplier.count()
@@ -91,7 +236,7 @@ class SupplierSelector:
         sol = self.solution.sort_values(['supplier', 'cardname', 'cost']).reset_index(drop = True)
         
         card_cost = sol['cost'].sum()
-        shipping_cost = len(groupby('supplier').sum())
+        shipping_cost = self.cost_calculator.get_shipping(sol).sum()
         
         print("card cost = %1.1f£" % card_cost)
         print("shipping cost = %1.1f£" % shipping_cost)
@@ -101,20 +246,8 @@ class SupplierSelector:
         if filename:
             sol.to_csv(filename)
     
-def main(path_in, path_out, *args):
-    kwargs = {arg.split("=")[0]:float(arg.split("=")[1]) for arg in args}
-    model = SupplierSelector(path_in)
-    model.run(**kwargs)
-    model.print_results(path_out)
-
-    
 #%%
 if __name__ == '__main__':
-    
-    if len(sys.argv) < 2:
-        raise SyntaxError("Insufficient arguments.")
-        
-    if len(sys.argv) != 2:
-        main(sys.argv[1], sys.argv[2], *sys.argv[3:])
-    else:   
-        main(sys.argv[1], sys.argv[2])
+    #the command line interface, see mtgss.cli
+    from mtgss.cli import main
+    main()
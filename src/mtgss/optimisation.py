@@ -5,26 +5,64 @@ Created on Mon Jan  4 08:56:58 2021
 
 @author: Thore
 """
+import os
+import json
+import time
+import multiprocessing
+from collections import OrderedDict
 import numpy as np
-from numpy.random import exponential
-from random import randint, uniform
+
+#individuals per unit of the log of the search space, see get_population_size
+POPULATION_PER_LOG = 20
+#expected number of mutated genes per child, see get_mutation_rate
+MUTATIONS_PER_GENOME = 2
+
+def get_log_search_space(bounds) -> float:
+    """natural log of the number of genomes with genes 0 to bounds"""
+    
+    return float(np.log(np.asarray(bounds, dtype = np.float64) + 1).sum())
+
+def get_population_size(bounds, min_size = 20, max_size = 8000) -> int:
+    """population size for genes 0 to bounds: POPULATION_PER_LOG individuals
+    per unit of the log of the search space, but no more than the number of 
+    genomes, between min_size and max_size"""
+    
+    log_size = get_log_search_space(bounds)
+    size = min(POPULATION_PER_LOG * log_size, np.exp(min(log_size, 30)))
+    return int(np.clip(np.rint(size), min_size, max_size))
+
+def get_mutation_rate(bounds) -> float:
+    """chance each gene mutates for genes 0 to bounds: MUTATIONS_PER_GENOME
+    mutations per genome, spread over the genes with more than one option"""
+    
+    num_free = np.count_nonzero(np.asarray(bounds) > 0)
+    return min(0.5, MUTATIONS_PER_GENOME / max(num_free, 1))
+
 
 class GeneticAlgorithm:
-    def __init__(self, cost_func, bounds, N = 8000, mutation_rate = 0.05,
-                 survivor_fraction = 0.1, num_children = 2, beta = 0.1, seed = []):
+    def __init__(self, cost_func, bounds, N = None, mutation_rate = None,
+                 survivor_fraction = 0.1, num_children = 2, beta = 0.1, seed = [],
+                 vectorised = False, random_state = None, cache_size = 0, callback = None):
         """
         Create model for genetic algorithm solver
 
         Parameters
         ----------
         cost_func : function
-            takes in population and computes cost.
+            takes in an individual and computes its cost. If vectorised, takes
+            in the whole population and returns an array of costs. If it also
+            has a method derive(parents, population) (see tools.IncrementalCost),
+            children are costed incrementally from their parents.
         bounds : list or array
-            upper bounds for population.
+            upper bounds for population. Genes with upper bound 0 are fixed 
+            and never crossed over or mutated.
         N : int, optional
-            population size. The default is 8000.
+            population size. The default is None, which sizes the population
+            from the search space (see get_population_size) and halves it 
+            whenever fewer than half of its individuals are distinct.
         mutation_rate : float, optional
-            chance each gene mutates. The default is 0.05.
+            chance each gene mutates. The default is None, which derives it 
+            from the search space (see get_mutation_rate).
         survivor_fraction : TYPE, optional
             fraction of carry-over of fittest from previous gen. The default is 0.1.
         num_children : int, optional
@@ -32,41 +70,103 @@ class GeneticAlgorithm:
         beta: float, optional
             exp(-1)% of parents are chosen in top fraction of this size. The default is 0.1.
         seed : Array, optional
-            initial population. Random if left empty. The default is [].
+            initial population, filled up to N at random. Random if left 
+            empty. The default is [].
+        vectorised : bool, optional
+            cost_func evaluates the whole population in one call. The default is False.
+        random_state : int or numpy.random.Generator, optional
+            seed for the random number generator, for reproducible runs. The default is None.
+        cache_size : int, optional
+            number of fitness values of recently seen individuals kept, to
+            avoid re-evaluating duplicates. 0 disables the cache. The default is 0.
+            An incremental cost_func keeps a state for every individual, 
+            duplicates included, so it cannot be combined with a cache.
+        callback : function, optional
+            called with the statistics of each generation (see __next__), for
+            example a sink from mtgss.progress. The default is None.
 
         """
         
+        if cache_size > 0 and hasattr(cost_func, 'derive'):
+            raise ValueError('The fitness cache cannot be used with an incremental cost_func')
         self.f = cost_func
-        self.bounds  = bounds
-        self.N = N #population size
-        self.mutation_rate = mutation_rate #chance a feature mutates randomly
+        self.bounds  = np.asarray(bounds)
+        self.free_genes = np.flatnonzero(self.bounds > 0) #genes with more than one option
+        self.adaptive = N is None #population shrinks as it converges
+        self.min_N = get_population_size([]) #smallest population it shrinks to
+        self.N = get_population_size(bounds) if N is None else N #population size
+        self.mutation_rate = get_mutation_rate(bounds) if mutation_rate is None else mutation_rate #chance a feature mutates randomly
         self.survivor_fraction = survivor_fraction #fraction of fittest old gen carry-over to new gen
         self.num_children = num_children #number of children each selected pair generates
         self.beta = beta #exp(-1)% of parents are chosen in top fraction of this size
+        self.incremental = hasattr(cost_func, 'derive') #cost_func updates from parents
+        self.vectorised = vectorised or self.incremental #cost_func takes whole population
+        self.rng = np.random.default_rng(random_state)
+        #least recently used cache of genome bytes:fitness
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.num_evaluations = 0 #number of individuals evaluated by cost_func
+        self.callback = callback
+        self.generation = 0
+        self.stats = {} #statistics of the last generation
 
         if len(seed) == 0:
             print('randomly generating seed.')
-            self.population = self.generate_random(N)
+            self.population = self.generate_random(self.N)
         else:
-            self.population = seed
+            self.population = np.asarray(seed)[:self.N]
+            if len(self.population) < self.N:
+                self.population = np.concatenate((self.population, self.generate_random(self.N - len(self.population))))
             
-        assert len(self.population) == N, str(len(self.population))
+        assert len(self.population) == self.N, str(len(self.population))
+        self.fitness = None #fitness of population, if known
         
     def generate_random(self, N):
         """generate random population of size N"""
         
-        population = []
-        for i in range(N):
-            ensemble =  [randint(0, upper_limit) for upper_limit in self.bounds]
-            population.append(ensemble)
-        
-        return np.array(population)
+        return self.rng.integers(0, self.bounds + 1, size = (N, len(self.bounds)))
         
             
     def get_fitness(self):
         """compute fitness of population"""
         
-        return np.array([self.f(p) for p in self.population])
+        return self._evaluate(self.population)
+    
+    def _evaluate(self, population):
+        """compute fitness of individuals, looking them up in the cache first"""
+        
+        if self.cache_size <= 0:
+            return self._call_cost_func(population)
+        
+        keys = [p.tobytes() for p in population]
+        fitness = np.empty(len(population))
+        misses = []
+        for k, key in enumerate(keys):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                fitness[k] = self.cache[key]
+            else:
+                misses.append(k)
+        self.cache_hits += len(population) - len(misses)
+        self.cache_misses += len(misses)
+        
+        if misses:
+            fitness[misses] = self._call_cost_func(population[misses])
+            for k in misses:
+                self.cache[keys[k]] = fitness[k]
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        return fitness
+    
+    def _call_cost_func(self, population):
+        """compute fitness of individuals with cost_func"""
+        
+        self.num_evaluations += len(population)
+        if self.vectorised:
+            return np.asarray(self.f(population))
+        return np.array([self.f(p) for p in population])
     
     def get_diversity(self):
         """compote how varied the population is in each feature"""
@@ -78,57 +178,710 @@ class GeneticAlgorithm:
         return self
         
     def __next__(self):
-        """Next step in optimisation: Update population by one generation"""
+        """Next step in optimisation: Update population by one generation.
+        
+        Returns best fitness and diversity of the population before the update.
+        Stores statistics of the generation in self.stats and passes them to
+        callback: generation, best and median fitness, diversity, population 
+        size, evaluations, cache hits and misses so far, and seconds spent in 
+        selection, crossover, mutation, evaluation and the whole generation.
+        
+        An adaptive population (N None) is first halved if fewer than half of
+        its individuals are distinct."""
+        start = time.perf_counter()
         #calculate fitness
-        fitness = self.get_fitness()
+        fitness = self.get_fitness() if self.fitness is None else self.fitness
+        if self.adaptive and self.N > self.min_N and self._count_distinct() < self.N / 2:
+            fitness = self._shrink(fitness)
+        evaluation_time = time.perf_counter() - start
         #calucate diversity
         diversity = self.get_diversity()
         
+        selection_start = time.perf_counter()
         #Oder popluation
         order = np.argsort(fitness)
         population_sorted = self.population[order]
         
         #create new generation
-        population_newgen = []
         b = self.N * self.beta
         newsize = int(self.N * (1 - self.survivor_fraction))
         oldsize = int(self.N - newsize)
         
-        while len(population_newgen) < newsize:
-            #get random indeces to select parents
-            pairs_idx = np.array(exponential(b, 2)).astype(int)
-            if max(pairs_idx) >= (self.N - 1): #index too high
-                continue #try again
-            
-            pair = population_sorted[pairs_idx]
-            #cross over: randomly select features from 2 parents
-            children = []
-            for i in range(self.num_children):
-                children.append([b[randint(0,1)] for b in pair.T])
-            
-            #mutate
-            for child in children:
-                for i, feature in enumerate(child):
-                    #mutate this gene with a chance of mutation_rate
-                    if uniform(0, 1) < self.mutation_rate:
-                        child[i] = randint(0, self.bounds[i])        
-            
-            #add to population
-            for child in children:
-                population_newgen.append(child)
+        #get random indeces to select parents, each pair generates num_children
+        num_pairs = -(-newsize // self.num_children)
+        pairs_idx = self._sample_parents(b, (num_pairs, 2))
+        pairs_idx = np.repeat(pairs_idx, self.num_children, axis = 0)[:newsize]
+        parents_idx = order[pairs_idx[:, 0]]
+        parents = self.population[parents_idx]
+        partners = population_sorted[pairs_idx[:, 1]]
+        
+        crossover_start = time.perf_counter()
+        #cross over: randomly select features from 2 parents
+        free = self.free_genes
+        crossover = self.rng.random((newsize, len(free))) < 0.5
+        population_newgen = parents.copy()
+        population_newgen[:, free] = np.where(crossover, parents[:, free], partners[:, free])
+        
+        mutation_start = time.perf_counter()
+        #mutate: each gene mutates with a chance of mutation_rate
+        mutate = self.rng.random((newsize, len(free))) < self.mutation_rate
+        mutations = self.rng.integers(0, self.bounds[free] + 1, size = (newsize, len(free)))
+        population_newgen[:, free] = np.where(mutate, mutations, population_newgen[:, free])
         
-        #finished creating new population, turn to np.array
-        population_newgen = np.array(population_newgen)
+        evaluation_start = time.perf_counter()
         #carry-over fittest from the old gen
         population_oldgen = population_sorted[0:oldsize,:]
         #update population
         self.population = np.concatenate((population_newgen,population_oldgen))
+        self.num_elites = oldsize
+        if self.incremental:
+            #cost children as changes to their first parent, survivors are unchanged
+            self.num_evaluations += newsize
+            self.fitness = np.asarray(self.f.derive(np.concatenate((parents_idx, order[0:oldsize])), 
+                                                    self.population))
+        else:
+            #survivors carry their fitness forward
+            self.fitness = np.concatenate((self._evaluate(population_newgen), fitness[order[0:oldsize]]))
+        end = time.perf_counter()
+        
+        self.generation += 1
+        self.stats = {'generation': self.generation,
+                      'best': float(fitness[order[0]]),
+                      'median': float(np.median(fitness)),
+                      'diversity': diversity.tolist(),
+                      'population_size': len(fitness),
+                      'evaluations': self.num_evaluations,
+                      'cache_hits': self.cache_hits,
+                      'cache_misses': self.cache_misses,
+                      'selection_time': crossover_start - selection_start,
+                      'crossover_time': mutation_start - crossover_start,
+                      'mutation_time': evaluation_start - mutation_start,
+                      'evaluation_time': evaluation_time + end - evaluation_start,
+                      'generation_time': end - start}
+        if self.callback is not None:
+            self.callback(self.stats)
         return (min(fitness), diversity)
     
+    def _count_distinct(self):
+        """number of distinct individuals in the population, told apart by a
+        random linear hash of their genes"""
+        
+        if not hasattr(self, '_hash_weights'):
+            #own generator, so counting does not change the course of the run
+            self._hash_weights = np.random.default_rng(0).integers(1, 2**62, len(self.bounds))
+        return len(np.unique(self.population @ self._hash_weights))
+    
+    def _shrink(self, fitness):
+        """halve the population, keeping its fittest individuals, and return
+        their fitness"""
+        
+        keep = np.argsort(fitness)[:max(self.min_N, self.N // 2)]
+        self.population = self.population[keep]
+        self.N = len(keep)
+        if self.incremental:
+            #derive from the individuals kept
+            return self._call_cost_func(self.population)
+        return fitness[keep]
+    
+    def get_fittest(self, n):
+        """return the n fittest individuals of the last generation"""
+        
+        if getattr(self, 'num_elites', 0) >= n:
+            #carried-over individuals are sorted by fitness
+            return self.population[len(self.population) - self.num_elites:][:n]
+        fitness = self.get_fitness() if self.fitness is None else self.fitness
+        return self.population[np.argsort(fitness)[:n]]
+    
+    def immigrate(self, individuals):
+        """replace newly created individuals by individuals from elsewhere"""
+        
+        self.population[:len(individuals)] = individuals
+        self.fitness = None
+    
+    def get_parameters(self) -> dict:
+        """return the hyperparameters to create a model with the same 
+        settings, as keyword arguments of __init__. The population size is 
+        part of the state (see get_state)."""
+        
+        return {'mutation_rate': float(self.mutation_rate),
+                'survivor_fraction': float(self.survivor_fraction),
+                'num_children': int(self.num_children),
+                'beta': float(self.beta),
+                'cache_size': int(self.cache_size)}
+    
+    def get_state(self) -> dict:
+        """return the state of the optimisation as arrays: population, its
+        fitness (empty if not known), generation, counters and the state of 
+        the random number generator (see set_state and mtgss.checkpoint)"""
+        
+        #smallest integer type that holds every gene
+        dtype = np.min_scalar_type(int(np.max(self.bounds, initial = 0)))
+        return {'population': self.population.astype(dtype),
+                'fitness': np.array([]) if self.fitness is None else np.asarray(self.fitness),
+                'generation': np.array(self.generation),
+                'adaptive': np.array(self.adaptive),
+                'min_N': np.array(self.min_N),
+                'num_elites': np.array(getattr(self, 'num_elites', 0)),
+                'num_evaluations': np.array(self.num_evaluations),
+                'cache_hits': np.array(self.cache_hits),
+                'cache_misses': np.array(self.cache_misses),
+                'rng_state': np.array(json.dumps(self.rng.bit_generator.state))}
+    
+    def set_state(self, state):
+        """continue the optimisation from a state returned by get_state"""
+        
+        self.population = np.asarray(state['population']).astype(np.int64)
+        self.N = len(self.population)
+        #an incremental cost_func must see the population before deriving from it
+        fitness = np.asarray(state['fitness'], dtype = np.float64)
+        self.fitness = fitness if len(fitness) and not self.incremental else None
+        self.generation = int(state['generation'])
+        self.adaptive = bool(state['adaptive'])
+        self.min_N = int(state.get('min_N', self.min_N))
+        self.num_elites = int(state['num_elites'])
+        self.num_evaluations = int(state['num_evaluations'])
+        self.cache_hits = int(state['cache_hits'])
+        self.cache_misses = int(state['cache_misses'])
+        self.rng.bit_generator.state = json.loads(str(state['rng_state']))
+    
+    def _sample_parents(self, b, size):
+        """draw parent indeces from an exponential distribution with scale b,
+        truncated to the N - 1 fittest members of the population"""
+        
+        #inverse transform sampling of the truncated exponential
+        truncation = 1 - np.exp(-(self.N - 1) / b)
+        u = self.rng.random(size)
+        return np.minimum((-b * np.log1p(-u * truncation)).astype(int), max(self.N - 2, 0))
+    
     def get_solution(self):
         """return fittest sample"""
         
-        fitness = self.get_fitness()
+        fitness = self.get_fitness() if self.fitness is None else self.fitness
         order = np.argsort(fitness)
         population_sorted = self.population[order]
         return population_sorted[0]
+
+
+def _run_island(connection, cost_func, bounds, kwargs):
+    """worker process of IslandModel: evolve one GeneticAlgorithm on command"""
+    
+    model = GeneticAlgorithm(cost_func, bounds, **kwargs)
+    while True:
+        command, argument = connection.recv()
+        if command == 'next':
+            connection.send((next(model), model.stats))
+        elif command == 'emigrate':
+            connection.send(model.get_fittest(argument))
+        elif command == 'immigrate':
+            model.immigrate(argument)
+        elif command == 'size':
+            connection.send(model.N)
+        elif command == 'solution':
+            connection.send(model.get_solution())
+        else: #close
+            break
+    connection.close()
+
+
+class IslandModel:
+    def __init__(self, cost_func, bounds, num_islands = None, migration_interval = 5,
+                 num_migrants = 10, random_state = None, callback = None, **kwargs):
+        """
+        Create island model: several GeneticAlgorithm populations evolving in 
+        parallel, one per process. Every migration_interval generations the 
+        fittest individuals of each island replace new individuals of the next 
+        island (ring topology).
+        
+        cost_func and bounds are sent to each process once. With the spawn 
+        start method (Windows, macOS) cost_func must be picklable, e.g. 
+        CostCalculator.get_total_cost_batch rather than a lambda.
+
+        Parameters
+        ----------
+        cost_func : function
+            see GeneticAlgorithm.
+        bounds : list or array
+            upper bounds for population.
+        num_islands : int, optional
+            number of populations/processes. The default is the number of CPUs.
+        migration_interval : int, optional
+            generations between migrations. The default is 5.
+        num_migrants : int, optional
+            number of individuals migrating from each island. The default is 10.
+        random_state : int, optional
+            seed from which the islands' seeds are derived. The default is None.
+        callback : function, optional
+            called with the statistics of each generation of all islands (see 
+            __next__). The default is None.
+        **kwargs : 
+            passed to each island's GeneticAlgorithm, e.g. N, the population 
+            size per island.
+
+        """
+        
+        self.num_islands = num_islands or os.cpu_count()
+        self.migration_interval = migration_interval
+        self.num_migrants = num_migrants
+        self.generation = 0
+        self.num_evaluations = 0 #number of individuals evaluated on all islands
+        self.callback = callback
+        self.stats = {} #statistics of the last generation
+        self.connections = []
+        self.processes = []
+        seeds = np.random.SeedSequence(random_state).spawn(self.num_islands)
+        for seed in seeds:
+            connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = _run_island, 
+                                              args = (child_connection, cost_func, bounds, 
+                                                      dict(kwargs, random_state = seed)),
+                                              daemon = True)
+            process.start()
+            self.connections.append(connection)
+            self.processes.append(process)
+        self.f = cost_func
+        self.vectorised = kwargs.get('vectorised', False)
+    
+    def __iter__(self):
+        """make iterable"""
+        return self
+    
+    def __next__(self):
+        """Next step in optimisation: update all islands by one generation.
+        Returns lowest fitness and diversity of the most diverse island.
+        
+        Statistics are those of GeneticAlgorithm.__next__, combined over the 
+        islands: lowest best, median of the medians, highest diversity, total 
+        population size, evaluations and cache hits, total seconds spent in each phase by all 
+        processes, and wall-clock seconds of the generation."""
+        
+        start = time.perf_counter()
+        results, island_stats = zip(*self._command('next'))
+        self.num_evaluations = sum(stats['evaluations'] for stats in island_stats)
+        self.generation += 1
+        if self.generation % self.migration_interval == 0:
+            self.migrate()
+        
+        fitness = min(f for f, _ in results)
+        diversity = np.max([d for _, d in results], 0)
+        
+        self.stats = {'generation': self.generation,
+                      'best': min(stats['best'] for stats in island_stats),
+                      'median': float(np.median([stats['median'] for stats in island_stats])),
+                      'diversity': diversity.tolist()}
+        for key in ('population_size', 'evaluations', 'cache_hits', 'cache_misses', 'selection_time', 
+                    'crossover_time', 'mutation_time', 'evaluation_time'):
+            self.stats[key] = sum(stats[key] for stats in island_stats)
+        self.stats['generation_time'] = time.perf_counter() - start
+        if self.callback is not None:
+            self.callback(self.stats)
+        return (fitness, diversity)
+    
+    def migrate(self):
+        """fittest individuals of each island move to the next island"""
+        
+        emigrants = self._command('emigrate', self.num_migrants)
+        for connection, individuals in zip(self.connections, np.roll(np.array(emigrants), 1, axis = 0)):
+            connection.send(('immigrate', individuals))
+    
+    def seed(self, seed_func):
+        """replace new individuals of each island by seed_func(n), where n is 
+        the island's population size"""
+        
+        for connection, n in zip(self.connections, self._command('size')):
+            connection.send(('immigrate', seed_func(n)))
+    
+    def get_solution(self):
+        """return fittest sample of all islands"""
+        
+        solutions = np.array(self._command('solution'))
+        if self.vectorised:
+            fitness = np.asarray(self.f(solutions))
+        else:
+            fitness = np.array([self.f(p) for p in solutions])
+        return solutions[np.argmin(fitness)]
+    
+    def close(self):
+        """stop the island processes"""
+        
+        for connection, process in zip(self.connections, self.processes):
+            if process.is_alive():
+                connection.send(('close', None))
+                process.join()
+            connection.close()
+        self.connections = []
+        self.processes = []
+    
+    def __del__(self):
+        self.close()
+        
+    def _command(self, command, argument = None):
+        """send command to all islands, then collect their responses"""
+        
+        for connection in self.connections:
+            connection.send((command, argument))
+        return [connection.recv() for connection in self.connections]
+    
+
+class LargeNeighbourhoodSearch:
+    def __init__(self, cost_calculator, num_moves = 100, ruin_fraction = 0.1,
+                 temperature = None, cooling = 0.95, seed = None, random_state = None,
+                 callback = None):
+        """
+        Create large neighbourhood search: a single arrangement is improved by
+        removing some cards and re-inserting them one at a time in their 
+        cheapest configuration given all other cards (see 
+        CostCalculator.get_marginal_costs). Worse arrangements are accepted 
+        with a chance of exp(-increase / temperature) (simulated annealing).
+        
+        The cards removed are chosen to move whole orders, which the genetic 
+        algorithm rarely does:
+        - close a supplier: every card bought from them, which may not be 
+          re-inserted with them,
+        - open a supplier: every card they offer, re-inserted as if their 
+          shipping were paid already,
+        - a random fraction ruin_fraction of the cards.
+        The cost of an arrangement is kept up to date from the number and cost
+        of the cards bought from each supplier, so a change of a card only 
+        touches the shipping of its own suppliers.
+
+        Parameters
+        ----------
+        cost_calculator : CostCalculator
+            cards, their suppliers and the shipping cost.
+        num_moves : int, optional
+            moves per iteration. The default is 100.
+        ruin_fraction : float, optional
+            fraction of the cards removed by random moves. The default is 0.1.
+        temperature : float, optional
+            initial temperature. The default is a tenth of the mean base 
+            shipping cost of the suppliers.
+        cooling : float, optional
+            factor by which the temperature falls each iteration. The default is 0.95.
+        seed : array, optional
+            initial arrangement. The default is the greedy arrangement (see 
+            CostCalculator.generate_greedy_arrangement).
+        random_state : int or numpy.random.Generator, optional
+            seed for the random number generator. The default is None.
+        callback : function, optional
+            called with the statistics of each iteration (see __next__). The 
+            default is None.
+
+        """
+        
+        cc = cost_calculator
+        self.cost_calculator = cc
+        self.num_moves = num_moves
+        self.ruin_fraction = ruin_fraction
+        self.num_suppliers = len(cc.supplier_names)
+        self.temperature = 0.1 * cc.shipping.base[:-1].mean() if temperature is None else temperature
+        self.cooling = cooling
+        self.rng = np.random.default_rng(random_state)
+        self.callback = callback
+        self.generation = 0
+        self.num_evaluations = 0 #number of moves evaluated
+        self.stats = {} #statistics of the last iteration
+        
+        #which suppliers offer each card, plus the padding dummy
+        self.offers = np.zeros((len(cc.ensembles), self.num_suppliers + 1), dtype = bool)
+        for i, distinct in enumerate(cc.config_distinct_supplier_ids):
+            self.offers[i, distinct] = True
+        self.offers[:, self.num_suppliers] = False
+        
+        arrangement = cc.generate_greedy_arrangement() if seed is None else seed
+        self.arrangement = np.zeros(len(cc.ensembles), dtype = np.int64)
+        #cost and number of cards bought from each supplier, plus the padding dummy
+        self.subtotals = np.zeros(self.num_suppliers + 1)
+        self.items = np.zeros(self.num_suppliers + 1, dtype = np.int64)
+        #which suppliers each card is bought from
+        self.uses = np.zeros((len(cc.ensembles), self.num_suppliers + 1), dtype = bool)
+        self.cost = sum(self._add(i, j) for i, j in enumerate(arrangement))
+        self.best_cost = self.cost
+        self.best = self.arrangement.copy()
+    
+    def _add(self, i, j, sign = 1):
+        """buy (sign 1) or return (sign -1) configuration j of card i and 
+        return the change of total cost"""
+        
+        cc = self.cost_calculator
+        ids = cc.config_distinct_supplier_ids[i][j]
+        #ids repeat only for the padding dummy, which never costs anything
+        before = cc.shipping(ids, self.subtotals[ids], self.items[ids])
+        self.subtotals[ids] += sign * cc.config_distinct_subtotals[i][j]
+        self.items[ids] += sign * cc.config_distinct_items[i][j]
+        after = cc.shipping(ids, self.subtotals[ids], self.items[ids])
+        self.arrangement[i] = j
+        self.uses[i] = False
+        if sign > 0:
+            self.uses[i, ids] = True
+        return sign * cc.config_costs[i][j] + (after - before).sum()
+    
+    def _shipping(self, s):
+        """shipping cost of the order from supplier s"""
+        
+        return self.cost_calculator.shipping(s, self.subtotals[s], self.items[s])
+    
+    def _move(self):
+        """remove cards chosen by a random move and re-insert them. Returns 
+        the cards and the change of total cost"""
+        
+        cc = self.cost_calculator
+        kind = self.rng.integers(3)
+        closed = opened = None
+        if kind == 0 and self.items[:-1].any():
+            closed = self.rng.choice(np.flatnonzero(self.items[:-1]))
+            cards = np.flatnonzero(self.uses[:, closed])
+        elif kind == 1:
+            opened = self.rng.integers(self.num_suppliers)
+            cards = np.flatnonzero(self.offers[:, opened])
+        else:
+            size = max(1, int(self.ruin_fraction * len(self.arrangement)))
+            cards = self.rng.choice(len(self.arrangement), min(size, len(self.arrangement)), replace = False)
+        cards = self.rng.permutation(cards)
+        
+        delta = 0
+        for i in cards:
+            delta += self._add(i, self.arrangement[i], -1)
+        if opened is not None:
+            #an extra dummy card makes the supplier's shipping look paid. The
+            #change of cost it causes is taken back out when it is removed
+            delta -= self._shipping(opened)
+            self.items[opened] += 1
+            delta += self._shipping(opened)
+        for i in cards:
+            costs = cc.get_marginal_costs(i, self.subtotals, self.items)
+            if closed is not None:
+                forbidden = (cc.config_distinct_supplier_ids[i] == closed).any(1)
+                if not forbidden.all():
+                    costs = np.where(forbidden, np.inf, costs)
+            delta += self._add(i, np.argmin(costs))
+        if opened is not None:
+            delta -= self._shipping(opened)
+            self.items[opened] -= 1
+            delta += self._shipping(opened)
+        return cards, delta
+    
+    def __iter__(self):
+        """make iterable"""
+        return self
+    
+    def __next__(self):
+        """Next step in optimisation: num_moves moves, each accepted if it 
+        lowers the cost or by chance exp(-increase / temperature), and undone 
+        otherwise.
+        
+        Returns best cost and diversity, the number of configurations each 
+        card took (1 plus the number of accepted moves changing it). Stores 
+        statistics of the iteration in self.stats and passes them to callback:
+        generation, best and current cost, temperature, accepted moves, 
+        diversity, evaluations so far and seconds."""
+        
+        start = time.perf_counter()
+        temperature = self.temperature * self.cooling ** self.generation
+        diversity = np.ones(len(self.arrangement), dtype = np.int64)
+        accepted = 0
+        for n in range(self.num_moves):
+            arrangement = self.arrangement.copy()
+            cards, delta = self._move()
+            changed = cards[self.arrangement[cards] != arrangement[cards]]
+            if delta < 1e-9 or self.rng.random() < np.exp(-delta / max(temperature, 1e-12)):
+                self.cost += delta
+                diversity[changed] += 1
+                accepted += 1
+                if self.cost < self.best_cost - 1e-9:
+                    self.best_cost = self.cost
+                    self.best = self.arrangement.copy()
+            else:
+                for i in changed:
+                    self._add(i, self.arrangement[i], -1)
+                    self._add(i, arrangement[i])
+        self.num_evaluations += self.num_moves
+        
+        self.generation += 1
+        self.stats = {'generation': self.generation,
+                      'best': float(self.best_cost),
+                      'current': float(self.cost),
+                      'temperature': temperature,
+                      'accepted': accepted,
+                      'diversity': diversity.tolist(),
+                      'evaluations': self.num_evaluations,
+                      'generation_time': time.perf_counter() - start}
+        if self.callback is not None:
+            self.callback(self.stats)
+        return (self.best_cost, diversity)
+    
+    def get_solution(self):
+        """return cheapest arrangement found"""
+        
+        return self.best.copy()
+
+
+class IntegerProgram:
+    def __init__(self, cost_calculator, time_limit = None, mip_rel_gap = 0):
+        """
+        Create exact solver: mixed-integer linear program of the supplier 
+        selection problem, solved with scipy's HiGHS interface.
+        
+        Each listing gets an integer variable, the number of copies bought from 
+        it, and each supplier a binary variable, whether anything is bought from 
+        them. The program minimises card cost plus shipping cost per supplier 
+        used, subject to buying the required number of each card and buying 
+        only from suppliers that are used (a facility location problem).
+        
+        Item tiers of the shipping model get a binary variable per supplier and
+        tier, whether the order reaches it. Free shipping thresholds get a 
+        binary variable per supplier, whether the order is free, and a 
+        continuous one, the supplier's shipping cost.
+
+        Parameters
+        ----------
+        cost_calculator : CostCalculator
+            cards, their suppliers and the shipping cost.
+        time_limit : float, optional
+            seconds after which the best solution so far is returned. The default is None.
+        mip_rel_gap : float, optional
+            relative optimality gap at which the solver stops. The default is 0.
+
+        """
+        
+        self.cost_calculator = cost_calculator
+        self.time_limit = time_limit
+        self.mip_rel_gap = mip_rel_gap
+        self.result = None
+        
+    def solve(self):
+        """solve program and return a configuration (tuple of listing indeces)
+        for each card of the cost calculator. The relative optimality gap of 
+        the solution is stored as self.gap, its cost as self.cost"""
+        from scipy.optimize import milp, LinearConstraint, Bounds
+        from scipy.sparse import coo_matrix
+        
+        cc = self.cost_calculator
+        catalogue = cc.catalogue
+        num_suppliers = len(catalogue.seller_names)
+        num_cards = np.array([listings.shape[1] for listings in cc.config_listings])
+        
+        #one variable per listing that has stock
+        listings = np.flatnonzero(catalogue.stock > 0)
+        cards = catalogue.card_ids[listings]
+        sellers = catalogue.seller_ids[listings]
+        capacities = np.minimum(catalogue.stock[listings], num_cards[cards])
+        num_listings = len(listings)
+        num_vars = num_listings + num_suppliers
+        rows = np.arange(num_listings)
+        
+        #objective: card cost + shipping cost of every supplier used
+        shipping = cc.shipping
+        c = [catalogue.prices[listings], shipping.base[:num_suppliers]]
+        upper = [capacities, np.ones(num_suppliers)]
+        integrality = [np.ones(num_vars)]
+        #buy required number of each card
+        demand = coo_matrix((np.ones(num_listings), (cards, rows)), 
+                            shape = (len(num_cards), num_vars))
+        #copies bought from listing <= capacity of listing * supplier used
+        linking = coo_matrix((np.concatenate((np.ones(num_listings), -capacities.astype(float))),
+                              (np.concatenate((rows, rows)), np.concatenate((rows, num_listings + sellers)))),
+                             shape = (num_listings, num_vars))
+        constraints = [(demand, num_cards, num_cards),
+                       (linking, -np.inf, 0)]
+        
+        if not shipping.flat:
+            #extra variables of each supplier: one per tier, then free and shipping cost
+            total_cards = num_cards.sum()
+            tiers = [(s, k) for s in range(num_suppliers) for k in range(1, shipping.tier_items.shape[1])
+                     if shipping.tier_items[s, k] <= total_cards]
+            free = [s for s in range(num_suppliers) if np.isfinite(shipping.free_over[s])]
+            tier_vars = num_vars + np.arange(len(tiers))
+            free_vars = num_vars + len(tiers) + np.arange(len(free))
+            cost_vars = free_vars + len(free)
+            num_vars += len(tiers) + 2 * len(free)
+            
+            #cost of reaching tier k of a supplier: its cost less that of tier k - 1
+            tier_costs = np.array([shipping.tier_costs[s, k] - shipping.tier_costs[s, k - 1] for s, k in tiers])
+            tier_items = np.array([shipping.tier_items[s, k] for s, k in tiers], dtype = float)
+            has_free = np.isin([s for s, k in tiers], free)
+            #shipping of suppliers with a threshold is paid through their cost variable
+            c[1] = np.where(np.isfinite(shipping.free_over[:num_suppliers]), 0, c[1])
+            c.extend([np.where(has_free, 0, tier_costs), np.zeros(len(free)), np.ones(len(free))])
+            upper.extend([np.ones(len(tiers)), np.ones(len(free)), np.full(len(free), np.inf)])
+            integrality.extend([np.ones(len(tiers) + len(free)), np.zeros(len(free))])
+            
+            #cards and cost of the order from each supplier
+            orders = coo_matrix((np.ones(num_listings), (sellers, rows)), shape = (num_suppliers, num_vars)).tocsr()
+            subtotals = coo_matrix((catalogue.prices[listings], (sellers, rows)), 
+                                   shape = (num_suppliers, num_vars)).tocsr()
+            unit = lambda columns: coo_matrix((np.ones(len(columns)), (np.arange(len(columns)), columns)), 
+                                              shape = (len(columns), num_vars)).tocsr()
+            tier_suppliers = [s for s, k in tiers]
+            #tier reached if and only if the order has enough cards
+            constraints.append((orders[tier_suppliers] - unit(tier_vars).multiply(tier_items[:, None]), 0, np.inf))
+            constraints.append((orders[tier_suppliers] - unit(tier_vars) * total_cards, -np.inf, tier_items - 1))
+            #free only if the order costs enough
+            constraints.append((subtotals[free] - unit(free_vars).multiply(shipping.free_over[free][:, None]), 
+                                0, np.inf))
+            #shipping cost >= base + tiers reached, unless free
+            position = {s: n for n, s in enumerate(free)}
+            free_tiers = [n for n, (s, k) in enumerate(tiers) if s in position]
+            bound = shipping.base[free] + np.array([np.clip(np.diff(shipping.tier_costs[s]), 0, None).sum() 
+                                                    for s in free])
+            cost_rows = coo_matrix((np.concatenate((np.ones(len(free)), -shipping.base[free], bound,
+                                                    -tier_costs[free_tiers])),
+                                    (np.concatenate((np.arange(len(free)),) * 3 + 
+                                                    ([position[tiers[n][0]] for n in free_tiers],)),
+                                     np.concatenate((cost_vars, num_listings + np.array(free, dtype = int), 
+                                                     free_vars, tier_vars[free_tiers])))),
+                                   shape = (len(free), num_vars))
+            constraints.append((cost_rows, 0, np.inf))
+        
+        options = {'mip_rel_gap': self.mip_rel_gap}
+        if self.time_limit is not None:
+            options['time_limit'] = self.time_limit
+        matrices = []
+        for matrix, lower, upper_bound in constraints:
+            if matrix.shape[0]:
+                matrix = matrix.tocsr()
+                matrix.resize(matrix.shape[0], num_vars)
+                matrices.append(LinearConstraint(matrix, lower, upper_bound))
+        self.result = milp(np.concatenate(c), integrality = np.concatenate(integrality), 
+                           bounds = Bounds(0, np.concatenate(upper)), 
+                           constraints = matrices, options = options)
+        if self.result.x is None:
+            raise RuntimeError('no solution found: ' + self.result.message)
+        self.cost = self.result.fun
+        self.gap = self.result.mip_gap
+        
+        #number of copies bought from each supplier for each card
+        copies_bought = np.round(self.result.x[:num_listings]).astype(int)
+        if not shipping.flat:
+            #which copies of a supplier are bought matters for free shipping
+            self.configurations = []
+            for i in range(len(num_cards)):
+                bought = cards == i
+                config = np.repeat(listings[bought] - catalogue.offsets[i], copies_bought[bought])
+                self.configurations.append(tuple(sorted(config.tolist())))
+            return self.configurations
+        num_bought = np.zeros((len(num_cards), num_suppliers), dtype = int)
+        np.add.at(num_bought, (cards, sellers), copies_bought)
+        
+        #buy the cheapest copies of each supplier (equal cost)
+        self.configurations = []
+        for i in range(len(num_cards)):
+            config = []
+            for row, seller in catalogue.get_copies(i, num_cards[i]):
+                if num_bought[i, seller] > 0:
+                    num_bought[i, seller] -= 1
+                    config.append(int(row - catalogue.offsets[i]))
+            self.configurations.append(tuple(sorted(config)))
+        return self.configurations
+    
+    def get_solution(self):
+        """return solution as arrangement of ensemble indeces"""
+        
+        if self.result is None:
+            self.solve()
+        solution = []
+        for i, config in enumerate(self.configurations):
+            try:
+                solution.append(self.cost_calculator.ensembles[i].index(config))
+            except ValueError:
+                raise ValueError('optimum for %s is not among its ensembles' % self.cost_calculator.keys[i])
+        return np.array(solution)
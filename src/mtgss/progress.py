@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sinks for the per-generation statistics of the optimisers.
+
+Pass one as callback to GeneticAlgorithm, IslandModel or SupplierSelector.run:
+
+    with JSONLSink('run.jsonl') as sink:
+        model.run(callback = sink)
+
+Each sink is called with a dict of statistics per generation (see
+GeneticAlgorithm.__next__).
+"""
+import csv
+import json
+
+class NullSink:
+    """discards all statistics"""
+
+    def __call__(self, stats):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class JSONLSink(NullSink):
+    """writes the statistics of each generation as one line of JSON"""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def __call__(self, stats):
+        self.file.write(json.dumps(stats) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CSVSink(NullSink):
+    """writes the statistics of each generation as one row of a CSV file, with
+    a header from the keys of the first generation. Lists (diversity) are
+    written space separated."""
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline = '')
+        self.writer = None
+
+    def __call__(self, stats):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames = list(stats))
+            self.writer.writeheader()
+        self.writer.writerow({key: ' '.join(map(str, value)) if isinstance(value, list) else value
+                              for key, value in stats.items()})
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shipping cost of the order from each seller.
+
+A rule gives the shipping cost of an order from one seller:
+
+    {"base": 1.5,                  cost of any order
+     "free_over": 20,              free if the cards cost at least this much
+     "tiers": [[10, 1], [30, 3]]}  extra cost of orders of at least 10 (30) cards
+
+Rules are looked up by seller name, then by site (any part of the seller's
+URL, e.g. "magicmadhouse.co.uk"), then the default, and later ones fill in
+what earlier ones leave out. A configuration file holds them as JSON:
+
+    {"default": {"base": 1},
+     "sites": {"magicmadhouse.co.uk": {"base": 1.99, "free_over": 20}},
+     "sellers": {"cleteh": {"base": 1.2, "tiers": [[5, 0.5]]}}}
+
+For fast evaluation the rules are compiled into arrays over the sellers of a
+catalogue (see CompiledShipping).
+"""
+import json
+import numpy as np
+
+DEFAULT_RULE = {'base': 1, 'free_over': None, 'tiers': []}
+
+class ShippingModel:
+    """Shipping rules of sellers and sites"""
+
+    def __init__(self, default = None, sites = None, sellers = None):
+        """Initialise ShippingModel
+
+        Parameters
+        ----------
+        default : dict, optional
+            rule of sellers without one of their own or of their site. The
+            default is a flat cost of 1 per seller.
+        sites : dict, optional
+            part of URL:rule. The default is None.
+        sellers : dict, optional
+            seller name:rule. The default is None.
+
+        """
+
+        self.default = dict(DEFAULT_RULE, **(default or {}))
+        self.sites = sites or {}
+        self.sellers = sellers or {}
+
+    @classmethod
+    def from_config(cls, config):
+        """create ShippingModel from a dict with keys default, sites and
+        sellers, or the path of a JSON file holding one"""
+
+        if isinstance(config, cls):
+            return config
+        if isinstance(config, str):
+            with open(config, encoding = 'UTF-8') as f:
+                config = json.load(f)
+        return cls(config.get('default'), config.get('sites'), config.get('sellers'))
+
+    def to_config(self) -> dict:
+        """configuration from which from_config recreates this model"""
+
+        return {'default': dict(self.default), 'sites': dict(self.sites), 'sellers': dict(self.sellers)}
+
+    def __repr__(self):
+        return 'ShippingModel(%d site rules, %d seller rules)' % (len(self.sites), len(self.sellers))
+
+    def get_rule(self, seller, url = '') -> dict:
+        """rule of seller, whose listings link to url"""
+
+        rule = dict(self.default)
+        for site, site_rule in self.sites.items():
+            if site in url:
+                rule.update(site_rule)
+                break
+        rule.update(self.sellers.get(seller, {}))
+        return rule
+
+    def _get_rules(self):
+        return [self.default] + list(self.sites.values()) + list(self.sellers.values())
+
+    @property
+    def flat(self) -> bool:
+        """whether every order costs its base, regardless of its size"""
+
+        return all(rule.get('free_over') is None and not rule.get('tiers') for rule in self._get_rules())
+
+    @property
+    def has_free_over(self) -> bool:
+        """whether some order ships free above a value"""
+
+        return any(rule.get('free_over') is not None for rule in self._get_rules())
+
+    @property
+    def max_cost(self) -> float:
+        """highest shipping cost of an order from one seller"""
+
+        rules = self._get_rules()
+        return max(rule.get('base', 0) for rule in rules) + \
+               max([0] + [cost for rule in rules for _, cost in rule.get('tiers', [])])
+
+    @property
+    def price_window(self) -> float:
+        """how much dearer than the cheapest copies on offer a copy may be and
+        still be part of a cheapest order: moving a copy to another seller
+        changes the shipping of both sellers by at most max_cost, and only of
+        the new seller if shipping does not depend on the order's size"""
+
+        return self.max_cost if self.flat else 2 * self.max_cost
+
+    def compile(self, seller_names, seller_urls):
+        """CompiledShipping of the sellers named seller_names, whose listings
+        link to seller_urls"""
+
+        return CompiledShipping([self.get_rule(seller, url) for seller, url in zip(seller_names, seller_urls)])
+
+
+class CompiledShipping:
+    """Shipping rules of the sellers of a catalogue, as arrays indexed by
+    seller id. An extra last seller never costs anything, for padding."""
+
+    def __init__(self, rules):
+        """Initialise CompiledShipping from a rule per seller"""
+
+        num_tiers = max([0] + [len(rule['tiers']) for rule in rules])
+        self.base = np.zeros(len(rules) + 1)
+        self.free_over = np.full(len(rules) + 1, np.inf)
+        #number of cards from which each tier applies, and its extra cost
+        self.tier_items = np.full((len(rules) + 1, num_tiers + 1), np.iinfo(np.int64).max)
+        self.tier_items[:, 0] = 0
+        self.tier_costs = np.zeros((len(rules) + 1, num_tiers + 1))
+        for s, rule in enumerate(rules):
+            self.base[s] = rule['base']
+            if rule['free_over'] is not None:
+                self.free_over[s] = rule['free_over']
+            for k, (items, cost) in enumerate(sorted(rule['tiers'])):
+                self.tier_items[s, k + 1] = items
+                self.tier_costs[s, k + 1] = cost
+        self.flat = num_tiers == 0 and np.isinf(self.free_over).all()
+        #cost of an order of n cards, for n up to the highest tier (at least 1,
+        #so that non-empty orders are not clipped to the free empty order)
+        max_items = int(max([1] + [items for rule in rules for items, _ in rule['tiers']]))
+        tier = (np.arange(max_items + 1)[None, :, None] >= self.tier_items[:, None, :]).sum(-1) - 1
+        self.item_costs = self.base[:, None] + np.take_along_axis(self.tier_costs, tier, 1)
+        self.item_costs[:, 0] = 0
+
+    def __call__(self, suppliers, subtotals, items):
+        """shipping cost of orders of items cards costing subtotals from
+        suppliers (arrays of equal shape)"""
+
+        suppliers = np.asarray(suppliers)
+        items = np.asarray(items)
+        if self.flat:
+            return np.where(items > 0, self.base[suppliers], 0)
+        cost = self.item_costs[suppliers, np.minimum(items, self.item_costs.shape[1] - 1).astype(np.int64)]
+        #tolerate rounding of subtotals summed from prices
+        return np.where(np.asarray(subtotals) >= self.free_over[suppliers] - 1e-9, 0, cost)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic decks and supplier catalogues, for benchmarks and tests that run
+offline.
+"""
+import numpy as np
+import pandas as pd
+from . import tools as t
+from . import webscrape as ws
+
+def generate_cardlist(num_cards = 60, max_copies = 4, random_state = None) -> t.CardList:
+    """Generate deck of num_cards different cards, each required 1 to
+    max_copies times"""
+
+    rng = np.random.default_rng(random_state)
+    data = {'Name': ['Card %d' % i for i in range(num_cards)],
+            'Number': rng.integers(1, max_copies + 1, num_cards).tolist()}
+    return t.CardList(data)
+
+def generate_suppliers(cardlist: t.CardList, num_sellers = 100, sellers_per_card = 20,
+                       mean_stock = 3, median_price = 0.5, price_spread = 0.5,
+                       random_state = None) -> dict:
+    """Generate supplier tables for the cards of cardlist.
+
+    Parameters
+    ----------
+    cardlist : CardList
+        cards to generate suppliers of.
+    num_sellers : int, optional
+        number of sellers in the market. The default is 100.
+    sellers_per_card : int, optional
+        number of sellers listing each card. The default is 20.
+    mean_stock : float, optional
+        mean number of copies per listing (at least 1). The default is 3.
+    median_price : float, optional
+        median price of a card. Card prices are log-normal. The default is 0.5.
+    price_spread : float, optional
+        standard deviation of the log of a seller's price relative to the
+        card's price. The default is 0.5.
+    random_state : int, optional
+        seed. The default is None.
+
+    Returns
+    -------
+    dict
+        cardname:SuppliersOfCard, as get_suppliers_from_cardlist.
+
+    """
+
+    rng = np.random.default_rng(random_state)
+    suppliers_allcards = {}
+    for card in cardlist:
+        card_price = median_price * rng.lognormal(0, 1)
+        sellers = rng.choice(num_sellers, min(sellers_per_card, num_sellers), replace = False)
+        prices = np.round(card_price * rng.lognormal(0, price_spread, len(sellers)), 2) + 0.01
+        stock = 1 + rng.poisson(mean_stock - 1, len(sellers))
+        data = [['seller%d' % s,
+                 'English',
+                 'https://www.example.com/seller%d' % s,
+                 'Near Mint',
+                 'Regular',
+                 price,
+                 num] for s, price, num in sorted(zip(sellers, prices, stock), key = lambda row: row[1])]
+        supplier_db = pd.DataFrame(data, columns = ws.HEADERS)
+        suppliers_allcards[card.name] = t.SuppliersOfCard(supplier_db, card.name)
+    return suppliers_allcards
@@ -4,13 +4,17 @@
 Created on Sat Jan  2 09:59:32 2021
 
 @author: Thore
+
+pandas is imported by the functions that build tables, so that importing this
+module is fast.
 """
 #%% Imports
 import os 
-import pandas as pd
+import hashlib
+import operator
+from concurrent.futures import ThreadPoolExecutor
 from . import webscrape as ws
-from itertools import combinations
-from scipy.special import comb
+from .shipping import ShippingModel
 from random import randint
 import numpy as np
 
@@ -89,31 +93,100 @@ class SuppliersOfCard:
             self.total_cards_on_offer = 0
         
         
-    def get_all_configurations(self, num_cards):
-        """get all possible ways to buy num_cards from for this card"""
+    def get_all_configurations(self, num_cards, shipping_cost = 1, max_configurations = 10**5):
+        """get all possible ways to buy num_cards from for this card
+        
+        A configuration is a sorted tuple of listing indices, one per card bought.
+        Configurations that can never be part of a cheapest order are left out:
+        copies are bought from each seller cheapest listing first, and copies 
+        that cost more than shipping_cost above the num_cards-th cheapest copy 
+        on offer are never bought.
+
+        Parameters
+        ----------
+        num_cards : int
+            number of copies to buy.
+        shipping_cost : float, optional
+            highest shipping cost of a supplier. None keeps all copies. The default is 1.
+        max_configurations : int, optional
+            if there are more configurations, only the cheapest copies are 
+            considered. The default is 10**5.
+
+        Returns
+        -------
+        list of tuples
+            all configurations. Empty if fewer than num_cards are on offer.
+
+        """
         
-        #all options
-        options = [e for key in self.stock for s in [key]*self.stock[key] for e in [s]]
-        #get possible configs
-        #number of combinations:
-        N = comb(len(options), num_cards)
-        if N > 10E6:
-            print('Number of options too high: Compute aborted')
+        return list(self.get_configuration_space(num_cards, shipping_cost, max_configurations))
+    
+    def get_configuration_space(self, num_cards, shipping_cost = 1, max_configurations = 10**5):
+        """the configurations of get_all_configurations as a ConfigurationSpace,
+        which computes them on demand"""
+        
+        copies = self._get_copies(num_cards, shipping_cost)
+        if len(copies) < num_cards:
+            return ConfigurationSpace(self, [], num_cards)
+        
+        #keep the longest prefix of cheapest copies with few enough configurations
+        lo, hi = num_cards, len(copies)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if _count_compositions(self._get_capacities(copies[:mid], num_cards), num_cards) <= max_configurations:
+                lo = mid
+            else:
+                hi = mid - 1
+        if lo < len(copies):
+            print('Number of options too high: only cheapest %d of %d copies considered' % (lo, len(copies)))
             print(self.cardname)
-            print(N)
-            return []
-            
-        #use set to make them all unique
-        configurations = set([c for c in combinations(options, num_cards)])
-        #return list rather than set
-        return list(configurations)
+        
+        copies_per_seller = {}
+        for _, idx, seller in copies[:lo]:
+            copies_per_seller.setdefault(seller, []).append(idx)
+        return ConfigurationSpace(self, list(copies_per_seller.values()), num_cards)
+    
+    def _get_copies(self, num_cards, shipping_cost, per_seller = True):
+        """list (price, listing index, seller) of every copy on offer that may be
+        bought, cheapest first. At most num_cards copies per seller, unless 
+        per_seller is False (a dearer copy of the same seller may then be 
+        needed to reach free shipping)."""
+        
+        copies = []
+        for idx, num in self.stock.items():
+            copies.extend([(self.prices[idx], idx, self.sellers[idx])] * min(num, num_cards))
+        copies.sort(key = lambda copy: copy[:2])
+        
+        #at most num_cards per seller, cheapest first
+        num_per_seller = {}
+        copies_capped = []
+        for copy in copies:
+            num_per_seller[copy[2]] = num_per_seller.get(copy[2], 0) + 1
+            if num_per_seller[copy[2]] <= num_cards or not per_seller:
+                copies_capped.append(copy)
+        
+        #a dearer copy could be replaced by an unused one of the num_cards cheapest
+        if shipping_cost is not None and len(copies_capped) >= num_cards:
+            max_price = copies_capped[num_cards - 1][0] + shipping_cost
+            copies_capped = [copy for copy in copies_capped if copy[0] <= max_price]
+        return copies_capped
+    
+    @staticmethod
+    def _get_capacities(copies, num_cards):
+        """number of copies of each seller"""
+        
+        capacities = {}
+        for _, _, seller in copies:
+            capacities[seller] = capacities.get(seller, 0) + 1
+        return list(capacities.values())
+    
     def get_suppliers_from_config(self, configuration):
         """return suppliername:cardcost for each id in configuration"""
         out = []
         for c in configuration:
             name = self.sellers[c]
             cost = self.prices[c]
-            url = list(self.supplier_db['URL'])[c]
+            url = self.supplier_db['URL'].iat[c]
             out.append([name, cost, url])
         return out       
             
@@ -130,16 +203,224 @@ class SuppliersOfCard:
         
         return [self.sellers[i] for i in configuration]
     
+class ConfigurationSpace:
+    """Sequence of the configurations of a card, computed on demand.
+    
+    A configuration buys k[g] copies from each seller g, the k[g] first listings
+    of copies_per_seller[g]. Configurations are numbered in the order of 
+    _iter_compositions, and converted from and to their number by counting 
+    the configurations of the remaining sellers, so no list of them is built."""
+    
+    def __init__(self, suppliers, copies_per_seller, num_cards):
+        """Initialise ConfigurationSpace
+        
+        Parameters
+        ----------
+        suppliers : SuppliersOfCard
+            suppliers of the card.
+        copies_per_seller : list of lists
+            listing index of each copy that may be bought from each seller, 
+            cheapest first.
+        num_cards : int
+            number of copies to buy."""
+        
+        self.cardname = suppliers.cardname
+        self.copies_per_seller = copies_per_seller
+        self.num_cards = num_cards
+        num_sellers = len(copies_per_seller)
+        capacities = [min(len(c), num_cards) for c in copies_per_seller]
+        
+        #ways[g, r]: number of ways to buy r copies from sellers g and after
+        ways = np.zeros((num_sellers + 1, num_cards + 1), dtype = np.int64)
+        ways[num_sellers, 0] = 1
+        #for seller g and r copies left, the choices of k[g] in numbering order,
+        #and the number of the first configuration with each choice
+        self._choices = np.zeros((num_sellers, num_cards + 1, num_cards + 1), dtype = np.int64)
+        self._starts = np.full((num_sellers, num_cards + 1, num_cards + 1), np.iinfo(np.int64).max)
+        for g in range(num_sellers - 1, -1, -1):
+            for r in range(num_cards + 1):
+                choices = list(range(1, min(capacities[g], r) + 1)) + [0]
+                counts = ways[g + 1, [r - k for k in choices]]
+                self._choices[g, r, :len(choices)] = choices
+                self._starts[g, r, :len(choices)] = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                ways[g, r] = counts.sum()
+        self._size = int(ways[0, num_cards])
+        
+        #listing index of j-th copy of seller g, padded
+        self._listings = np.zeros((num_sellers, num_cards), dtype = np.int64)
+        self._costs = np.zeros((num_sellers, num_cards + 1))
+        for g, copies in enumerate(copies_per_seller):
+            self._listings[g, :capacities[g]] = copies[:capacities[g]]
+            #cost of the k first copies
+            self._costs[g, 1:capacities[g] + 1] = np.cumsum(suppliers.prices[copies[:capacities[g]]])
+    
+    def __repr__(self):
+        return 'ConfigurationSpace(%s, %d of %d)' % (self.cardname, self.num_cards, self._size)
+    
+    def __len__(self):
+        return self._size
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [tuple(c) for c in self.get_listings(np.arange(self._size)[i])]
+        i = operator.index(i)
+        if not -self._size <= i < self._size:
+            raise IndexError('configuration index out of range')
+        return tuple(self.get_listings(np.array([i % self._size]))[0].tolist())
+    
+    def __iter__(self):
+        for composition in _iter_compositions([min(len(c), self.num_cards) for c in self.copies_per_seller], 
+                                              self.num_cards):
+            yield tuple(sorted(idx for g, k in composition for idx in self.copies_per_seller[g][:k]))
+    
+    def get_numbers(self, indices):
+        """number of copies bought from each seller in configurations indices, 
+        shape (len(indices), number of sellers)"""
+        
+        indices = np.array(indices, dtype = np.int64)
+        remaining = np.full(len(indices), self.num_cards)
+        numbers = np.zeros((len(indices), len(self.copies_per_seller)), dtype = np.int64)
+        for g in range(len(self.copies_per_seller)):
+            starts = self._starts[g, remaining]
+            choice = (indices[:, None] >= starts).sum(1) - 1
+            numbers[:, g] = self._choices[g, remaining, choice]
+            indices -= starts[np.arange(len(indices)), choice]
+            remaining -= numbers[:, g]
+        return numbers
+    
+    def get_listings(self, indices):
+        """sorted listing indices of configurations indices, shape 
+        (len(indices), num_cards)"""
+        
+        numbers = self.get_numbers(indices)
+        listings = np.zeros((len(numbers), self.num_cards), dtype = np.int64)
+        filled = np.zeros(len(numbers), dtype = np.int64)
+        rows = np.arange(len(numbers))
+        for g in range(len(self.copies_per_seller)):
+            for j in range(numbers[:, g].max(initial = 0)):
+                bought = numbers[:, g] > j
+                listings[rows[bought], filled[bought]] = self._listings[g, j]
+                filled += bought
+        return np.sort(listings, 1)
+    
+    def get_costs(self, indices):
+        """card cost of configurations indices"""
+        
+        numbers = self.get_numbers(indices)
+        return self._costs[np.arange(numbers.shape[1]), numbers].sum(1)
+    
+    def index(self, configuration):
+        """number of configuration (listing indices). Raises ValueError if it
+        is not in the space"""
+        
+        group = {idx: (g, j) for g, copies in enumerate(self.copies_per_seller) 
+                 for j, idx in enumerate(copies[:self.num_cards])}
+        numbers = np.zeros(len(self.copies_per_seller), dtype = np.int64)
+        for idx in configuration:
+            if idx not in group:
+                raise ValueError('%s is not a configuration of %s' % (configuration, self.cardname))
+            numbers[group[idx][0]] += 1
+        if len(configuration) != self.num_cards or tuple(sorted(configuration)) != \
+                tuple(sorted(self.copies_per_seller[g][j] for g, k in enumerate(numbers) for j in range(k))):
+            raise ValueError('%s is not a configuration of %s' % (configuration, self.cardname))
+        
+        number = 0
+        remaining = self.num_cards
+        for g, k in enumerate(numbers):
+            choice = list(self._choices[g, remaining]).index(k)
+            number += self._starts[g, remaining, choice]
+            remaining -= k
+        return int(number)
+    
+
+class Catalogue:
+    """Columnar table of all listings of all cards.
+    
+    Listings of card i are rows offsets[i]:offsets[i+1] of the arrays prices,
+    stock, card_ids, seller_ids and url_ids, in the order of the card's 
+    supplier table. Seller names and URLs are stored once in string tables,
+    with the URL of each seller's first listing in seller_urls."""
+    
+    def __init__(self, suppliers_allcards: dict, cardnames = None):
+        """Initialise Catalogue
+        
+        Parameters
+        ----------
+        suppliers_allcards : dict
+            dictionary of cardname:SuppliersOfCard.
+        cardnames : list, optional
+            cards to include, in this order. The default is all cards."""
+        
+        self.cardnames = list(suppliers_allcards) if cardnames is None else list(cardnames)
+        seller_ids = {}
+        url_ids = {}
+        prices, stock, sellers, urls, sizes, seller_urls = [], [], [], [], [], []
+        for cardname in self.cardnames:
+            suppliers = suppliers_allcards[cardname]
+            num_listings = len(suppliers.prices)
+            prices.extend(suppliers.prices)
+            stock.extend(suppliers.stock.get(idx, 0) for idx in range(num_listings))
+            card_urls = list(suppliers.supplier_db['URL'][:num_listings])
+            for name, url in zip(suppliers.sellers, card_urls):
+                if name not in seller_ids:
+                    seller_ids[name] = len(seller_ids)
+                    seller_urls.append(url)
+                sellers.append(seller_ids[name])
+            urls.extend(url_ids.setdefault(url, len(url_ids)) for url in card_urls)
+            sizes.append(num_listings)
+        
+        self.offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        self.prices = np.array(prices, dtype = np.float64)
+        self.stock = np.array(stock, dtype = np.int32)
+        self.card_ids = np.repeat(np.arange(len(sizes), dtype = np.int32), sizes)
+        self.seller_ids = np.array(sellers, dtype = np.int32)
+        self.url_ids = np.array(urls, dtype = np.int32)
+        self.seller_names = list(seller_ids)
+        self.seller_urls = seller_urls
+        self.urls = list(url_ids)
+    
+    def __repr__(self):
+        return 'Catalogue(%d cards, %d listings, %d sellers)' % (
+            len(self.cardnames), len(self.prices), len(self.seller_names))
+    
+    def __len__(self):
+        """return number of listings"""
+        
+        return len(self.prices)
+    
+    def get_listings(self, i):
+        """return slice of rows of card i"""
+        
+        return slice(self.offsets[i], self.offsets[i + 1])
+    
+    def get_copies(self, i, num_cards):
+        """list (row, seller id) of every copy of card i on offer, cheapest 
+        first. At most num_cards per listing and per seller."""
+        
+        rows = np.arange(self.offsets[i], self.offsets[i + 1])
+        rows = rows[np.lexsort((rows, self.prices[rows]))]
+        copies = []
+        num_per_seller = {}
+        for row in rows:
+            seller = self.seller_ids[row]
+            num = min(self.stock[row], num_cards - num_per_seller.get(seller, 0))
+            if num > 0:
+                num_per_seller[seller] = num_per_seller.get(seller, 0) + num
+                copies.extend([(row, seller)] * num)
+        return copies
+    
+
 class CostCalculator:
     """Class that takes in some choice of cards and computes the cost"""
     
-    def __init__(self, suppliers_allcards, all_ensembles_dict):
-        """Initialise CostCalculater Class"""
+    def __init__(self, suppliers_allcards, all_ensembles_dict, shipping = None):
+        """Initialise CostCalculater Class. shipping is a ShippingModel (or its
+        configuration, see ShippingModel.from_config), by default a flat cost 
+        of 1 per supplier."""
         
         keys = []
         ensembles = []
         ensemble_sizes = []
-        suppliers = []
         for key in all_ensembles_dict:
             ensemble_size = len(all_ensembles_dict[key])
             if ensemble_size == 0: #we ignore cards that we cannot buy
@@ -148,33 +429,170 @@ class CostCalculator:
             keys.append(key)
             ensembles.append(all_ensembles_dict[key])
             ensemble_sizes.append(ensemble_size)
-            suppliers.append(suppliers_allcards[key])
             
-        self.suppliers = suppliers
+        self.catalogue = Catalogue(suppliers_allcards, keys)
         self.ensembles = ensembles
         self.ensemble_sizes = ensemble_sizes
         self.keys = keys
-        self.shipping_cost = 1
+        self.shipping_model = ShippingModel() if shipping is None else ShippingModel.from_config(shipping)
+        #shipping rules as arrays indexed by supplier id
+        self.shipping = self.shipping_model.compile(self.catalogue.seller_names, self.catalogue.seller_urls)
+        #highest shipping cost of a supplier
+        self.shipping_cost = self.shipping_model.max_cost
+        self._build_lookup_tables()
+    
+    def _build_lookup_tables(self):
+        """Precompute, for each card, the catalogue rows, the card cost and the 
+        suppliers of every configuration so populations can be costed in bulk.
+        
+        These tables hold every configuration of a ConfigurationSpace, which 
+        is deliberate: costing a population then takes a lookup per gene 
+        instead of unranking each configuration again. They are kept small 
+        (about 60 bytes per configuration of a card of 3 copies, see 
+        benchmarks/bench_mtgss.py) by storing each supplier of a configuration
+        once, with the cost and number of the cards bought from it, in the 
+        smallest integer types that hold them."""
+        
+        self.config_listings = []
+        self.config_costs = []
+        #distinct supplier ids, padded with len(supplier_names), and the cost 
+        #and number of the cards bought from each
+        self.config_distinct_supplier_ids = []
+        self.config_distinct_subtotals = []
+        self.config_distinct_items = []
+        self.supplier_names = self.catalogue.seller_names
+        for i, ensemble in enumerate(self.ensembles):
+            #config index -> catalogue rows, shape (num_configs, num_cards)
+            if isinstance(ensemble, ConfigurationSpace):
+                configs = self.catalogue.offsets[i] + ensemble.get_listings(np.arange(len(ensemble)))
+            else:
+                configs = self.catalogue.offsets[i] + np.array(ensemble, dtype = np.int64)
+            self.config_listings.append(configs.astype(np.int32))
+            self.config_costs.append(self.catalogue.prices[configs].sum(1))
+            
+            #group cards of each configuration by supplier
+            supplier_ids = self.catalogue.seller_ids[configs]
+            order = np.argsort(supplier_ids, 1, kind = 'stable')
+            ids = np.take_along_axis(supplier_ids, order, 1)
+            prices = np.take_along_axis(self.catalogue.prices[configs], order, 1)
+            first = np.ones(ids.shape, dtype = bool)
+            first[:, 1:] = ids[:, 1:] != ids[:, :-1]
+            group = (np.arange(len(ids))[:, None] * ids.shape[1] + np.cumsum(first, 1) - 1).ravel()
+            distinct = np.full(ids.size, len(self.supplier_names), dtype = np.int32)
+            distinct[group] = ids.ravel()
+            self.config_distinct_supplier_ids.append(distinct.reshape(ids.shape))
+            self.config_distinct_subtotals.append(np.bincount(group, prices.ravel(), ids.size).reshape(ids.shape))
+            self.config_distinct_items.append(np.bincount(group, minlength = ids.size).astype(np.int16)
+                                              .reshape(ids.shape))
+        self._stack_lookup_tables()
+    
+    def _stack_lookup_tables(self):
+        """Stack the lookup tables of all cards into flat arrays, so that a 
+        population is costed with a few lookups instead of one per card. The 
+        tables of each card become views of the stacked ones.
+        
+        Configuration j of card i is entry config_offsets[i] + j of 
+        stacked_costs. Its suppliers, and the cost and number of the cards 
+        bought from each, are the widths[i] entries of stacked_supplier_ids, 
+        stacked_subtotals and stacked_items from table_offsets[i] + 
+        j * widths[i] on."""
+        
+        sizes = np.array([len(costs) for costs in self.config_costs], dtype = np.int64)
+        self.config_offsets = np.cumsum(sizes) - sizes
+        self.stacked_costs = np.concatenate(self.config_costs + [np.zeros(0)])
+        self.config_costs = [self.stacked_costs[start:start + size] 
+                             for start, size in zip(self.config_offsets, sizes)]
+        self.widths = np.array([ids.shape[1] for ids in self.config_distinct_supplier_ids], dtype = np.int64)
+        self.table_offsets = np.cumsum(sizes * self.widths) - sizes * self.widths
+        for name, dtype in (('supplier_ids', np.int32), ('subtotals', np.float64), ('items', np.int16)):
+            tables = getattr(self, 'config_distinct_' + name)
+            stacked = np.concatenate([table.ravel() for table in tables] + [np.zeros(0, dtype = dtype)])
+            for i, (start, size, width) in enumerate(zip(self.table_offsets, sizes, self.widths)):
+                tables[i] = stacked[start:start + size * width].reshape(size, width)
+            setattr(self, 'stacked_' + name, stacked)
+        #position of each entry of a configuration among those of its card
+        self._table_positions = np.concatenate([np.arange(width) for width in self.widths] + 
+                                               [np.zeros(0, dtype = np.int64)])
+    
+    def _get_table_index(self, population):
+        """index of the stacked table entries of the configurations of each 
+        row of population, concatenated"""
+        
+        starts = self.table_offsets + population * self.widths
+        return np.repeat(starts, self.widths, axis = 1) + self._table_positions
+    
+    def fingerprint(self) -> str:
+        """hash of the catalogue, the configurations of each card and the 
+        shipping rules, which together give each arrangement its meaning"""
+        
+        digest = hashlib.sha256()
+        for names in (self.keys, self.supplier_names):
+            digest.update('\0'.join(names).encode() + b'\1')
+        for array in (self.catalogue.offsets, self.catalogue.prices, self.catalogue.stock,
+                      self.catalogue.seller_ids, self.shipping.base, self.shipping.free_over,
+                      self.shipping.item_costs, *[listings.astype(np.int64) for listings in self.config_listings]):
+            digest.update(np.ascontiguousarray(array).tobytes() + str(array.shape).encode())
+        return digest.hexdigest()
     
     def get_cost(self, sample: list):
         """Calculate cost of ordering all cards for a given ensemble."""
         
-        selected_suppliers = []
-        cost_cards_only = 0
-        #for each card, get idx which corresponds to a possible Seller config
-        for i, j in enumerate(sample): 
-            #get which Seller configuration
-            config = self.ensembles[i][j]
-            #get cost for each seller
-            cost = self.suppliers[i].get_cost_no_shipping(config)
-            cost_cards_only += cost
-            #append list of suppliers
-            selected_suppliers.extend(self.suppliers[i].get_supplier_names(config))
-        
-        #get set of all suppliers and multiply by shipping cost for each supplier
-        cost_shipping = len(set(selected_suppliers)) *  self.shipping_cost
+        cost_cards_only, cost_shipping = self.get_cost_batch(np.array(sample, dtype = np.int64, ndmin = 2))
+        return(cost_cards_only[0], cost_shipping[0])
+    
+    def get_cost_batch(self, population):
+        """Calculate cost of a whole population of ensembles at once.
+
+        Parameters
+        ----------
+        population : array
+            (N, num_cards) array of configuration indices, one row per ensemble.
+
+        Returns
+        -------
+        tuple of arrays
+            card cost and shipping cost of each row.
+        """
+        
+        population = np.asarray(population)
+        cost_cards_only = self.stacked_costs[self.config_offsets + population].sum(1)
+        index = self._get_table_index(population)
+        
+        #suppliers of each row, padded with the dummy len(supplier_names)
+        selected_suppliers = self.stacked_supplier_ids[index]
+        if self.shipping.flat:
+            #base cost of distinct suppliers per row: changes along sorted rows
+            selected_suppliers.sort(1)
+            first = np.ones(selected_suppliers.shape, dtype = bool)
+            first[:, 1:] = selected_suppliers[:, 1:] != selected_suppliers[:, :-1]
+            cost_shipping = (self.shipping.base[selected_suppliers] * first).sum(1)
+            return(cost_cards_only, cost_shipping)
+        
+        #subtotal and number of cards of each supplier per row
+        num_suppliers = len(self.supplier_names) + 1
+        keys = (np.arange(len(population))[:, None] * num_suppliers + selected_suppliers).ravel()
+        items = np.bincount(keys, self.stacked_items[index].ravel(), len(population) * num_suppliers)
+        subtotals = np.bincount(keys, self.stacked_subtotals[index].ravel(), len(population) * num_suppliers)
+        orders = np.flatnonzero(items)
+        costs = self.shipping(orders % num_suppliers, subtotals[orders], items[orders].astype(np.int64))
+        cost_shipping = np.bincount(orders // num_suppliers, costs, len(population))
         
         return(cost_cards_only, cost_shipping)
+    
+    def get_shipping(self, solution) -> 'pd.Series':
+        """shipping cost of each supplier of solution (see decode_arrangement)"""
+        import pandas as pd
+        
+        orders = solution.groupby('supplier')['cost'].agg(['sum', 'count'])
+        supplier_ids = {name: s for s, name in enumerate(self.supplier_names)}
+        costs = self.shipping([supplier_ids[name] for name in orders.index], 
+                              orders['sum'].to_numpy(), orders['count'].to_numpy())
+        return pd.Series(costs, index = orders.index, name = 'shipping')
+    
+    def get_total_cost_batch(self, population):
+        """Calculate total cost (cards + shipping) of a whole population"""
+        
+        return np.sum(self.get_cost_batch(population), 0)
             
     def generate_arrangement(self):
         """Generate a random ensemble of buying configurations"""
@@ -182,84 +600,630 @@ class CostCalculator:
         return [randint(0, upper_limit - 1) for upper_limit in self.ensemble_sizes]
     
     def generate_min_card_cost_arrangement(self):
-        """Generate a ensemble with minimum cost_cards_only
-        takes entries with lowest index.
-        Assumes cards are sorted by price in ascending order"""
+        """Generate a ensemble with minimum cost_cards_only"""
         
-        return [np.argmin(np.sum(np.array(e),1)) for e in self.ensembles]
+        return [int(np.argmin(costs)) for costs in self.config_costs]
     
-    def decode_arrangement(self, solution) -> pd.DataFrame:
+    def generate_greedy_arrangement(self, arrangement = None, max_passes = 10):
+        """Improve an arrangement (default: minimum card cost) by local search.
+        One card at a time is changed to the configuration with the lowest 
+        total cost given the suppliers of all other cards, which moves cards 
+        onto suppliers already used when that saves more than shipping.
+        Stops when no single card change lowers the cost."""
+        
+        if arrangement is None:
+            arrangement = self.generate_min_card_cost_arrangement()
+        arrangement = np.array(arrangement)
+        #cost and number of cards bought from each supplier, plus a padding dummy
+        subtotals = np.zeros(len(self.supplier_names) + 1)
+        items = np.zeros(len(self.supplier_names) + 1, dtype = int)
+        def add(i, j, sign):
+            np.add.at(subtotals, self.config_distinct_supplier_ids[i][j], sign * self.config_distinct_subtotals[i][j])
+            np.add.at(items, self.config_distinct_supplier_ids[i][j], sign * self.config_distinct_items[i][j])
+        for i, j in enumerate(arrangement):
+            add(i, j, 1)
+        
+        for n in range(max_passes):
+            improved = False
+            for i in range(len(arrangement)):
+                add(i, arrangement[i], -1)
+                costs = self.get_marginal_costs(i, subtotals, items)
+                j = np.argmin(costs)
+                if costs[j] < costs[arrangement[i]] - 1e-9:
+                    arrangement[i] = j
+                    improved = True
+                add(i, arrangement[i], 1)
+            if not improved:
+                break
+        return arrangement
+    
+    def get_marginal_costs(self, i, subtotals, items):
+        """cost of each configuration of card i, including the change of 
+        shipping cost of the orders from each supplier, which without card i 
+        cost subtotals and contain items cards (arrays with one entry per 
+        supplier plus a padding dummy)"""
+        
+        distinct = self.config_distinct_supplier_ids[i]
+        if self.shipping.flat:
+            #only suppliers not yet used add shipping
+            opening = np.where(items == 0, self.shipping.base, 0)
+            return self.config_costs[i] + opening[distinct].sum(1)
+        before =self.shipping(distinct, subtotals[distinct], items[distinct])
+        after = self.shipping(distinct, subtotals[distinct] + self.config_distinct_subtotals[i],
+                              items[distinct] + self.config_distinct_items[i])
+        return self.config_costs[i] + (after - before).sum(1)
+    
+    def generate_seed_population(self, num, random_state = None, num_restarts = 10):
+        """Generate num good arrangements to seed an optimiser with: the 
+        minimum card cost arrangement, greedy local optima from it and from 
+        num_restarts perturbations of it, and perturbations of these."""
+        
+        rng = np.random.default_rng(random_state)
+        bounds = np.array(self.ensemble_sizes) - 1
+        #each gene mutates with a chance of 2/num_genes
+        mutation_rate = min(1, 2 / max(len(bounds), 1))
+        def perturb(population):
+            mutate = rng.random(population.shape) < mutation_rate
+            return np.where(mutate, rng.integers(0, bounds + 1, population.shape), population)
+        
+        cheapest = np.array(self.generate_min_card_cost_arrangement())
+        greedy = self.generate_greedy_arrangement(cheapest)
+        local_optima = [cheapest, greedy]
+        for n in range(num_restarts):
+            local_optima.append(self.generate_greedy_arrangement(perturb(greedy[None, :])[0]))
+        local_optima = np.array(local_optima)[:num]
+        
+        #fill up with perturbed local optima
+        parents = local_optima[rng.integers(0, len(local_optima), num - len(local_optima))]
+        return np.concatenate((local_optima, perturb(parents)))
+    
+    def decode_arrangement(self, solution) -> 'pd.DataFrame':
         """take an arrangement of ensemble indeces and translate to suppliers"""
-        sol = {}
-        for i, idx in enumerate(solution):
-            cardname = self.keys[i]
-            config = self.ensembles[i][idx]
-            sol[cardname] =  self.suppliers[i].get_suppliers_from_config(config)
         
-        #turn dict into DataFrame
+        return self.decode_configurations([self.ensembles[i][idx] for i, idx in enumerate(solution)])
+    
+    def decode_configurations(self, configurations) -> 'pd.DataFrame':
+        """take a configuration (tuple of listing indeces) for each card and 
+        translate to suppliers"""
+        import pandas as pd
+        
+        catalogue = self.catalogue
         headers = ['supplier', 'cardname', 'cost', 'url']    
         entries = []
-        for key in sol:
-            card = key
-            for supplier, cost, url in sol[key]:
-                entries.append([supplier, card, cost, url])
+        for i, config in enumerate(configurations):
+            for row in catalogue.offsets[i] + np.array(config, dtype = np.int64):
+                entries.append([catalogue.seller_names[catalogue.seller_ids[row]],
+                                self.keys[i],
+                                catalogue.prices[row],
+                                catalogue.urls[catalogue.url_ids[row]]])
         
         return pd.DataFrame(entries, columns = headers)
 
 
+class IncrementalCost:
+    """Cost function of a population that is updated gene by gene.
+    
+    Keeps, for each individual of the last evaluated population, its card cost,
+    its shipping cost and the number (and, unless shipping is flat, the cost) 
+    of the cards bought from each supplier. Changing a gene then only touches 
+    the cards of that gene and the shipping of their suppliers.
+    
+    The state of each individual is a row (slot) of these arrays. Individuals
+    derived unchanged keep the slot of their parent, so that only the slots 
+    of changed individuals are copied and updated. While many genes change 
+    between generations (early in a run) costing from scratch is faster, so 
+    populations are then costed by CostCalculator.get_total_cost_batch and 
+    the state is only built once few genes change."""
+    
+    def __init__(self, cost_calculator: CostCalculator, max_changed = None):
+        """Initialise IncrementalCost. Populations in which more than a 
+        fraction max_changed of the genes changed (twice that once the state 
+        is built) are costed from scratch. The default is 0.05, or 0.2 if 
+        shipping is not flat (and costing from scratch slower)."""
+        
+        cc = cost_calculator
+        self.cost_calculator = cc
+        self.num_suppliers = len(cc.supplier_names)
+        if max_changed is None:
+            max_changed = 0.05 if cc.shipping.flat else 0.2
+        self.max_changed = max_changed
+        self.population = None
+        self.slots = None #slot of each individual, None until the state is built
+    
+    def __call__(self, population):
+        """compute total cost of population from scratch"""
+        
+        self.population = np.array(population)
+        self.slots = None
+        return self.cost_calculator.get_total_cost_batch(self.population)
+    
+    def _build(self):
+        """build the state of the current population"""
+        
+        cc = self.cost_calculator
+        n = len(self.population)
+        num_columns = self.num_suppliers + 1
+        self.slots = np.arange(n)
+        self.card_cost, self.shipping_cost = cc.get_cost_batch(self.population)
+        index = cc._get_table_index(self.population)
+        keys = (self.slots[:, None] * num_columns + cc.stacked_supplier_ids[index]).ravel()
+        self.supplier_counts = np.bincount(keys, cc.stacked_items[index].ravel(), 
+                                           n * num_columns).astype(np.int16).reshape(n, num_columns)
+        self.supplier_subtotals = None
+        if not cc.shipping.flat:
+            self.supplier_subtotals = np.bincount(keys, cc.stacked_subtotals[index].ravel(), 
+                                                  n * num_columns).reshape(n, num_columns)
+    
+    def get_fitness(self):
+        """total cost of the current population"""
+        
+        if self.slots is None:
+            self._build()
+        return self.card_cost[self.slots] + self.shipping_cost[self.slots]
+    
+    def derive(self, parents, population):
+        """compute total cost of population, whose row k was derived from row
+        parents[k] of the last evaluated population by changing some genes.
+        Only the state of the rows that changed is copied, and only the genes
+        that changed are costed."""
+        
+        population = np.array(population)
+        changed = population != self.population[parents]
+        #once built, the state is kept unless far more genes change
+        max_changed = self.max_changed if self.slots is None else 2 * self.max_changed
+        if np.count_nonzero(changed) > max_changed * changed.size:
+            return self(population)
+        if self.slots is None:
+            self._build()
+        parent_slots = self.slots[parents]
+        rows, genes = np.nonzero(changed)
+        old_configs = self.population[parents[rows], genes]
+        
+        #the first unchanged child of a parent takes over its slot, every 
+        #other child gets a copy of its parent's state in an unused slot
+        unchanged = np.ones(len(population), dtype = bool)
+        unchanged[rows] = False
+        kept = np.flatnonzero(unchanged)
+        kept = kept[np.unique(parent_slots[kept], return_index = True)[1]]
+        copied = np.ones(len(population), dtype = bool)
+        copied[kept] = False
+        copied = np.flatnonzero(copied)
+        used = np.zeros(len(self.card_cost), dtype = bool)
+        used[parent_slots[kept]] = True
+        free = np.flatnonzero(~used)
+        if len(free) < len(copied):
+            self._grow(len(copied) - len(free))
+            free = np.concatenate((free, np.arange(len(used), len(self.card_cost))))
+        free = free[:len(copied)]
+        for array in (self.card_cost, self.shipping_cost, self.supplier_counts, self.supplier_subtotals):
+            if array is not None:
+                array[free] = array[parent_slots[copied]]
+        self.slots = np.empty(len(population), dtype = np.int64)
+        self.slots[kept] = parent_slots[kept]
+        self.slots[copied] = free
+        
+        self.population = population
+        self._update(rows, genes, old_configs, population[rows, genes])
+        return self.get_fitness()
+    
+    def _grow(self, n):
+        """add n unused slots"""
+        
+        self.card_cost = np.concatenate((self.card_cost, np.zeros(n)))
+        self.shipping_cost = np.concatenate((self.shipping_cost, np.zeros(n)))
+        self.supplier_counts = np.concatenate((self.supplier_counts, 
+                                               np.zeros((n, self.num_suppliers + 1), dtype = np.int16)))
+        if self.supplier_subtotals is not None:
+            self.supplier_subtotals = np.concatenate((self.supplier_subtotals, 
+                                                      np.zeros((n, self.num_suppliers + 1))))
+    
+    def _update(self, rows, genes, old_configs, new_configs):
+        """change gene genes[m] of row rows[m] of the population from 
+        old_configs[m] to new_configs[m], updating the state of the rows' 
+        slots"""
+        
+        cc = self.cost_calculator
+        num_slots = len(self.card_cost)
+        slots = self.slots[rows]
+        card_change = (cc.stacked_costs[cc.config_offsets[genes] + new_configs] - 
+                       cc.stacked_costs[cc.config_offsets[genes] + old_configs])
+        self.card_cost += np.bincount(slots, card_change, num_slots)
+        
+        #stacked table entries of the old and new configurations (see 
+        #CostCalculator._stack_lookup_tables), added and subtracted resp.
+        widths = np.tile(cc.widths[genes], 2)
+        ends = np.cumsum(widths)
+        starts = np.concatenate((cc.table_offsets[genes] + new_configs * cc.widths[genes], 
+                                 cc.table_offsets[genes] + old_configs * cc.widths[genes]))
+        index = np.repeat(starts - ends + widths, widths) + np.arange(ends[-1] if len(ends) else 0)
+        signs = np.repeat(np.repeat([1, -1], len(genes)), widths)
+        
+        #change of the number and cost of the cards of each (slot, supplier)
+        keys = np.repeat(np.tile(slots, 2), widths) * (self.num_suppliers + 1) + cc.stacked_supplier_ids[index]
+        size = num_slots * (self.num_suppliers + 1)
+        item_change = np.bincount(keys, signs * cc.stacked_items[index], size)
+        if self.supplier_subtotals is None:
+            subtotal_change = 0
+            touched = np.flatnonzero(item_change != 0)
+        else:
+            subtotal_change = np.bincount(keys, signs * cc.stacked_subtotals[index], size)
+            touched = np.flatnonzero((item_change != 0) | (subtotal_change != 0))
+        
+        #shipping changes only for the suppliers whose orders changed
+        counts = self.supplier_counts.reshape(-1)
+        touched_slots, suppliers = np.divmod(touched, self.num_suppliers + 1)
+        if self.supplier_subtotals is None:
+            before = cc.shipping(suppliers, 0, counts[touched])
+            counts[touched] += item_change[touched].astype(np.int16)
+            after = cc.shipping(suppliers, 0, counts[touched])
+        else:
+            subtotals = self.supplier_subtotals.reshape(-1)
+            before = cc.shipping(suppliers, subtotals[touched], counts[touched])
+            counts[touched] += item_change[touched].astype(np.int16)
+            subtotals[touched] += subtotal_change[touched]
+            after = cc.shipping(suppliers, subtotals[touched], counts[touched])
+        self.shipping_cost += np.bincount(touched_slots, after - before, num_slots)
+    
+    def get_move_delta(self, k, i, j):
+        """change of total cost of individual k if gene i is set to j"""
+        
+        cc = self.cost_calculator
+        if self.slots is None:
+            self._build()
+        slot = self.slots[k]
+        old = self.population[k, i]
+        ids = np.concatenate((cc.config_distinct_supplier_ids[i][old], cc.config_distinct_supplier_ids[i][j]))
+        items = np.concatenate((-cc.config_distinct_items[i][old], cc.config_distinct_items[i][j]))
+        subtotals = np.concatenate((-cc.config_distinct_subtotals[i][old], cc.config_distinct_subtotals[i][j]))
+        ids, inverse = np.unique(ids, return_inverse = True)
+        counts = self.supplier_counts[slot, ids]
+        before = 0 if self.supplier_subtotals is None else self.supplier_subtotals[slot, ids]
+        after = before + np.bincount(inverse, subtotals, len(ids))
+        shipping_change = (cc.shipping(ids, after, counts + np.bincount(inverse, items, len(ids)).astype(int)) -
+                           cc.shipping(ids, before, counts)).sum()
+        return cc.stacked_costs[cc.config_offsets[i] + j] - cc.stacked_costs[cc.config_offsets[i] + old] + shipping_change
+    
+    def move(self, k, i, j):
+        """set gene i of individual k to j and update its cost"""
+        
+        if self.slots is None:
+            self._build()
+        old = self.population[k, i]
+        self.population[k, i] = j
+        self._update(np.array([k]), np.array([i]), np.array([old]), np.array([j]))
+        
+
 #%% Functions
-def _parse_cod(filename) -> CardList: 
-    """Parse .COD filetypes (cockatric format .xml)
-    Imports all cards anywhere in the deck
+def _count_compositions(capacities, total) -> int:
+    """number of ways to write total as sum of k[g], 0 <= k[g] <= capacities[g]"""
+    
+    #ways[r]: number of ways to make r from the capacities so far
+    ways = [1] + [0] * total
+    for capacity in capacities:
+        ways = [sum(ways[r - k] for k in range(min(capacity, r) + 1)) for r in range(total + 1)]
+    return ways[total]
+
+def _iter_compositions(capacities, total):
+    """generate all ways to write total as sum of k[g], 0 <= k[g] <= capacities[g].
+    Yields tuples of (g, k[g]) pairs of the non-zero k[g]."""
+    
+    #capacity of groups g and after
+    remaining = np.cumsum(capacities[::-1])[::-1].tolist() + [0]
+    
+    def compositions(start, total):
+        if total == 0:
+            yield ()
+            return
+        for g in range(start, len(capacities)):
+            if remaining[g] < total:
+                return
+            for k in range(1, min(capacities[g], total) + 1):
+                for tail in compositions(g + 1, total - k):
+                    yield ((g, k),) + tail
+    
+    return compositions(0, total)
+
+def _iter_cod(filename):
+    """Parse .COD filetypes (cockatric format .xml) card by card.
+    Yields all cards anywhere in the deck
     """
     import xml.etree.ElementTree as et 
-    xtree = et.parse(filename)
-    xroot = xtree.getroot()
-    xcards = xroot.findall('.//card') #find all cards in tree
-    card_names = []
-    card_numbers = []
-    #get card name and number of cards and append to list
-    for xcard in xcards:
-        card_numbers.append(int(xcard.attrib.get('number')))
-        card_names.append(xcard.attrib.get('name'))
-    #turn list of cards into dataframe
-    data = {'Name': card_names, 
-            'Number': card_numbers}
-
-    return(CardList(data))
+    for _, element in et.iterparse(filename):
+        if element.tag == 'card':
+            yield Card(element.get('name'), int(element.get('number', 1)))
+            element.clear() #free parsed cards of large files
+    
+#section headers of plain text lists (sb: a sideboard marker without a card)
+_TEXT_SECTIONS = {'deck', 'main', 'mainboard', 'sideboard', 'sb', 'commander', 'companion', 'maybeboard'}
+
+def _iter_text(filename):
+    """Parse plain text lists (.dec, .txt), one card per line:
+    
+        4 Lightning Bolt
+        4x Counterspell
+        SB: 2 Duress
+        1 [M10] Island
+        2 Opt (XLN) 65
+        Plains
+    
+    A line without a number is one copy. Empty lines, comments (starting 
+    with // or #) and section headers (e.g. Sideboard, or SB: without a card)
+    are skipped."""
+    import re
+    line_format = re.compile(r'(?:SB:\s*)?(?:(\d+)x?\s+)?(?:\[[^\]]*\]\s*)?(.+?)(?:\s+\([A-Za-z0-9]+\)(?:\s+\S+)?)?')
+    with open(filename, encoding = 'UTF-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(('//', '#')) or line.rstrip(':').lower() in _TEXT_SECTIONS:
+                continue
+            number, name = line_format.fullmatch(line).groups()
+            yield Card(name, int(number or 1))
+
+#accepted column names of CSV inventories, lower case
+_CSV_NAMES = ('name', 'card name', 'card', 'cardname')
+_CSV_NUMBERS = ('number', 'count', 'quantity', 'qty', 'amount')
+
+def _iter_csv(filename):
+    """Parse CSV inventories with a header row, e.g. exported collections. 
+    The card name is in a column called name, card name or card and the 
+    number of copies in one called number, count, quantity, qty or amount
+    (any case). Without a number column, each row is one copy."""
+    import csv
+    with open(filename, encoding = 'UTF-8', newline = '') as f:
+        reader = csv.reader(f)
+        header = [column.strip().lower() for column in next(reader, [])]
+        name_column = next((header.index(name) for name in _CSV_NAMES if name in header), None)
+        if name_column is None:
+            raise ValueError('%s has no card name column (%s)' % (filename, ', '.join(_CSV_NAMES)))
+        number_column = next((header.index(name) for name in _CSV_NUMBERS if name in header), None)
+        for row in reader:
+            if len(row) <= name_column or not row[name_column].strip():
+                continue
+            number = row[number_column].strip() if number_column is not None else ''
+            yield Card(row[name_column].strip(), int(number or 1))
+
+#file extension:function yielding the Cards of the file, as they are parsed
+CARD_READERS = {'.cod': _iter_cod,
+                '.dec': _iter_text,
+                '.txt': _iter_text,
+                '.csv': _iter_csv}
+
+def iter_cards(filename):
+    """Yield the Cards of a deck or collection file as they are parsed, 
+    without merging duplicates. The format is chosen by file extension (see 
+    CARD_READERS)."""
     
-def get_cardlist_from_filename(filename) -> CardList:
-    """ Returns pandas database with parsed filename
-    File should contain list of cards with number and card names
-    """
     _, file_extension = os.path.splitext(filename)
-    if file_extension == '.cod':
-        cardlist = _parse_cod(filename)
-        
-        return(cardlist)
-    else:
+    if file_extension.lower() not in CARD_READERS:
         raise NameError('Unknown filetype')
+    return CARD_READERS[file_extension.lower()](filename)
+
+def merge_cards(cards) -> CardList:
+    """CardList of cards (an iterable of Card), with the copies of cards of 
+    the same normalised name (see webscrape.normalise_cardname) added up 
+    under the first spelling seen"""
+    
+    merged = {}
+    for card in cards:
+        key = ws.normalise_cardname(card.name)
+        if key in merged:
+            merged[key][1] += card.number
+        else:
+            merged[key] = [card.name, card.number]
+    return CardList({'Name': [name for name, _ in merged.values()], 
+                     'Number': [number for _, number in merged.values()]})
+    
+def get_cardlist_from_filename(filename) -> CardList:
+    """ Returns CardList of the cards in filename (.cod, .dec, .txt or .csv,
+    see iter_cards), with duplicates across zones merged (see merge_cards)
+    """
+    
+    return merge_cards(iter_cards(filename))
+
+#site:function scraping the site's rows (see webscrape.HEADERS) of a card
+SITES = {'lm': ws.get_lm_rows, 
+         'mm': ws.get_mm_rows}
 
-def get_suppliers(cardname):
+def get_suppliers(cardname, sessions = None, cache = None):
+    """get SuppliersOfCard of cardname from all sites. 
+    sessions is an optional dict site:requests.Session (see SITES), 
+    cache an optional SupplierCache to serve and store the tables."""
+    import pandas as pd
     
-    db1 = ws.get_lm_suppliers(cardname)
-    db2 = ws.get_mm_suppliers(cardname)
-    db = pd.concat([db1, db2]).reset_index(drop = True)
+    sessions = sessions or {}
+    rows = []
+    for site, scrape in SITES.items():
+        if cache is None:
+            rows.extend(scrape(cardname, sessions.get(site)))
+        else:
+            fetch = lambda: pd.DataFrame(scrape(cardname, sessions.get(site)), columns = ws.HEADERS)
+            rows.extend(cache.fetch(site, cardname, fetch).itertuples(index = False, name = None))
+    #one table of all sites
+    db = pd.DataFrame(rows, columns = ws.HEADERS)
     print('%d sellers found for: '%len(db) + cardname)
     return SuppliersOfCard(db, cardname)
     
 
-def get_suppliers_from_cardlist(cardlist: CardList) -> dict:
-    """turn a cardlist into a dictionary cardname:SuppliersOfCard"""
+def get_suppliers_from_cardlist(cardlist: CardList, max_workers = 1, max_connections = 4, 
+                                cache = None) -> dict:
+    """turn a cardlist into a dictionary cardname:SuppliersOfCard
+    
+    Parameters
+    ----------
+    cardlist : CardList
+        cards to look up.
+    max_workers : int, optional
+        number of cards fetched concurrently. The default is 1.
+    max_connections : int, optional
+        maximum number of concurrent connections per site. The default is 4.
+    cache : SupplierCache, optional
+        persistent cache of supplier tables. The default is None.
+
+    Returns
+    -------
+    dict
+        cardname:SuppliersOfCard, in the order of cardlist.
+
+    """
     
     num_cards = len(cardlist)
+    cardnames = [card.name for card in cardlist]
+    #one keep-alive session per site
+    sessions = {site: ws.get_session(max_connections) for site in SITES}
     suppliers_allcards = {}
-    for i, card in enumerate(cardlist):
-        print('(%d/%d) '%(i+1,num_cards), end = '')
-        suppliers_allcards[card.name] = get_suppliers(card.name)
+    if max_workers <= 1:
+        for i, cardname in enumerate(cardnames):
+            print('(%d/%d) '%(i+1,num_cards), end = '')
+            suppliers_allcards[cardname] = get_suppliers(cardname, sessions, cache)
+        return suppliers_allcards
+    
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(get_suppliers, cardname, sessions, cache) for cardname in cardnames]
+        #collect in deck order
+        for cardname, future in zip(cardnames, futures):
+            suppliers_allcards[cardname] = future.result()
     return suppliers_allcards
 
-def get_dict_of_all_ensembles(cardlist: CardList, suppliers_allcards_dict: dict) -> dict:
+def get_suppliers_from_cards(cards, max_workers = 8, max_connections = 4, cache = None):
+    """look up the suppliers of cards while they are still being read, e.g. 
+    from iter_cards: each new card is queued for fetching as soon as it 
+    arrives, and further copies of a card already seen (by normalised name) 
+    are added to it without fetching it again.
+
+    Parameters
+    ----------
+    cards : iterable
+        Cards to look up.
+    max_workers : int, optional
+        number of cards fetched concurrently. The default is 8.
+    max_connections : int, optional
+        maximum number of concurrent connections per site. The default is 4.
+    cache : SupplierCache, optional
+        persistent cache of supplier tables. The default is None.
+
+    Returns
+    -------
+    CardList
+        the cards, merged as merge_cards does.
+    dict
+        cardname:SuppliersOfCard, in the order of the CardList.
+
+    """
+    
+    sessions = {site: ws.get_session(max_connections) for site in SITES}
+    futures = {} #normalised name:fetch of the first spelling seen
+    with ThreadPoolExecutor(max(max_workers, 1)) as executor:
+        def fetch_new(cards):
+            """pass cards on to merge_cards, queueing each new card for fetching"""
+            for card in cards:
+                key = ws.normalise_cardname(card.name)
+                if key not in futures:
+                    futures[key] = executor.submit(get_suppliers, card.name, sessions, cache)
+                yield card
+        cardlist = merge_cards(fetch_new(cards))
+        #merge_cards keeps the first spelling of each card, in order
+        suppliers_allcards = {card.name: future.result() for card, future in zip(cardlist, futures.values())}
+    return cardlist, suppliers_allcards
+
+def get_suppliers_from_filename(filename, max_workers = 8, max_connections = 4, cache = None):
+    """CardList of the cards in filename and their suppliers, fetched while
+    the file is parsed (see get_suppliers_from_cards)"""
+    
+    return get_suppliers_from_cards(iter_cards(filename), max_workers, max_connections, cache)
+
+def prune_suppliers(cardlist: CardList, suppliers_allcards_dict: dict, shipping_cost = 1, shipping = None):
+    """Remove listings and sellers that are never needed for a cheapest order.
+    
+    A listing is removed if none of its copies can be bought, see 
+    SuppliersOfCard._get_copies: the seller has enough cheaper copies of the 
+    card (e.g. a dearer foil), or it costs more than shipping_cost above the
+    cheapest copies on offer. If shipping is free over some order value, 
+    dearer copies of a seller are kept, as they may reach it.
+    A seller B is removed if another seller A offers every card that B does, 
+    each in the required number at no more than B's cheapest price for it, 
+    and A's shipping costs no more than B's. Buying from A instead of B then
+    never costs more. Of sellers that dominate each other, the first is kept.
+    Sellers are only removed if shipping does not depend on the order's size.
+
+    Parameters
+    ----------
+    cardlist : CardList
+        contains cardnames and numbers required. 
+    suppliers_allcards : dict
+        dictionary of cardname:SuppliersOfCard.
+    shipping_cost : float, optional
+        highest shipping cost of a supplier. The default is 1.
+    shipping : ShippingModel, optional
+        shipping rules, instead of shipping_cost. The default is None.
+
+    Returns
+    -------
+    dict
+        cardname:SuppliersOfCard with the remaining listings.
+    dict
+        report of the number of listings and sellers before and after, and 
+        the names of the removed sellers.
+
+    """
+    
+    if shipping is not None:
+        shipping_cost = shipping.price_window
+    #listings of which copies may be bought
+    copies = {}
+    for card in cardlist:
+        copies[card.name] = suppliers_allcards_dict[card.name]._get_copies(
+            card.number, shipping_cost, per_seller = shipping is None or not shipping.has_free_over)
+    
+    #for each seller, cardname:[cheapest price, price of num_cards-th cheapest copy]
+    offers = {}
+    for card in cardlist:
+        num_copies = {}
+        for price, _, seller in copies[card.name]:
+            num_copies[seller] = num_copies.get(seller, 0) + 1
+            offer = offers.setdefault(seller, {}).setdefault(card.name, [price, np.inf])
+            if num_copies[seller] == card.number:
+                offer[1] = price
+    
+    order = {seller: i for i, seller in enumerate(offers)}
+    #base shipping cost of each seller
+    base = dict.fromkeys(offers, 0)
+    if shipping is not None:
+        for card in cardlist:
+            suppliers = suppliers_allcards_dict[card.name]
+            for _, idx, seller in copies[card.name]:
+                base[seller] = shipping.get_rule(seller, suppliers.supplier_db['URL'].iat[idx])['base']
+    def dominates(a, b):
+        if a == b or not offers[b].keys() <= offers[a].keys() or base[a] > base[b]:
+            return False
+        prices = [(offers[a][name][1], offers[b][name][0]) for name in offers[b]]
+        if any(nth_a > lowest_b for nth_a, lowest_b in prices):
+            return False
+        return any(nth_a < lowest_b for nth_a, lowest_b in prices) or base[a] < base[b] or order[a] < order[b]
+    
+    dominated = set()
+    for b in offers if shipping is None or shipping.flat else []:
+        name = next(iter(offers[b]))
+        candidates = {seller for _, _, seller in copies[name]}
+        if any(dominates(a, b) for a in candidates):
+            dominated.add(b)
+    
+    pruned = {}
+    for card in cardlist:
+        suppliers = suppliers_allcards_dict[card.name]
+        rows = sorted({idx for _, idx, seller in copies[card.name] if seller not in dominated})
+        supplier_db = suppliers.supplier_db.iloc[rows].reset_index(drop = True)
+        pruned[card.name] = SuppliersOfCard(supplier_db, card.name)
+    
+    report = {'listings_before': sum(len(suppliers_allcards_dict[card.name].supplier_db) for card in cardlist),
+              'listings_after': sum(len(pruned[card.name].supplier_db) for card in cardlist),
+              'sellers_before': len({seller for card in cardlist 
+                                     for seller in suppliers_allcards_dict[card.name].sellers}),
+              'sellers_after': len(set(offers) - dominated),
+              'dominated_sellers': sorted(dominated)}
+    return pruned, report
+
+def get_dict_of_all_ensembles(cardlist: CardList, suppliers_allcards_dict: dict, shipping_cost = 1,
+                              lazy = True) -> dict:
     """for each card, calculate all possible arrangements required cards be bought. 
     
 
@@ -269,19 +1233,27 @@ def get_dict_of_all_ensembles(cardlist: CardList, suppliers_allcards_dict: dict)
         contains cardnames and numbers required. 
     suppliers_allcards : dict
         dictionary of cardname:SuppliersOfCard.
+    shipping_cost : float, optional
+        highest shipping cost of a supplier, see SuppliersOfCard.get_all_configurations.
+    lazy : bool, optional
+        return a ConfigurationSpace per card instead of a list of tuples. The 
+        default is True.
         
 
     Returns
     -------
     dict
-        cardname: list of tuples of all possible buying combinations.
+        cardname: sequence of tuples of all possible buying combinations.
 
     """
     all_ensembles_dict = {}
     
     for card in cardlist:
         suppliers = suppliers_allcards_dict[card.name]
-        configs = suppliers.get_all_configurations(card.number)
+        if lazy:
+            configs = suppliers.get_configuration_space(card.number, shipping_cost)
+        else:
+            configs = suppliers.get_all_configurations(card.number, shipping_cost)
         all_ensembles_dict[card.name] = configs
         
     return all_ensembles_dict
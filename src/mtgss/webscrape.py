@@ -4,12 +4,64 @@
 Created on Wed Jan  6 12:39:08 2021
 
 @author: Thore
+
+pandas, requests and lxml are imported by the functions that use them, so 
+that importing this module is fast.
 """
-import pandas as pd
-import requests
-import lxml.html as lh
+import functools
 import re
 
+LM_URL_BASE = "https://lilianamarket.co.uk/magic-cards/"
+MM_URL_BASE = "https://www.magicmadhouse.co.uk/search/"
+TIMEOUT = 10 #seconds to wait for a server response
+#columns of supplier tables
+HEADERS = ['Seller', 
+           'Language', 
+           'URL', 
+           'Condition',
+           'Card type', 
+           'Price', 
+           '# in stock']
+
+def normalise_cardname(cardname) -> str:
+    """lower case card name with whitespace collapsed, for use as key"""
+    
+    return ' '.join(cardname.lower().split())
+
+def get_session(max_connections = 4, retries = 3, backoff_factor = 0.5) -> 'requests.Session':
+    """Create a keep-alive session for requests to one site.
+
+    Parameters
+    ----------
+    max_connections : int, optional
+        maximum number of concurrent connections to the site. Further requests
+        block until a connection is free. The default is 4.
+    retries : int, optional
+        number of retries of failed requests. The default is 3.
+    backoff_factor : float, optional
+        retry n waits backoff_factor * 2**(n-1) seconds. The default is 0.5.
+
+    Returns
+    -------
+    session : requests.Session
+
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    retry = Retry(total = retries, 
+                  backoff_factor = backoff_factor,
+                  status_forcelist = (429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections = 1, 
+                          pool_maxsize = max_connections, 
+                          pool_block = True, 
+                          max_retries = retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 def _get_url(base_url, cardname) -> str:
     """
     Parameters
@@ -33,127 +85,135 @@ def _get_url(base_url, cardname) -> str:
     url = base_url + cardname_clean
     return url
 
-def get_mm_suppliers(cardname) -> pd.DataFrame:
-    """Finds all offers on magicmadhouse.co.uk of cardname.
+#queries of the supplier pages, compiled on first use (see _xpath)
+_MM_PRODUCTS = "//div[starts-with(@class,'product p')]"
+_MM_LINKS = ".//a[starts-with(@href,'/magic-the-gathering')]"
+_MM_PRICE = ".//span[@class='GBP']/text()"
+_MM_STOCK = ".//span[starts-with(@class,'stock-message ')]/text()"
+_LM_ROWS = '//tr'
+_DIGITS = re.compile('[0-9]+')
 
-    Returns
-    -------
-    Pandas DataFrame of sellers, with seller_name,Language,
-    Foil/NotFoil,Price,num in stock
+@functools.lru_cache(maxsize = None)
+def _xpath(query):
+    """compiled XPath query"""
+    
+    from lxml import etree
+    return etree.XPath(query)
 
-    """
-    url_base = "https://www.magicmadhouse.co.uk/search/"
-    url = _get_url(url_base, cardname)
+def parse_mm_page(content, cardname, url) -> list:
+    """Parse search results page of magicmadhouse.co.uk (page content at url)
+    into a row (see HEADERS) per product of cardname in stock"""
+    import lxml.html as lh
     
-    #get website content
-    page = requests.get(url)
-    doc = lh.fromstring(page.content)
-    #all cards listed on homepage
-    tr_elements = doc.xpath("//div[starts-with(@class,'product p')]")
+    doc = lh.fromstring(content)
+    get_links, get_price, get_stock = _xpath(_MM_LINKS), _xpath(_MM_PRICE), _xpath(_MM_STOCK)
+    regular = cardname.lower()
+    foil = regular + ' (foil)'
     
-    headers = ['Seller', 
-           'Language', 
-           'URL', 
-           'Condition',
-           'Card type', 
-           'Price', 
-           '# in stock']
-    
-    data = []
-    for node in tr_elements:
-        try:
-            cardname_scraped = node.xpath(".//a[starts-with(@href,'/magic-the-gathering')]/@title")[1]
-            url_ = node.xpath(".//a[starts-with(@href,'/magic-the-gathering')]/@href")[1]
-        except IndexError:
+    rows = []
+    #all cards listed on homepage
+    for node in _xpath(_MM_PRODUCTS)(doc):
+        links = get_links(node)
+        titles = [a.get('title') for a in links if a.get('title') is not None]
+        if len(links) < 2 or len(titles) < 2:
             continue #not a magic card
-            
-        price = float(node.xpath(".//span[@class='GBP']/text()")[0][1:])
-        stock = node.xpath(".//span[starts-with(@class,'stock-message ')]/text()")[0]
-        stock = (''.join(re.findall('[1-9]', stock)))
- 
+        
         #check card type
-        if cardname_scraped.lower() == cardname.lower():
+        cardname_scraped = titles[1].lower()
+        if cardname_scraped == regular:
             cardtype = 'Regular'
-        elif cardname_scraped.lower() == (cardname.lower() + ' (foil)'):
+        elif cardname_scraped == foil:
             cardtype = 'Foil'
         else:
             continue #not the right card
         
         #check stock
-        try:
-            stock = int(stock)
-        except ValueError:
+        stock = _DIGITS.search(get_stock(node)[0])
+        if stock is None or int(stock.group()) == 0:
             continue #none in stock
-            
+        
         #correct card found
         #assume all cards are English
-        data.append(['www.MagicMadhouse', 
+        rows.append(('www.MagicMadhouse', 
                      'English', 
-                     url + url_[1:], 
+                     url + links[1].get('href')[1:], 
                      'Unknown',
                      cardtype,
-                     price, 
-                     stock])
-        
-    #turn into dataframe
-    supplier_db = pd.DataFrame(data, columns = headers)
-    return supplier_db
-        
-def get_lm_suppliers(cardname) -> pd.DataFrame:
-    """Finds all sellers on lilianamarket.co.uk of cardname.
+                     float(get_price(node)[0].strip()[1:]), 
+                     int(stock.group())))
+    return rows
 
-    Returns
-    -------
-    Pandas DataFrame of sellers, with seller_name,Language,Condition,
-    Foil/NotFoil,Price,num in stock
+def parse_lm_page(content) -> list:
+    """Parse card page of lilianamarket.co.uk into a row (see HEADERS) per
+    listing"""
+    import lxml.html as lh
+    
+    doc = lh.fromstring(content)
+    rows = []
+    #iterate through rows (first row is header, last the number of listings)
+    for listing in _xpath(_LM_ROWS)(doc)[1:-1]:
+        #get entries of each category in table row, without empty ones
+        entries = [entry for entry in (cell.text_content().strip() for cell in listing) if entry]
+        if len(entries) != 6:
+            continue #not a listing
+        seller, language, condition, cardtype, price, stock = entries
+        rows.append((seller, 
+                     language, 
+                     "https://lilianamarket.co.uk/" + seller, 
+                     condition, 
+                     cardtype, 
+                     float(price.replace('£', '')), 
+                     int(stock)))
+    return rows
 
-    """
-    url_base = "https://lilianamarket.co.uk/magic-cards/" 
-    url = _get_url(url_base, cardname)
+def get_mm_rows(cardname, session = None, timeout = TIMEOUT) -> list:
+    """Finds all offers on magicmadhouse.co.uk of cardname, as rows with the 
+    columns HEADERS. Uses session for the request if given (see get_session)."""
+    import requests
     
+    url = _get_url(MM_URL_BASE, cardname)
     #get website content
-    page = requests.get(url)
-    doc = lh.fromstring(page.content)
-    tr_elements = doc.xpath('//tr')
-
+    page = (session or requests).get(url, timeout = timeout)
+    return parse_mm_page(page.content, cardname, url)
 
+def get_lm_rows(cardname, session = None, timeout = TIMEOUT) -> list:
+    """Finds all sellers on lilianamarket.co.uk of cardname, as rows with the
+    columns HEADERS. Uses session for the request if given (see get_session)."""
+    import requests
+    
+    url = _get_url(LM_URL_BASE, cardname)
+    #get website content
+    page = (session or requests).get(url, timeout = timeout)
     #Check that page has been found
     try:
         page.raise_for_status()
     except requests.HTTPError:
         print('error with card: '+cardname)
         raise
-    
-    headers = ['Seller', 
-           'Language', 
-           'URL', 
-           'Condition',
-           'Card type', 
-           'Price', 
-           '# in stock']
-    
-    #Reach here if headers found, so at least one card is sold
-    #Fill table
-    data = []
-    #iterate through rows (first row is header)
-    try:
-        for listing in tr_elements[1:-1]:
-            #get entries of each category in table row
-            entries = [cat.text_content().strip() for cat in listing]
-            #remove empty strings
-            while '' in entries: entries.remove('') 
-            seller = entries[0]
-            url = "https://lilianamarket.co.uk/"+seller
-            entries.insert(2, url)
-            data.append(entries)
-    except IndexError: #No cards listed
-        pass
-    
-    #turn into dataframe
-    supplier_db = pd.DataFrame(data, columns = headers)
-    #change format of cost 
-    supplier_db['Price'] = supplier_db['Price'].replace({'£':''}, regex = True).astype(float)
-    #change format of num of cards
-    supplier_db['# in stock'] = supplier_db['# in stock'].astype(int)
-    return supplier_db
+    return parse_lm_page(page.content)
+
+def get_mm_suppliers(cardname, session = None, timeout = TIMEOUT) -> 'pd.DataFrame':
+    """Finds all offers on magicmadhouse.co.uk of cardname.
+    Uses session for the request if given (see get_session).
+
+    Returns
+    -------
+    Pandas DataFrame of sellers, with seller_name,Language,
+    Foil/NotFoil,Price,num in stock
 
+    """
+    import pandas as pd
+    return pd.DataFrame(get_mm_rows(cardname, session, timeout), columns = HEADERS)
+        
+def get_lm_suppliers(cardname, session = None, timeout = TIMEOUT) -> 'pd.DataFrame':
+    """Finds all sellers on lilianamarket.co.uk of cardname.
+    Uses session for the request if given (see get_session).
+
+    Returns
+    -------
+    Pandas DataFrame of sellers, with seller_name,Language,Condition,
+    Foil/NotFoil,Price,num in stock
+
+    """
+    import pandas as pd
+    return pd.DataFrame(get_lm_rows(cardname, session, timeout), columns = HEADERS)
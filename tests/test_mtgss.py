@@ -1,12 +1,23 @@
 # -*- coding: utf-8 -*-
 import pickle
 import pytest
-from mtgss.optimisation import GeneticAlgorithm as ga
+from mtgss.optimisation import GeneticAlgorithm as ga, IslandModel, LargeNeighbourhoodSearch, IntegerProgram
+import mtgss.optimisation as optimisation
 import mtgss.tools as t
+import mtgss.webscrape as ws
+from mtgss.cache import SupplierCache
+from mtgss.shipping import ShippingModel
+from mtgss import synthetic, progress, batch, checkpoint, cli
+from mtgss.mtgss import SupplierSelector
 import numpy as np
-from numpy.random import seed as npseed
+import pandas as pd
 from random import seed as rdseed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
 import os
+import json
+import subprocess
+import sys
 dirname = os.path.dirname(__file__)
 filename = os.path.join(dirname,'resources','objs.pkl')
 
@@ -39,6 +50,38 @@ def fitness_list():
         fitness_list = pickle.load(f)[3] 
     return fitness_list
 
+@pytest.fixture
+def stub_server(monkeypatch):
+    """local HTTP server serving the saved supplier pages in place of the sites"""
+    pages = {}
+    for site in ['lm', 'mm']:
+        with open(os.path.join(dirname, 'resources', site + '_page.html'), encoding = 'UTF-8') as f:
+            pages[site] = f.read()
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1' #keep-alive
+        
+        def do_GET(self):
+            _, site, cardname = self.path.split('/', 2)
+            body = pages[site].replace('CARDNAME', cardname.replace('-', ' ')).encode('UTF-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target = server.serve_forever, daemon = True).start()
+    url = 'http://127.0.0.1:%d/' % server.server_port
+    monkeypatch.setattr(ws, 'LM_URL_BASE', url + 'lm/')
+    monkeypatch.setattr(ws, 'MM_URL_BASE', url + 'mm/')
+    yield server
+    server.shutdown()
+    server.server_close()
+
 def test_cardlist_import(cardlist):
     """test reading of cards from file"""
     print(cardlist)
@@ -54,30 +97,711 @@ def test_findallcombinatoins(cardlist, suppliers_allcards, all_ensembles_dict):
     temp_var  = t.get_dict_of_all_ensembles(cardlist, suppliers_allcards)
     assert len(temp_var) == len(all_ensembles_dict)
     
-    for key in temp_var:
-        assert(len(temp_var[key]) == len(all_ensembles_dict[key]))
+    for card in cardlist:
+        configs = temp_var[card.name]
+        prices = suppliers_allcards[card.name].prices
+        card_cost = lambda configs: min(prices[list(c)].sum() for c in configs)
+        assert len(set(configs)) == len(configs)
+        assert all(len(c) == card.number for c in configs)
+        if all_ensembles_dict[card.name]:
+            #dominated configurations are pruned, cheapest one is kept
+            assert set(configs) <= set(all_ensembles_dict[card.name])
+            assert card_cost(configs) == pytest.approx(card_cost(all_ensembles_dict[card.name]))
+        elif suppliers_allcards[card.name].total_cards_on_offer >= card.number:
+            #high-stock cards are no longer dropped
+            assert 0 < len(configs) <= 10**5
+            assert card_cost(configs) == pytest.approx(np.sort(np.repeat(prices, 
+                list(suppliers_allcards[card.name].stock.values())))[:card.number].sum())
+        else:
+            assert len(configs) == 0
     
-def test_optimisation(suppliers_allcards, all_ensembles_dict, fitness_list):
+def test_optimisation(suppliers_allcards, all_ensembles_dict):
     #setup cost
     cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
     bounds = np.array(cost_calculator.ensemble_sizes) - 1
     cost_func = lambda p: sum(cost_calculator.get_cost(p))
-    #setup random seeds
-    npseed(1)
-    rdseed(1)
-
-    model = ga(cost_func, bounds, N=1000)
-    
-    fitness_list2 = [];
-    num_iterations = 10
-    for i in range(num_iterations):
-        #Update
-        f = next(model)
-        #get fitness values
-        fitness_list2.append(f[0])
-        #Output
-        print('\r(%d/%d) '%(i+1,num_iterations), end = '')
-        print('top ensemble fitness: %1.1f   '%f[0], end = '')
-            
 
-    assert(fitness_list2 ==  fitness_list)
\ No newline at end of file
+    fitness_lists = []
+    for run in range(2):
+        #seeded models are reproducible without global seeding
+        model = ga(cost_func, bounds, N=1000, random_state=1)
+        
+        fitness_list2 = [];
+        num_iterations = 10
+        for i in range(num_iterations):
+            #Update
+            f = next(model)
+            #get fitness values
+            fitness_list2.append(f[0])
+            #Output
+            print('\r(%d/%d) '%(i+1,num_iterations), end = '')
+            print('top ensemble fitness: %1.1f   '%f[0], end = '')
+        fitness_lists.append(fitness_list2)
+    
+    assert(fitness_lists[0] == fitness_lists[1])
+    #fittest individuals are carried over, so fitness never gets worse
+    assert(np.all(np.diff(fitness_lists[0]) <= 0))
+    assert(fitness_lists[0][-1] < fitness_lists[0][0])
+    assert(len(model.population) == 1000)
+    assert(np.all(model.population <= bounds) and np.all(model.population >= 0))
+
+def test_batch_cost(suppliers_allcards, all_ensembles_dict):
+    """batch costing agrees with costing each ensemble individually"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    rdseed(2)
+    population = np.array([cost_calculator.generate_arrangement() for i in range(200)])
+    
+    card_cost, shipping_cost = cost_calculator.get_cost_batch(population)
+    expected = np.array([cost_calculator.get_cost(p) for p in population])
+    
+    assert card_cost == pytest.approx(expected[:, 0])
+    assert np.array_equal(shipping_cost, expected[:, 1])
+    
+def test_optimisation_vectorised(suppliers_allcards, all_ensembles_dict):
+    """GA gives the same result with a batch cost function"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    cost_func = lambda p: sum(cost_calculator.get_cost(p))
+    batch_cost_func = lambda population: np.sum(cost_calculator.get_cost_batch(population), 0)
+    
+    fitness_lists = []
+    for f, vectorised in [(cost_func, False), (batch_cost_func, True)]:
+        model = ga(f, bounds, N=1000, vectorised=vectorised, random_state=1)
+        fitness_lists.append([next(model)[0] for i in range(10)])
+    
+    assert(fitness_lists[0] == pytest.approx(fitness_lists[1]))
+
+def test_concurrent_scrape(stub_server):
+    """concurrent fetching returns the same suppliers as serial fetching, in deck order"""
+    cardlist = t.CardList({'Name': ['Tempered Steel', 'Dispatch', 'Salvage Titan', 'Island'],
+                           'Number': [2, 4, 1, 7]})
+    serial = t.get_suppliers_from_cardlist(cardlist)
+    concurrent = t.get_suppliers_from_cardlist(cardlist, max_workers = 4, max_connections = 2)
+    
+    assert list(concurrent) == [card.name for card in cardlist]
+    for cardname in serial:
+        assert serial[cardname].supplier_db.equals(concurrent[cardname].supplier_db)
+        #4 on lilianamarket, 2 on magicmadhouse
+        assert len(concurrent[cardname].supplier_db) == 6
+
+def test_parse_pages():
+    """supplier pages parse into typed rows"""
+    pages = {}
+    for site in ['lm', 'mm']:
+        with open(os.path.join(dirname, 'resources', site + '_page.html'), 'rb') as f:
+            pages[site] = f.read().replace(b'CARDNAME', b'Tempered Steel')
+    
+    rows = ws.parse_lm_page(pages['lm'])
+    assert rows[0] == ('cleteh', 'English', 'https://lilianamarket.co.uk/cleteh', 'Near Mint', 'Regular', 0.25, 2)
+    assert [row[4] for row in rows] == ['Regular', 'Regular', 'Regular', 'Foil']
+    
+    rows = ws.parse_mm_page(pages['mm'], 'tempered steel', 'https://mm/search/')
+    #other card and out of stock product are left out
+    assert rows == [('www.MagicMadhouse', 'English', 'https://mm/search/magic-the-gathering-cardname', 
+                     'Unknown', 'Regular', 0.49, 3),
+                    ('www.MagicMadhouse', 'English', 'https://mm/search/magic-the-gathering-cardname-foil', 
+                     'Unknown', 'Foil', 1.99, 1)]
+    assert ws.parse_mm_page(pages['mm'].replace(b'3 In Stock', b'10 In Stock'), 'Tempered Steel', '')[0][-1] == 10
+    assert ws.parse_lm_page(b'<html><body><p>not found</p></body></html>') == []
+    
+def test_supplier_cache(stub_server, tmp_path, monkeypatch):
+    """cached supplier tables are served without touching the network"""
+    path = str(tmp_path / 'suppliers.sqlite')
+    cardlist = t.CardList({'Name': ['Tempered Steel', 'Salvage Titan'], 'Number': [2, 1]})
+    fetched = t.get_suppliers_from_cardlist(cardlist, cache = SupplierCache(path))
+    
+    def unreachable(cardname, session):
+        raise ConnectionError('network used')
+    monkeypatch.setattr(t, 'SITES', {'lm': unreachable, 'mm': unreachable})
+    
+    cache = SupplierCache(path)
+    assert len(cache) == 4
+    cached = t.get_suppliers_from_cardlist(cardlist, max_workers = 2, cache = cache)
+    for cardname in fetched:
+        assert fetched[cardname].supplier_db.equals(cached[cardname].supplier_db)
+    #card names are normalised
+    assert cache.get('lm', ' tempered  STEEL') is not None
+    #expired entries are re-fetched, except offline
+    assert cache.get('lm', 'Tempered Steel', max_age = -1) is None
+    with pytest.raises(ConnectionError):
+        t.get_suppliers('Tempered Steel', cache = SupplierCache(path, ttl = -1))
+    offline = SupplierCache(path, ttl = -1, offline = True)
+    assert len(t.get_suppliers('Tempered Steel', cache = offline).supplier_db) == 6
+    assert len(t.get_suppliers('Dispatch', cache = offline).supplier_db) == 0
+
+def test_integer_program(suppliers_allcards, all_ensembles_dict):
+    """exact solver finds a solution at least as good as the genetic algorithm"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    model = IntegerProgram(cost_calculator)
+    configurations = model.solve()
+    solution = model.get_solution()
+    
+    assert model.gap == pytest.approx(0)
+    assert sum(cost_calculator.get_cost(solution)) == pytest.approx(model.cost)
+    assert len(cost_calculator.decode_configurations(configurations)) == sum(len(c) for c in configurations)
+    
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    cost_func = lambda population: np.sum(cost_calculator.get_cost_batch(population), 0)
+    genetic = ga(cost_func, bounds, N=1000, vectorised=True, random_state=1)
+    for i in range(10):
+        next(genetic)
+    assert model.cost <= sum(cost_calculator.get_cost(genetic.get_solution())) + 1e-9
+
+def test_catalogue(suppliers_allcards):
+    """catalogue holds the supplier tables of all cards in a compact form"""
+    catalogue = t.Catalogue(suppliers_allcards)
+    
+    assert len(catalogue) == sum(len(s.prices) for s in suppliers_allcards.values())
+    for i, cardname in enumerate(catalogue.cardnames):
+        suppliers = suppliers_allcards[cardname]
+        rows = catalogue.get_listings(i)
+        assert np.array_equal(catalogue.prices[rows], suppliers.prices)
+        assert [catalogue.seller_names[s] for s in catalogue.seller_ids[rows]] == list(suppliers.sellers)
+        assert [catalogue.urls[u] for u in catalogue.url_ids[rows]] == list(suppliers.supplier_db['URL'])
+        assert np.all(catalogue.card_ids[rows] == i)
+        
+    assert len(pickle.dumps(catalogue)) < len(pickle.dumps(suppliers_allcards)) / 2
+
+def test_island_model(suppliers_allcards, all_ensembles_dict):
+    """islands evolve in parallel processes and exchange their fittest"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    
+    fitness_lists = []
+    for run in range(2):
+        model = IslandModel(cost_calculator.get_total_cost_batch, bounds, num_islands = 2, 
+                            migration_interval = 2, N = 300, vectorised = True, random_state = 1)
+        fitness_lists.append([next(model)[0] for i in range(6)])
+        solution = model.get_solution()
+        model.close()
+        
+    assert fitness_lists[0] == fitness_lists[1]
+    assert np.all(np.diff(fitness_lists[0]) <= 0)
+    assert sum(cost_calculator.get_cost(solution)) <= fitness_lists[0][-1] + 1e-9
+
+def test_incremental_cost(suppliers_allcards, all_ensembles_dict):
+    """incrementally updated costs agree with costing from scratch"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    cost = t.IncrementalCost(cost_calculator, max_changed = 1)
+    rng = np.random.default_rng(0)
+    
+    population = rng.integers(0, bounds + 1, (300, len(bounds)))
+    assert cost(population) == pytest.approx(cost_calculator.get_total_cost_batch(population))
+    #children: mutated copies of random parents
+    parents = rng.integers(0, 300, 300)
+    children = population[parents]
+    mutate = rng.random(children.shape) < 0.2
+    children[mutate] = rng.integers(0, bounds + 1, children.shape)[mutate]
+    assert cost.derive(parents, children) == pytest.approx(cost_calculator.get_total_cost_batch(children))
+    #single moves
+    for n in range(100):
+        k, i = rng.integers(300), rng.integers(len(bounds))
+        j = rng.integers(bounds[i] + 1)
+        before = cost.get_fitness()[k]
+        delta = cost.get_move_delta(k, i, j)
+        cost.move(k, i, j)
+        assert cost.get_fitness()[k] - before == pytest.approx(delta)
+    assert cost.get_fitness() == pytest.approx(cost_calculator.get_total_cost_batch(cost.population))
+    #unchanged individuals keep the state of their parent, without copying it
+    slots = cost.slots.copy()
+    cost.derive(np.arange(300), cost.population)
+    assert (cost.slots == slots).all()
+    
+    #genetic algorithm detects incremental cost functions
+    model = ga(t.IncrementalCost(cost_calculator), bounds, N=1000, random_state=1)
+    for i in range(10):
+        next(model)
+        assert model.fitness == pytest.approx(cost_calculator.get_total_cost_batch(model.population))
+
+def test_fitness_cache(suppliers_allcards, all_ensembles_dict):
+    """cached fitness values give the same result with fewer evaluations"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    
+    models = [ga(cost_calculator.get_total_cost_batch, bounds, N=1000, vectorised=True, 
+                 random_state=1, cache_size=cache_size) for cache_size in [0, 500]]
+    fitness_lists = [[next(model)[0] for i in range(10)] for model in models]
+    
+    assert fitness_lists[0] == fitness_lists[1]
+    assert models[0].cache_hits == 0 and len(models[0].cache) == 0
+    assert models[1].cache_hits > 0 and len(models[1].cache) == 500
+    assert models[1].cache_hits + models[1].cache_misses == models[0].num_evaluations
+    assert models[1].num_evaluations == models[1].cache_misses
+    #survivors are not re-evaluated
+    assert models[0].num_evaluations == 1000 + 10 * 900
+
+def test_synthetic():
+    """synthetic decks and catalogues are reproducible and can be optimised"""
+    cardlist = synthetic.generate_cardlist(10, random_state = 0)
+    suppliers_allcards = synthetic.generate_suppliers(cardlist, num_sellers = 20, sellers_per_card = 5, 
+                                                      random_state = 0)
+    again = synthetic.generate_suppliers(cardlist, num_sellers = 20, sellers_per_card = 5, random_state = 0)
+    
+    assert len(cardlist) == len(suppliers_allcards) == 10
+    for card in cardlist:
+        supplier_db = suppliers_allcards[card.name].supplier_db
+        assert supplier_db.equals(again[card.name].supplier_db)
+        assert len(supplier_db) == 5 and supplier_db['Seller'].is_unique
+        assert np.all(supplier_db['Price'] > 0) and np.all(supplier_db['# in stock'] >= 1)
+    
+    all_ensembles_dict = t.get_dict_of_all_ensembles(cardlist, suppliers_allcards)
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    program = IntegerProgram(cost_calculator)
+    program.solve()
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    model = ga(cost_calculator.get_total_cost_batch, bounds, N=500, vectorised=True, random_state=0)
+    fitness = [next(model)[0] for i in range(10)]
+    assert program.cost <= fitness[-1] + 1e-9
+
+def test_early_stopping(cardlist, suppliers_allcards, all_ensembles_dict):
+    """runs stop on stalled fitness, collapsed diversity and budgets"""
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                all_ensembles_dict = all_ensembles_dict)
+    
+    info = selector.run(200, stall_generations = 5, N = 300, random_state = 1)
+    assert info['stop_reason'] == 'stalled'
+    assert len(info['fitness']) == len(info['generation_times']) < 200
+    assert info['fitness'][-6] == info['fitness'][-1]
+    
+    info = selector.run(200, min_diversity = 1, N = 300, mutation_rate = 0, random_state = 1)
+    assert info['stop_reason'] == 'converged'
+    
+    info = selector.run(200, max_evaluations = 3000, N = 300, random_state = 1)
+    assert info['stop_reason'] == 'max_evaluations'
+    assert selector.model.num_evaluations == 300 + 10 * 270
+    
+    info = selector.run(10**6, time_limit = 0.5, N = 300, random_state = 1)
+    assert info['stop_reason'] == 'time_limit'
+    assert info['seconds'] < 1.5
+    assert selector.run(solver = 'milp')['stop_reason'] == 'optimal'
+
+def test_warm_start(cardlist, suppliers_allcards, all_ensembles_dict, monkeypatch):
+    """seeded populations contain the greedy arrangement, which is no worse than 
+    the cheapest cards, and seeded runs start from it"""
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    cheapest = cost_calculator.generate_min_card_cost_arrangement()
+    greedy = cost_calculator.generate_greedy_arrangement()
+    cost = lambda arrangement: cost_calculator.get_total_cost_batch(np.array([arrangement]))[0]
+    assert cost(greedy) <= cost(cheapest)
+    #no single card change improves greedy
+    for i, size in enumerate(cost_calculator.ensemble_sizes):
+        for j in range(size):
+            neighbour = greedy.copy()
+            neighbour[i] = j
+            assert cost(neighbour) >= cost(greedy) - 1e-9
+    
+    seeds = cost_calculator.generate_seed_population(50, random_state = 0)
+    assert seeds.shape == (50, len(cheapest))
+    assert (seeds[1] == greedy).all()
+    assert (seeds < np.array(cost_calculator.ensemble_sizes)).all()
+    
+    model = ga(cost_calculator.get_total_cost_batch, np.array(cost_calculator.ensemble_sizes) - 1,
+               N = 100, vectorised = True, seed = seeds, random_state = 0)
+    assert model.population.shape == (100, len(cheapest))
+    
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                all_ensembles_dict = all_ensembles_dict)
+    #seeding draws from a random state of its own, one per island
+    random_states = []
+    generate = t.CostCalculator.generate_seed_population
+    def record(self, num, random_state = None):
+        random_states.append(random_state)
+        return generate(self, num, random_state)
+    monkeypatch.setattr(t.CostCalculator, 'generate_seed_population', record)
+    info = selector.run(1, N = 100, random_state = 0)
+    assert info['fitness'][0] <= cost(greedy)
+    assert isinstance(random_states[0], np.random.SeedSequence) and random_states[0].spawn_key == (0,)
+    info = selector.run(1, solver = 'islands', num_islands = 2, N = 100, random_state = 0)
+    assert info['fitness'][0] <= cost(greedy)
+    assert len({random_state.spawn_key for random_state in random_states}) == 3
+
+def test_progress_sinks(cardlist, suppliers_allcards, all_ensembles_dict, tmp_path):
+    """each generation emits its statistics to the callback"""
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                all_ensembles_dict = all_ensembles_dict)
+    with progress.JSONLSink(tmp_path / 'run.jsonl') as jsonl, progress.CSVSink(tmp_path / 'run.csv') as csv:
+        events = []
+        def callback(stats):
+            events.append(stats)
+            jsonl(stats)
+            csv(stats)
+        info = selector.run(5, N = 100, cache_size = 1000, random_state = 0, callback = callback)
+    
+    assert events == info['stats']
+    assert [e['generation'] for e in events] == [1, 2, 3, 4, 5]
+    assert [e['best'] for e in events] == info['fitness']
+    for e in events:
+        assert e['best'] <= e['median']
+        assert len(e['diversity']) == len(selector.cost_calculator.ensemble_sizes)
+        assert e['evaluations'] == e['cache_misses']
+        phases = sum(e[key] for key in ('selection_time', 'crossover_time', 'mutation_time', 'evaluation_time'))
+        assert 0 < phases <= e['generation_time']
+    
+    lines = (tmp_path / 'run.jsonl').read_text().splitlines()
+    assert [json.loads(line) for line in lines] == events
+    rows = (tmp_path / 'run.csv').read_text().splitlines()
+    assert rows[0].split(',')[:3] == ['generation', 'best', 'median'] and len(rows) == 6
+    
+    progress.NullSink()(events[0])
+    info = selector.run(2, solver = 'islands', num_islands = 2, N = 100, random_state = 0, 
+                        callback = progress.NullSink())
+    assert info['stats'][-1]['evaluations'] == selector.model.num_evaluations
+
+def test_prune_suppliers(cardlist, suppliers_allcards):
+    """pruning removes dominated listings and sellers but keeps the optimum"""
+    columns = ['Seller', 'Language', 'URL', 'Condition', 'Edition', 'Price', '# in stock']
+    def suppliers(rows):
+        return t.SuppliersOfCard(pd.DataFrame([[seller, 'English', seller, 'NM', edition, price, num] 
+                                               for seller, edition, price, num in rows], columns = columns), '')
+    small = t.CardList({'Name': ['a', 'b'], 'Number': [2, 1]})
+    allcards = {'a': suppliers([('A', 'Regular', 0.5, 2), ('A', 'Foil', 2.0, 1), ('B', 'Regular', 0.6, 2),
+                                ('C', 'Regular', 5.0, 4)]),
+                'b': suppliers([('A', 'Regular', 1.0, 1), ('B', 'Regular', 0.1, 1)])}
+    pruned, report = t.prune_suppliers(small, allcards)
+    #foil of A never needed, C costs too much
+    assert list(pruned['a'].supplier_db['Edition']) == ['Regular', 'Regular']
+    assert report['listings_before'] == 6 and report['listings_after'] == 4
+    assert report['sellers_before'] == 3 and report['sellers_after'] == 2
+    #A is dearer than B for card b
+    assert report['dominated_sellers'] == []
+    allcards['b'] = suppliers([('A', 'Regular', 0.1, 1), ('B', 'Regular', 0.1, 1)])
+    pruned, report = t.prune_suppliers(small, allcards)
+    assert report['dominated_sellers'] == ['B']
+    assert list(pruned['b'].sellers) == ['A']
+    
+    pruned, report = t.prune_suppliers(cardlist, suppliers_allcards)
+    assert report['listings_after'] < report['listings_before']
+    costs = []
+    for d in (suppliers_allcards, pruned):
+        program = IntegerProgram(t.CostCalculator(d, t.get_dict_of_all_ensembles(cardlist, d)))
+        program.solve()
+        costs.append(program.cost)
+    assert costs[1] == pytest.approx(costs[0])
+    
+    #a dearer copy of the same seller is kept if it may reach free shipping
+    market = {'X': suppliers([('A', 'Regular', 0.5, 1), ('A', 'Foil', 5, 1)]), 
+              'Y': suppliers([('A', 'Regular', 16, 1)])}
+    selector = SupplierSelector('', cardlist = t.CardList({'Name': ['X', 'Y'], 'Number': [1, 1]}), 
+                                suppliers_allcards = market, shipping = {'default': {'base': 5, 'free_over': 20}})
+    assert selector.pruning_report['listings_after'] == 3
+    selector.run(solver = 'milp')
+    assert selector.model.cost == pytest.approx(21) and selector.model.gap == 0
+
+def test_batch(cardlist, suppliers_allcards, tmp_path):
+    """decks share card lookups and configurations, and each gets a CSV"""
+    decks = {'first': [card for card in cardlist][:5], 'second': [card for card in cardlist][3:]}
+    for name, cards in decks.items():
+        with open(tmp_path / (name + '.cod'), 'w') as f:
+            f.write('<cockatrice_deck version="1"><zone name="main">')
+            f.write(''.join('<card number="%d" name="%s"/>' % (card.number, card.name) for card in cards))
+            f.write('</zone></cockatrice_deck>')
+    
+    result = batch.run_batch(tmp_path, tmp_path / 'out', num_processes = 2, suppliers_allcards = suppliers_allcards,
+                             num_iterations = 3, N = 100, random_state = 0)
+    summary = result['summary']
+    assert summary['decks'] == 2
+    assert summary['unique_cards'] == summary['configuration_tables'] == len(cardlist)
+    assert set(os.listdir(tmp_path / 'out')) == {'first.csv', 'second.csv', 'summary.csv'}
+    for name, cards in decks.items():
+        solution = pd.read_csv(tmp_path / 'out' / (name + '.csv'))
+        #cards without enough copies on offer are left out
+        assert summary['per_deck'][name]['cards'] == sum(card.number for card in cards) >= len(solution) > 0
+        assert summary['per_deck'][name]['cost'] >= solution['cost'].sum()
+    
+    #in-process runs give the same results
+    serial = batch.run_batch(tmp_path, num_processes = 1, suppliers_allcards = suppliers_allcards,
+                             num_iterations = 3, N = 100, random_state = 0)
+    for name in decks:
+        assert serial['summary']['per_deck'][name]['cost'] == summary['per_deck'][name]['cost']
+    
+    #the integer program buys the foil copy to reach free shipping, which no ensemble holds
+    market = {'X': t.SuppliersOfCard(pd.DataFrame([['A', 'English', 'a', 'Near Mint', 'Regular', 0.5, 1],
+                                                   ['A', 'English', 'a', 'Near Mint', 'Foil', 5, 1]],
+                                                  columns = ws.HEADERS), 'X'),
+              'Y': t.SuppliersOfCard(pd.DataFrame([['A', 'English', 'a', 'Near Mint', 'Regular', 16, 1]],
+                                                  columns = ws.HEADERS), 'Y')}
+    os.makedirs(tmp_path / 'foil')
+    with open(tmp_path / 'foil' / 'foil.txt', 'w') as f:
+        f.write('X\nY\n')
+    result = batch.run_batch(tmp_path / 'foil', suppliers_allcards = market, num_processes = 1, solver = 'milp',
+                             shipping = {'default': {'base': 5, 'free_over': 20}})
+    assert result['summary']['per_deck']['foil']['cost'] == pytest.approx(21)
+    
+    #decks whose CSVs would overwrite each other are refused
+    (tmp_path / 'foil' / 'FOIL.dec').write_text('X\n')
+    with pytest.raises(ValueError):
+        batch.run_batch(tmp_path / 'foil', suppliers_allcards = market, num_processes = 1, solver = 'milp')
+    os.remove(tmp_path / 'foil' / 'FOIL.dec')
+    (tmp_path / 'foil' / 'summary.txt').write_text('X\n')
+    with pytest.raises(ValueError):
+        batch.run_batch(tmp_path / 'foil', suppliers_allcards = market, num_processes = 1, solver = 'milp')
+
+def test_configuration_space(cardlist, suppliers_allcards):
+    """lazy configuration spaces match the lists of configurations"""
+    for card in cardlist:
+        suppliers = suppliers_allcards[card.name]
+        space = suppliers.get_configuration_space(card.number)
+        configs = suppliers.get_all_configurations(card.number)
+        assert len(space) == len(configs)
+        if not configs:
+            continue
+        numbers = np.arange(len(space))
+        assert [tuple(c) for c in space.get_listings(numbers)] == configs
+        assert space.get_costs(numbers) == pytest.approx([suppliers.prices[list(c)].sum() for c in configs])
+        for i in [0, len(configs) // 2, len(configs) - 1]:
+            assert space[i] == configs[i] and space.index(configs[i]) == i
+        assert space[-1] == configs[-1] and space[1:3] == configs[1:3]
+    with pytest.raises(IndexError):
+        space[len(space)]
+    with pytest.raises(ValueError):
+        space.index((max(max(c) for c in configs) + 1,))
+    
+    #cost calculators built from either agree
+    lazy = t.CostCalculator(suppliers_allcards, t.get_dict_of_all_ensembles(cardlist, suppliers_allcards))
+    eager = t.CostCalculator(suppliers_allcards, t.get_dict_of_all_ensembles(cardlist, suppliers_allcards, lazy = False))
+    assert lazy.ensemble_sizes == eager.ensemble_sizes
+    for a, b in zip(lazy.config_listings, eager.config_listings):
+        assert (a == b).all()
+
+def test_shipping_model(tmp_path, capsys):
+    """shipping rules are looked up, compiled and costed consistently everywhere"""
+    config = {'default': {'base': 1.5, 'free_over': 6, 'tiers': [[4, 0.5], [8, 1.5]]},
+              'sites': {'example.com/seller1': {'base': 3, 'free_over': None}},
+              'sellers': {'seller3': {'base': 0.2}}}
+    with open(tmp_path / 'shipping.json', 'w') as f:
+        json.dump(config, f)
+    model = ShippingModel.from_config(str(tmp_path / 'shipping.json'))
+    assert model.get_rule('seller3')['base'] == 0.2 and model.get_rule('seller3')['free_over'] == 6
+    assert model.get_rule('seller1', 'https://www.example.com/seller1')['free_over'] is None
+    assert not model.flat and model.max_cost == 4.5 and model.price_window == 9
+    assert ShippingModel().flat and ShippingModel().price_window == 1
+    
+    compiled = model.compile(['seller0', 'seller1'], ['', 'https://www.example.com/seller1'])
+    costs = compiled([0, 0, 0, 0, 0, 1, 1, 2], [1, 1, 1, 5.99, 6, 50, 0, 9], [0, 1, 4, 9, 9, 9, 1, 1])
+    assert costs.tolist() == [0, 1.5, 2, 3, 0, 4.5, 3, 0]
+    
+    cardlist = synthetic.generate_cardlist(12, 4, random_state = 1)
+    suppliers_allcards = synthetic.generate_suppliers(cardlist, 30, 10, random_state = 1)
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards, shipping = config)
+    assert selector.pruning_report['dominated_sellers'] == []
+    selector.run(5, N = 200, random_state = 0)
+    assert isinstance(selector.model.f, t.IncrementalCost)
+    assert selector.model.fitness == pytest.approx(selector.cost_calculator.get_total_cost_batch(selector.model.population))
+    #a fitness cache is used instead of incremental costing
+    selector.run(5, N = 200, random_state = 0, cache_size = 1000)
+    assert not isinstance(selector.model.f, t.IncrementalCost) and selector.model.cache_hits > 0
+    with pytest.raises(ValueError):
+        ga(t.IncrementalCost(selector.cost_calculator), np.array(selector.cost_calculator.ensemble_sizes) - 1, 
+           cache_size = 10)
+    cc = selector.cost_calculator
+    bounds = np.array(cc.ensemble_sizes) - 1
+    population = np.random.default_rng(0).integers(0, bounds + 1, (100, len(bounds)))
+    
+    card_cost, shipping_cost = cc.get_cost_batch(population)
+    assert np.allclose(np.array([cc.get_cost(p) for p in population]), np.stack((card_cost, shipping_cost), 1))
+    for p, cost in zip(population[:10], card_cost + shipping_cost):
+        solution = cc.decode_arrangement(p)
+        assert solution['cost'].sum() + cc.get_shipping(solution).sum() == pytest.approx(cost)
+    incremental = t.IncrementalCost(cc)
+    incremental(population)
+    children = population[::-1].copy()
+    children[:, 0] = 0
+    assert np.allclose(incremental.derive(np.arange(100)[::-1], children), cc.get_total_cost_batch(children))
+    
+    selector.print_results()
+    solution = selector.solution
+    assert 'shipping cost = %1.1f' % cc.get_shipping(solution).sum() in capsys.readouterr().out
+    genetic_cost = cc.get_total_cost_batch(selector.model.get_solution()[None])[0]
+    
+    info = selector.run(solver = 'milp')
+    program = selector.model
+    assert info['stop_reason'] == 'optimal'
+    assert selector.solution['cost'].sum() + cc.get_shipping(selector.solution).sum() == pytest.approx(program.cost)
+    assert program.cost <= genetic_cost + 1e-9
+    
+    #free shipping over a subtotal, without tiers
+    config = {'default': {'base': 5, 'free_over': 20}}
+    compiled = ShippingModel.from_config(config).compile(['seller0', 'seller1'], ['', ''])
+    assert compiled([0, 0, 1, 1], [1, 0, 20, 3], [1, 0, 7, 9]).tolist() == [5, 0, 0, 5]
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards, shipping = config)
+    selector.run(solver = 'milp')
+    cc = selector.cost_calculator
+    assert selector.solution['cost'].sum() + cc.get_shipping(selector.solution).sum() == pytest.approx(selector.model.cost)
+    assert cc.get_shipping(selector.solution).sum() > 0
+
+def test_checkpoint(cardlist, suppliers_allcards, all_ensembles_dict, tmp_path):
+    """a run resumed from its checkpoint continues exactly as if uninterrupted"""
+    path = str(tmp_path / 'run.npz')
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                all_ensembles_dict = all_ensembles_dict)
+    #hyperparameters other than the defaults are saved and restored
+    parameters = {'mutation_rate': 0.2, 'survivor_fraction': 0.2, 'num_children': 3, 'beta': 0.2, 'cache_size': 50}
+    uninterrupted = selector.run(10, N = 100, random_state = 0, **parameters)
+    population = selector.model.population
+    
+    selector.run(4, N = 100, random_state = 0, checkpoint = path, checkpoint_interval = 3, **parameters)
+    saved = checkpoint.load_checkpoint(path)
+    assert int(saved['state']['generation']) == 4
+    assert saved['fingerprint'] == selector.cost_calculator.fingerprint()
+    assert saved['parameters'] == parameters
+    resumed = checkpoint.resume(path, 6)
+    assert resumed.model.generation == 10
+    assert resumed.model.get_parameters() == parameters
+    assert np.allclose(resumed.run_info['fitness'], uninterrupted['fitness'][4:])
+    assert (resumed.model.population == population).all()
+    assert int(checkpoint.load_checkpoint(path)['state']['generation']) == 10
+    
+    other = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                             all_ensembles_dict = all_ensembles_dict, shipping = {'default': {'base': 2}})
+    with pytest.raises(ValueError):
+        other.run(1, state = dict(saved['state'], fingerprint = saved['fingerprint']))
+
+def test_large_neighbourhood_search(cardlist, suppliers_allcards, all_ensembles_dict):
+    """the search keeps the cost of its arrangement up to date and never does
+    worse than the greedy arrangement it starts from"""
+    shipping = {'default': {'base': 1.5, 'free_over': 6, 'tiers': [[4, 0.5], [8, 1.5]]}}
+    synthetic_cardlist = synthetic.generate_cardlist(12, 4, random_state = 1)
+    synthetic_suppliers = synthetic.generate_suppliers(synthetic_cardlist, 30, 10, random_state = 1)
+    synthetic_ensembles = t.get_dict_of_all_ensembles(synthetic_cardlist, synthetic_suppliers, 9)
+    for suppliers, ensembles, shipping in ((suppliers_allcards, all_ensembles_dict, None), 
+                                           (suppliers_allcards, all_ensembles_dict, shipping),
+                                           (synthetic_suppliers, synthetic_ensembles, shipping)):
+        cost_calculator = t.CostCalculator(suppliers, ensembles, shipping)
+        cost = lambda arrangement: cost_calculator.get_total_cost_batch(np.array([arrangement]))[0]
+        greedy = cost(cost_calculator.generate_greedy_arrangement())
+        model = LargeNeighbourhoodSearch(cost_calculator, num_moves = 20, random_state = 0)
+        for i in range(5):
+            best, diversity = next(model)
+            assert model.cost == pytest.approx(cost(model.arrangement))
+        assert best == pytest.approx(cost(model.get_solution()))
+        assert best <= greedy + 1e-9
+        assert len(diversity) == len(cost_calculator.ensemble_sizes) and min(diversity) >= 1
+        assert model.stats['evaluations'] == 100
+    
+    selector = SupplierSelector('', cardlist = cardlist, suppliers_allcards = suppliers_allcards,
+                                all_ensembles_dict = all_ensembles_dict)
+    info = selector.run(5, solver = 'lns', random_state = 0)
+    assert len(info['fitness']) == 5 and info['fitness'][-1] <= info['fitness'][0]
+    assert len(selector.solution) > 0
+
+def test_adaptive_population(suppliers_allcards, all_ensembles_dict):
+    """population size and mutation rate follow the search space, single-option
+    genes stay fixed and a converged population shrinks"""
+    assert optimisation.get_population_size([]) == optimisation.get_population_size([0, 0]) == 20
+    assert optimisation.get_population_size([1000] * 100) == 8000
+    assert optimisation.get_population_size([4, 4]) == 25
+    assert optimisation.get_mutation_rate([0, 9, 0, 9, 9, 9]) == 0.5
+    assert optimisation.get_mutation_rate([9] * 40) == 0.05
+    
+    cost_calculator = t.CostCalculator(suppliers_allcards, all_ensembles_dict)
+    bounds = np.array(cost_calculator.ensemble_sizes) - 1
+    bounds[:2] = 0
+    model = ga(cost_calculator.get_total_cost_batch, bounds, vectorised = True, random_state = 0)
+    assert model.N == optimisation.get_population_size(bounds) and model.adaptive
+    assert model.mutation_rate == optimisation.get_mutation_rate(bounds)
+    #without mutation the population converges
+    model = ga(cost_calculator.get_total_cost_batch, bounds, mutation_rate = 0, vectorised = True, random_state = 0)
+    sizes = [next(model) and model.stats['population_size'] for i in range(30)]
+    assert (model.population[:, :2] == 0).all()
+    assert sizes[-1] < sizes[0] and sizes[-1] >= model.min_N
+    assert np.all(np.diff(sizes) <= 0)
+    
+    model = ga(cost_calculator.get_total_cost_batch, np.zeros(len(bounds), dtype = int), vectorised = True)
+    assert model.N == 20 and next(model)[0] == cost_calculator.get_total_cost_batch(model.population[:1])[0]
+    model = ga(cost_calculator.get_total_cost_batch, bounds, N = 100, vectorised = True, random_state = 0)
+    assert not model.adaptive
+    assert all(next(model) and model.stats['population_size'] == 100 for i in range(10))
+
+def test_startup():
+    """the package and its command line load without matplotlib, pandas, lxml,
+    scipy or requests"""
+    code = ('import sys, time; start = time.perf_counter(); import mtgss.mtgss, mtgss.batch, mtgss.cli; '
+            'print(time.perf_counter() - start); '
+            'print(",".join(m for m in ("matplotlib", "pandas", "lxml", "scipy", "requests") if m in sys.modules))')
+    seconds, loaded = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True,
+                                     check = True).stdout.splitlines()
+    assert loaded == ''
+    assert float(seconds) < 1
+    usage = subprocess.run([sys.executable, '-m', 'mtgss.cli', '--help'], capture_output = True, text = True,
+                           check = True).stdout
+    assert 'run' in usage and 'batch' in usage and 'resume' in usage
+
+def test_cli(stub_server, tmp_path):
+    """the run command optimises a deck and writes its solution"""
+    output = str(tmp_path / 'solution.csv')
+    cli.main(['run', os.path.join(dirname, 'resources', 'dec.cod'), output, '--iterations', '2', '--workers', '4'])
+    solution = pd.read_csv(output, index_col = 0)
+    assert list(solution.columns) == ['supplier', 'cardname', 'cost', 'url'] and len(solution) > 0
+    with pytest.raises(SystemExit):
+        cli.main(['run', '--solver', 'unknown'])
+
+def test_card_formats(stub_server, tmp_path):
+    """.dec, .txt and .csv lists read as the .cod deck, merging copies of the same card"""
+    cod = t.get_cardlist_from_filename(os.path.join(dirname, 'resources', 'dec.cod'))
+    expected = {card.name: card.number for card in cod}
+    
+    (tmp_path / 'deck.dec').write_text('// main\n' + 
+                                       ''.join('%d %s\n' % (card.number, card.name) for card in cod))
+    (tmp_path / 'deck.txt').write_text('Deck\n2 Sai, Master Thopterist (M19) 68\n2x Tempered Steel\n'
+                                       '7 Island\n7 Plains\n2 Loxodon Warhammer\n2 Mace of the Valiant\n'
+                                       '2 Dispatch\n\nSideboard\nSB: 2 dispatch\nSB:\nSalvage Titan\n'
+                                       "1 Inventors' Fair\n")
+    (tmp_path / 'deck.csv').write_text('Quantity,Name,Set\n' + 
+                                       ''.join('%d,"%s",XXX\n' % (card.number, card.name) for card in cod))
+    for extension in ['dec', 'txt', 'csv']:
+        cardlist = t.get_cardlist_from_filename(str(tmp_path / ('deck.' + extension)))
+        assert {card.name: card.number for card in cardlist} == expected
+    (tmp_path / 'deck.xls').write_text('')
+    with pytest.raises(NameError):
+        t.get_cardlist_from_filename(str(tmp_path / 'deck.xls'))
+    
+    #cards are looked up once each, while the list is read
+    cardlist, suppliers_allcards = t.get_suppliers_from_filename(str(tmp_path / 'deck.txt'), max_workers = 4)
+    assert [card.name for card in cardlist] == list(suppliers_allcards) == list(expected)
+    assert all(len(suppliers.supplier_db) > 0 for suppliers in suppliers_allcards.values())
+
+def test_joint(cardlist, suppliers_allcards, tmp_path):
+    """decks bought together share stock and shipping and are split back into manifests"""
+    def suppliers(cardname, listings):
+        supplier_db = pd.DataFrame([[seller, 'English', 'https://www.example.com/' + seller, 'Near Mint', 'Regular',
+                                     price, stock] for seller, price, stock in listings], columns = ws.HEADERS)
+        return t.SuppliersOfCard(supplier_db, cardname)
+    market = {'Bolt': suppliers('Bolt', [('seller0', 1, 2), ('seller1', 3, 10)]),
+              'Opt': suppliers('Opt', [('seller0', 1, 5), ('seller1', 1.5, 5)]),
+              'Tithe': suppliers('Tithe', [('seller1', 2, 1)])}
+    decks = {'first': t.CardList({'Name': ['Bolt', 'Tithe'], 'Number': [2, 1]}),
+             'second': t.CardList({'Name': ['bolt', 'Opt', 'Tithe'], 'Number': [2, 1, 1]})}
+    
+    merged = batch.merge_decks(decks, market)
+    assert [(card.name, card.number) for card in merged.cardlist] == [('Bolt', 4), ('Tithe', 1), ('Opt', 1)]
+    result = batch.run_joint(decks, market, solver = 'milp')
+    summary = result['summary']
+    #2 Bolt from each seller, shipping from both once
+    assert summary['cost'] == pytest.approx(2 * 1 + 2 * 3 + 1 + 2 + 2) and summary['shipping'] == 2
+    manifests = result['solutions']
+    assert sorted(manifests['first']['cardname']) == ['Bolt', 'Bolt', 'Tithe']
+    assert sorted(manifests['second']['cardname']) == ['Opt', 'bolt', 'bolt']
+    
+    #a deck called order would be overwritten by the joint order
+    os.makedirs(tmp_path / 'decks')
+    (tmp_path / 'decks' / 'order.txt').write_text('Bolt\n')
+    assert list(batch._read_decks(tmp_path / 'decks')) == ['order']
+    with pytest.raises(ValueError):
+        batch.run_batch(tmp_path / 'decks', tmp_path / 'out', suppliers_allcards = market, joint = True, solver = 'milp')
+    assert summary['per_deck']['second']['bought'] == 3 < summary['per_deck']['second']['cards']
+    assert sum(deck['cost'] for deck in summary['per_deck'].values()) == pytest.approx(summary['cost'])
+    assert sum(deck['shipping'] for deck in summary['per_deck'].values()) == pytest.approx(2)
+    
+    #from files, with the genetic algorithm
+    cards = [card for card in cardlist]
+    for name, deck_cards in {'first': cards[:5], 'second': cards[3:]}.items():
+        with open(tmp_path / (name + '.txt'), 'w') as f:
+            f.write(''.join('%d %s\n' % (card.number, card.name) for card in deck_cards))
+    result = batch.run_batch(tmp_path, tmp_path / 'out', suppliers_allcards = suppliers_allcards, joint = True,
+                             num_iterations = 3, N = 100, random_state = 0)
+    assert set(os.listdir(tmp_path / 'out')) == {'first.csv', 'second.csv', 'order.csv', 'summary.csv'}
+    order = pd.read_csv(tmp_path / 'out' / 'order.csv', index_col = 0)
+    manifests = pd.concat([pd.read_csv(tmp_path / 'out' / (name + '.csv'), index_col = 0) for name in decks])
+    assert len(order) == len(manifests) and order['cost'].sum() == pytest.approx(manifests['cost'].sum())
+    assert result['summary']['decks'] == 2 and result['summary']['unique_cards'] == len(cardlist)